@@ -0,0 +1,215 @@
+import os
+import argparse
+import datetime
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from finance_gpt import TOP_LEVEL_DIR, setup_logger
+from finance_gpt.scoring import DEFAULT_PARAMETERS, score_sentiments, select_stocks
+from finance_gpt.portfolio_manager import size_portfolio
+from finance_gpt.structures import PositionSide, get_symbol_registry
+
+logger = setup_logger(__name__)
+
+CACHE_DIR = os.path.join(TOP_LEVEL_DIR, "cache", "backtest")
+
+def load_sentiment_records(start: datetime.datetime, end: datetime.datetime, path: str = None) -> pd.DataFrame:
+    """Loads the sentiment records between start and end.
+    
+    Reads the local cache file if it exists, otherwise loads them from MongoDB and writes the cache.
+    """
+    if path is None:
+        path = os.path.join(CACHE_DIR, f"sentiments_{start:%Y%m%d}_{end:%Y%m%d}.csv.gz")
+        
+    if not os.path.exists(path):
+        from finance_gpt.mongodb import MongoDBWrapper
+        
+        logger.info(f"Loading sentiment records from {start} to {end} from MongoDB.")
+        records = MongoDBWrapper().get_sentiment_records(time_frame=end - start, until=end)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        records.to_csv(path, index=False)
+        
+    records = pd.read_csv(path)
+    records["timestamp"] = pd.to_datetime(records["timestamp"], utc=True)
+    return records
+
+def load_price_history(path: str, tickers: list[str] = None, start: datetime.date = None, end: datetime.date = None, download: bool = False) -> pd.DataFrame:
+    """Loads daily open prices, indexed by date with one column per ticker.
+    
+    Only reads the local csv file, unless download is set and the file does not exist yet.
+    """
+    if not os.path.exists(path):
+        if not download:
+            raise FileNotFoundError(f"No price history at {path}, pass download=True to fetch it.")
+        import yfinance as yf
+        
+        logger.info(f"Downloading open prices of {len(tickers)} tickers from {start} to {end}.")
+        prices = yf.download(tickers, start=start, end=end, progress=False)["Open"]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        prices.to_csv(path)
+        
+    prices = pd.read_csv(path, index_col=0, parse_dates=True)
+    prices.index = pd.DatetimeIndex(prices.index).tz_localize(None).normalize()
+    if tickers is not None:
+        prices = prices.reindex(columns=tickers)
+    return prices.sort_index()
+
+
+@dataclass
+class BacktestResult:
+    dates: pd.DatetimeIndex
+    tickers: list[str]
+    # signed amount of stocks per day and ticker, held from the open of the day to the next open
+    quantities: np.ndarray
+    pnl: np.ndarray
+    equity: np.ndarray
+    returns: np.ndarray
+    turnover: np.ndarray
+    drawdown: np.ndarray
+    
+    def summary(self) -> dict:
+        """Gets the key figures of the backtest."""
+        volatility = np.std(self.returns)
+        return {
+            "days": len(self.dates),
+            "total_return": float(self.equity[-1] / self.equity[0] - 1) if len(self.equity) > 0 else 0.0,
+            "sharpe": float(np.mean(self.returns) / volatility * np.sqrt(252)) if volatility > 0 else 0.0,
+            "max_drawdown": float(self.drawdown.min()) if len(self.drawdown) > 0 else 0.0,
+            "mean_turnover": float(self.turnover.mean()) if len(self.turnover) > 0 else 0.0,
+            "mean_positions": float((self.quantities != 0).sum(axis=1).mean()) if len(self.quantities) > 0 else 0.0,
+        }
+        
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "pnl": self.pnl,
+            "equity": self.equity,
+            "return": self.returns,
+            "turnover": self.turnover,
+            "drawdown": self.drawdown,
+        }, index=self.dates)
+
+
+class Backtest():
+    """Replays stored sentiments day by day through the scoring and sizing of the live policy.
+    
+    Every trading day the portfolio is chosen shortly before the open from the sentiments before
+    that moment and held until the next open. Positions are sized from a fixed capital, so they do
+    not depend on earlier results and P&L, turnover and drawdown are computed on whole arrays.
+    """
+    
+    def __init__(self, records: pd.DataFrame, prices: pd.DataFrame, parameters: dict = None, capital: float = 100000.0, decision_time: datetime.time = datetime.time(9, 25), timezone: str = "America/New_York") -> None:
+        self.parameters = {**DEFAULT_PARAMETERS, **(parameters or {})}
+        self.prices = prices
+        self.capital = capital
+        
+        # sort once, so the window of every day is a slice, and look up the symbol ids once,
+        # presorted records with ids (e.g. the mapped arrays of a sweep worker) are used without a copy
+        self.registry = get_symbol_registry()
+        if records["timestamp"].is_monotonic_increasing and "symbol_id" in records:
+            self.records = records
+        else:
+            self.records = records.sort_values("timestamp", kind="stable").reset_index(drop=True)
+            if "symbol_id" not in self.records:
+                self.records["symbol_id"] = self.registry.ids(self.records["ticker"])
+        self._timestamps = self.records["timestamp"].to_numpy(dtype="datetime64[ns]")
+        
+        # price column of every symbol id, -1 for symbols without prices
+        self._columns = np.full(len(self.registry), -1, dtype=np.int64)
+        column_ids = self.registry.ids(prices.columns)
+        self._columns[column_ids[column_ids >= 0]] = np.flatnonzero(column_ids >= 0)
+        
+        # moment of the decision on every day, in utc
+        decisions = pd.DatetimeIndex(prices.index + pd.Timedelta(hours=decision_time.hour, minutes=decision_time.minute))
+        self._decisions = decisions.tz_localize(timezone).tz_convert("UTC").tz_localize(None).to_numpy(dtype="datetime64[ns]")
+        
+    def target_quantities(self) -> np.ndarray:
+        """Gets the signed amount of stocks per day (rows) and ticker (columns)."""
+        price_matrix = self.prices.to_numpy(dtype=np.float64)
+        quantities = np.zeros_like(price_matrix)
+        
+        time_frame = np.timedelta64(int(self.parameters["time_frame_hours"] * 3600), "s")
+        starts = np.searchsorted(self._timestamps, self._decisions - time_frame, side="left")
+        ends = np.searchsorted(self._timestamps, self._decisions, side="left")
+        
+        for day, (start, end) in enumerate(zip(starts, ends)):
+            if start == end:
+                continue
+                
+            scores = score_sentiments(
+                self.records.iloc[start:end],
+                now=pd.Timestamp(self._decisions[day], tz="UTC"),
+                half_life_hours=self.parameters["half_life_hours"],
+                source_weights=self.parameters["source_weights"],
+                min_articles=self.parameters["min_articles"],
+            )
+            
+            # only stocks with a price can be traded
+            prices_today = price_matrix[day]
+            columns = self._columns[self.registry.ids(scores.index)]
+            tradable = (columns >= 0) & np.isfinite(prices_today[columns])
+            new_stocks = select_stocks(scores[tradable], self.parameters["amount_of_stocks"], self.parameters["threshold"])
+            
+            portfolio = size_portfolio(
+                new_stocks,
+                self.capital,
+                get_price=lambda symbol: prices_today[self._columns[self.registry.id(symbol)]],
+                is_shortable=lambda symbol: True,
+            )
+            for position in portfolio.positions:
+                sign = -1.0 if position.side == PositionSide.SHORT else 1.0
+                quantities[day, self._columns[self.registry.id(position.symbol)]] = sign * position.amount
+                
+        return quantities
+        
+    def run(self) -> BacktestResult:
+        quantities = self.target_quantities()
+        prices = self.prices.to_numpy(dtype=np.float64)
+        
+        # hold from this open to the next open, nothing is held after the last day
+        price_changes = np.nan_to_num(np.diff(prices, axis=0, append=prices[-1:]), nan=0.0)
+        pnl = (quantities * price_changes).sum(axis=1)
+        equity = self.capital + np.cumsum(pnl)
+        returns = pnl / self.capital
+        
+        # traded value relative to the capital
+        previous = np.vstack([np.zeros((1, quantities.shape[1])), quantities[:-1]])
+        turnover = (np.abs(quantities - previous) * np.nan_to_num(prices, nan=0.0)).sum(axis=1) / self.capital
+        
+        peaks = np.maximum.accumulate(np.concatenate([[self.capital], equity]))[1:]
+        drawdown = equity / peaks - 1
+        
+        return BacktestResult(
+            dates=self.prices.index,
+            tickers=list(self.prices.columns),
+            quantities=quantities,
+            pnl=pnl,
+            equity=equity,
+            returns=returns,
+            turnover=turnover,
+            drawdown=drawdown,
+        )
+
+
+if __name__ == "__main__":
+    from finance_gpt.utils import load_tickers
+    
+    parser = argparse.ArgumentParser(description="Backtest the policy on stored sentiments and a local price history.")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--end", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--prices", default=os.path.join(CACHE_DIR, "prices.csv"), help="csv of daily open prices, one column per ticker")
+    parser.add_argument("--records", default=None, help="csv of sentiment records, loaded from MongoDB if it does not exist")
+    parser.add_argument("--download", action="store_true", help="download the price history if the csv does not exist")
+    parser.add_argument("--capital", type=float, default=100000.0)
+    args = parser.parse_args()
+    
+    tickers = load_tickers()
+    start = datetime.datetime.combine(args.start, datetime.time(), tzinfo=datetime.timezone.utc)
+    end = datetime.datetime.combine(args.end, datetime.time(), tzinfo=datetime.timezone.utc)
+    
+    prices = load_price_history(args.prices, tickers=tickers, start=args.start, end=args.end, download=args.download)
+    prices = prices.loc[str(args.start):str(args.end)]
+    records = load_sentiment_records(start - datetime.timedelta(hours=DEFAULT_PARAMETERS["time_frame_hours"]), end, path=args.records)
+    
+    result = Backtest(records, prices, capital=args.capital).run()
+    print(result.to_frame())
+    print(result.summary())
@@ -0,0 +1,267 @@
+"""Offline benchmark of a sentiment cycle and a rebalance, against local stand-ins of all external services.
+
+    python -m finance_gpt.benchmark --articles 10000 --symbols 100
+"""
+# standard libraries
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import dataclass, field, asdict
+from typing import Callable
+# finance_gpt imports
+from finance_gpt import setup_logger
+from finance_gpt.utils import load_tickers, load_config
+from finance_gpt.fake_services import ServiceBehaviour, FakeNewsApi, FakeOpenAI, FakeAlpaca, FakeMongoClient, FakeTradeUpdatesServer, generate_news
+from finance_gpt.news_api import NewsApi
+from finance_gpt.gpt import GPT
+from finance_gpt.mongodb import MongoDBWrapper
+from finance_gpt.news_sentimenter import NewsSentimenter
+from finance_gpt.portfolio_manager import PortfolioManager
+from finance_gpt.policy import Policy
+from finance_gpt.metrics import ITEMS
+# third party imports
+from alpaca.trading.client import TradingClient
+from alpaca.trading.stream import TradingStream
+from alpaca.data.historical import StockHistoricalDataClient
+
+logger = setup_logger(__name__)
+
+SERVICES = ["news_api", "openai", "mongodb", "alpaca"]
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes everywhere else
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+@dataclass
+class StageResult:
+    name: str
+    wall_seconds: float
+    # service -> request, error and rate limit counts
+    requests: dict[str, dict]
+    peak_rss_mb: float
+    # peak of python allocations during the stage, only when tracing memory
+    peak_traced_mb: float = None
+    details: dict = field(default_factory=dict)
+
+
+class Benchmark():
+    """Runs the components of a trading day against fake services with the given behaviours.
+    
+    The news of the cycle are generated, the account starts with random positions in half of
+    the symbols, so that the rebalance opens, resizes, flips and closes positions.
+    """
+    
+    def __init__(self, articles: int = 10000, symbols: int = 100, behaviours: dict[str, ServiceBehaviour] = None, fill_delay: float = 0.05, seed: int = 0, trace_memory: bool = False, sentimenter_config: dict = None, policy_parameters: dict = None) -> None:
+        tickers = load_tickers()
+        if symbols > len(tickers):
+            raise ValueError(f"Only {len(tickers)} symbols are known, can not benchmark {symbols}.")
+        self.tickers = tickers[:symbols]
+        self.articles = articles
+        self.behaviours = behaviours if behaviours is not None else {}
+        self.fill_delay = fill_delay
+        self.seed = seed
+        self.trace_memory = trace_memory
+        self.sentimenter_config = sentimenter_config if sentimenter_config is not None else load_config().get("news_sentimenter", {})
+        self.policy_parameters = policy_parameters if policy_parameters is not None else {}
+        
+        self.services = {}
+        self.results = []
+        
+    def setup(self) -> None:
+        """Starts the fake services and wires the components to them, without injected errors."""
+        rng = random.Random(self.seed)
+        prices = {ticker: round(rng.uniform(10, 500), 2) for ticker in self.tickers}
+        positions = {ticker: rng.randint(1, 50) * rng.choice([1, 1, -1]) for ticker in rng.sample(self.tickers, len(self.tickers) // 2)}
+        
+        logger.info("Generating %s news of %s symbols.", self.articles, len(self.tickers))
+        news = generate_news(self.tickers, self.articles, seed=self.seed)
+        
+        self.trade_updates = FakeTradeUpdatesServer()
+        self.trade_updates.start()
+        self.services = {
+            "news_api": FakeNewsApi(news, behaviour=self.behaviours.get("news_api")),
+            "openai": FakeOpenAI(behaviour=self.behaviours.get("openai")),
+            "mongodb": FakeMongoClient(behaviour=self.behaviours.get("mongodb")),
+            "alpaca": FakeAlpaca(prices, positions=positions, fill_delay=self.fill_delay, trade_updates=self.trade_updates, behaviour=self.behaviours.get("alpaca")),
+        }
+        for service in self.services.values():
+            if hasattr(service, "start"):
+                service.start()
+                
+        # errors are only injected into the measured stages, the components can not start without their services
+        with ExitStack() as stack:
+            for service in self.services.values():
+                stack.enter_context(service.reliable())
+            self._wire()
+            
+    def _wire(self) -> None:
+        # news sentimenter
+        self.db = MongoDBWrapper(client=self.services["mongodb"])
+        news_api_config = load_config().get("news_api", {})
+        news_api = NewsApi(
+            max_workers=news_api_config.get("max_workers", 4),
+            max_retries=news_api_config.get("max_retries", 5),
+            backoff=news_api_config.get("backoff", 1.0),
+            api_key="benchmark",
+            url=f"{self.services['news_api'].url}/api/v1",
+        )
+        gpt = GPT(api_key="benchmark", base_url=f"{self.services['openai'].url}/v1")
+        self.sentimenter = NewsSentimenter(db=self.db, config=self.sentimenter_config, news_api=news_api, gpt=gpt)
+        
+        # portfolio manager and policy, the asset metadata is not shared with real runs
+        self._cache_dir = tempfile.TemporaryDirectory()
+        alpaca_url = self.services["alpaca"].url
+        pm_config = {**load_config().get("portfolio_manager", {}), "asset_cache_path": os.path.join(self._cache_dir.name, "assets.json")}
+        self.pm = PortfolioManager(
+            config=pm_config,
+            trading_client=TradingClient(api_key="benchmark", secret_key="benchmark", paper=True, url_override=alpaca_url),
+            data_client=StockHistoricalDataClient(api_key="benchmark", secret_key="benchmark", url_override=alpaca_url),
+            stream=TradingStream(api_key="benchmark", secret_key="benchmark", paper=True, url_override=self.trade_updates.url),
+        )
+        self.policy = Policy(name="benchmark", parameters=self.policy_parameters, db=self.db, pm=self.pm)
+        if not self.trade_updates.wait_for_listeners(1):
+            logger.warning("The order tracker does not listen to trade updates, fills are polled.")
+            
+    def teardown(self) -> None:
+        self.pm.order_tracker.stop()
+        for service in self.services.values():
+            if hasattr(service, "stop"):
+                service.stop()
+        self.trade_updates.stop()
+        self._cache_dir.cleanup()
+        
+    def measure(self, name: str, function: Callable[[], dict]) -> StageResult:
+        """Runs one stage, function returns the details of the result. A failing stage is reported with its error."""
+        for service in self.services.values():
+            service.reset_stats()
+        if self.trace_memory:
+            tracemalloc.start()
+            
+        start = time.perf_counter()
+        try:
+            details = function()
+        except Exception as e:
+            logger.exception("Stage %s failed.", name)
+            details = {"error": repr(e)}
+        wall_seconds = time.perf_counter() - start
+        
+        peak_traced_mb = None
+        if self.trace_memory:
+            peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            
+        result = StageResult(
+            name=name,
+            wall_seconds=wall_seconds,
+            requests={service_name: service.stats() for service_name, service in self.services.items()},
+            peak_rss_mb=peak_rss_mb(),
+            peak_traced_mb=peak_traced_mb,
+            details=details,
+        )
+        logger.info("Stage %s took %.2fs.", name, wall_seconds)
+        self.results.append(result)
+        return result
+        
+    def run(self) -> list[StageResult]:
+        """Runs a sentiment cycle, then selects and rebalances the portfolio."""
+        self.setup()
+        try:
+            self.measure("sentiment_cycle", self._sentiment_cycle)
+            portfolio = {}
+            self.measure("get_portfolio", lambda: self._get_portfolio(portfolio))
+            self.measure("rebalance", lambda: self._rebalance(portfolio))
+        finally:
+            self.teardown()
+        return self.results
+        
+    def _sentiment_cycle(self) -> dict:
+        stages = ["news_fetched", "news_new", "news_failed"]
+        before = {stage: ITEMS.value(stage=stage) for stage in stages}
+        asyncio.run(self.sentimenter.run_cycle())
+        
+        details = {stage: ITEMS.value(stage=stage) - before[stage] for stage in stages}
+        details["cache"] = self.sentimenter.pipeline.cache.stats()
+        return details
+        
+    def _get_portfolio(self, portfolio: dict) -> dict:
+        portfolio["new"] = self.policy.get_portfolio()
+        return {"positions": len(portfolio["new"])}
+        
+    def _rebalance(self, portfolio: dict) -> dict:
+        if "new" not in portfolio:
+            raise RuntimeError("There is no new portfolio, getting it failed.")
+        return self.pm.update(portfolio["new"]).summary()
+
+
+def format_results(results: list[StageResult]) -> str:
+    """Formats the results as a table, one row per stage."""
+    header = f"{'stage':<16}{'wall [s]':>10}" + "".join(f"{service:>10}" for service in SERVICES) + f"{'errors':>8}{'rss [MB]':>10}{'traced [MB]':>13}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        errors = sum(result.requests[service]["errors"] + result.requests[service]["rate_limited"] for service in SERVICES)
+        traced = f"{result.peak_traced_mb:.1f}" if result.peak_traced_mb is not None else "-"
+        lines.append(
+            f"{result.name:<16}{result.wall_seconds:>10.2f}"
+            + "".join(f"{result.requests[service]['requests']:>10}" for service in SERVICES)
+            + f"{errors:>8}{result.peak_rss_mb:>10.1f}{traced:>13}"
+        )
+    for result in results:
+        lines.append(f"{result.name}: {result.details}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description="Benchmark a sentiment cycle and a rebalance against local stand-ins of all external services.")
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per request of every service")
+    parser.add_argument("--openai-latency", type=float, default=0.05, help="seconds per request of the model")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds per request")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second of every service")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing requests of every service")
+    for service in SERVICES:
+        parser.add_argument(f"--{service.replace('_', '-')}-error-rate", type=float, default=None, help=f"share of failing requests of {service}, --error-rate by default")
+    parser.add_argument("--fill-delay", type=float, default=0.05, help="seconds until an order is filled")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="concurrent model requests, taken from config.json by default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="also trace the peak of python allocations, slows the run down")
+    parser.add_argument("--output", default=None, help="json file for the results")
+    args = parser.parse_args()
+    
+    behaviours = {}
+    for seed, service in enumerate(SERVICES, start=args.seed):
+        latency = args.openai_latency if service == "openai" else args.latency
+        error_rate = getattr(args, f"{service}_error_rate")
+        error_rate = error_rate if error_rate is not None else args.error_rate
+        behaviours[service] = ServiceBehaviour(latency=latency, jitter=args.jitter, rate_limit=args.rate_limit, error_rate=error_rate, seed=seed)
+        
+    sentimenter_config = load_config().get("news_sentimenter", {})
+    if args.max_concurrency is not None:
+        sentimenter_config = {**sentimenter_config, "max_concurrency": args.max_concurrency}
+        
+    benchmark = Benchmark(
+        articles=args.articles,
+        symbols=args.symbols,
+        behaviours=behaviours,
+        fill_delay=args.fill_delay,
+        seed=args.seed,
+        trace_memory=args.trace_memory,
+        sentimenter_config=sentimenter_config,
+    )
+    results = benchmark.run()
+    print(format_results(results))
+    
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"parameters": vars(args), "stages": [asdict(result) for result in results]}, f, indent=4, default=str)
@@ -0,0 +1,247 @@
+import re
+import zlib
+import hashlib
+import datetime
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+import numpy as np
+from finance_gpt import setup_logger
+
+logger = setup_logger(__name__)
+
+# words that do not change what a headline says about a stock
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "after", "as", "amid", "at", "by", "for", "from", "in", "into", "is", "are",
+    "its", "of", "on", "over", "to", "with", "while", "following",
+}
+
+# words that mean the same in a headline, mapped to one token
+SYNONYMS = {
+    **dict.fromkeys(["shares", "share", "stock", "stocks"], "stock"),
+    **dict.fromkeys([
+        "rise", "rises", "rising", "rose", "climb", "climbs", "climbed", "gain", "gains", "gained", "jump", "jumps",
+        "jumped", "rally", "rallies", "rallied", "surge", "surges", "surged", "soar", "soars", "soared", "advance",
+        "advances", "advanced", "higher", "up",
+    ], "up"),
+    **dict.fromkeys([
+        "fall", "falls", "fell", "drop", "drops", "dropped", "slide", "slides", "slid", "slip", "slips", "slipped",
+        "sink", "sinks", "sank", "decline", "declines", "declined", "tumble", "tumbles", "tumbled", "plunge",
+        "plunges", "plunged", "lower", "down",
+    ], "down"),
+    **dict.fromkeys(["strong", "solid", "robust", "record"], "strong"),
+    **dict.fromkeys(["weak", "soft", "disappointing"], "weak"),
+}
+
+# words that give a headline its direction, headlines of different directions are never duplicates
+POSITIVE_WORDS = {word for word, token in SYNONYMS.items() if token in ("up", "strong")} | {
+    "approve", "approves", "approved", "approval", "beat", "beats", "top", "tops", "topped", "raise", "raises",
+    "raised", "hike", "hikes", "hiked", "boost", "boosts", "boosted", "lift", "lifts", "lifted", "upgrade",
+    "upgrades", "upgraded", "win", "wins", "won", "outperform", "outperforms", "bullish",
+}
+NEGATIVE_WORDS = {word for word, token in SYNONYMS.items() if token in ("down", "weak")} | {
+    "reject", "rejects", "rejected", "rejection", "deny", "denies", "denied", "miss", "misses", "missed", "cut",
+    "cuts", "slash", "slashes", "slashed", "reduce", "reduces", "reduced", "downgrade", "downgrades", "downgraded",
+    "lose", "loses", "underperform", "underperforms", "bearish",
+}
+# "t" is what is left of n't after the normalization
+NEGATION_WORDS = {"not", "no", "never", "without", "neither", "nor", "fail", "fails", "failed", "t"}
+
+class MinHasher():
+    """Computes MinHash signatures over the word shingles (word pairs in order) of a headline.
+    
+    Stop words are dropped and synonyms mapped to one token, so that reworded headlines
+    ("shares rise" and "stock climbs") share their shingles.
+    """
+    
+    def __init__(self, num_perm: int = 128, shingle_size: int = 2, seed: int = 1) -> None:
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        
+        # random multiply-shift hash functions, arithmetic wraps around modulo 2**64
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        
+    @staticmethod
+    def normalize(title: str) -> str:
+        title = unicodedata.normalize("NFKC", title).lower()
+        title = re.sub(r"[^\w\s]", " ", title)
+        return " ".join(title.split())
+        
+    @staticmethod
+    def tokens(title: str) -> list[str]:
+        tokens = []
+        for word in MinHasher.normalize(title).split():
+            if word in STOP_WORDS:
+                continue
+            if word in SYNONYMS:
+                word = SYNONYMS[word]
+            elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+                # plural
+                word = word[:-1]
+            tokens.append(word)
+        return tokens
+        
+    @staticmethod
+    def polarity(title: str) -> tuple[frozenset, bool]:
+        """Gets the directions ("+" and "-") of a headline and whether it is negated."""
+        words = MinHasher.normalize(title).split()
+        directions = frozenset(
+            direction
+            for word in words
+            for direction, direction_words in (("+", POSITIVE_WORDS), ("-", NEGATIVE_WORDS))
+            if word in direction_words
+        )
+        negated = sum(word in NEGATION_WORDS for word in words) % 2 == 1
+        return directions, negated
+        
+    def shingles(self, title: str) -> set[str]:
+        tokens = self.tokens(title)
+        if len(tokens) <= self.shingle_size:
+            return {" ".join(tokens)}
+        return {" ".join(tokens[i:i + self.shingle_size]) for i in range(len(tokens) - self.shingle_size + 1)}
+        
+    def signature(self, title: str) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in self.shingles(title)), dtype=np.uint64)
+        # hash every shingle with every hash function and keep the minimum per function
+        permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return permuted.min(axis=0)
+        
+    @staticmethod
+    def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+        """Estimates the jaccard similarity of two signatures."""
+        return float(np.mean(signature == other))
+
+
+@dataclass(eq=False)
+class HeadlineSignature:
+    minhash: np.ndarray
+    # directions and negation, see MinHasher.polarity
+    polarity: tuple
+
+
+@dataclass(eq=False)
+class DuplicateEntry:
+    url: str
+    ticker: str
+    signature: HeadlineSignature
+    added: datetime.datetime
+    # sentiment and verdict, once the representative is sentimented
+    result: tuple = None
+    band_keys: list = field(default_factory=list)
+
+
+class NearDuplicateIndex():
+    """Rolling index of sentimented headlines per ticker, to find near duplicate headlines with LSH.
+    
+    Every entry is the representative of a cluster. A new headline is either matched to the most
+    similar representative of the same ticker and polarity, or added as a new representative.
+    """
+    
+    def __init__(self, threshold: float = 0.7, num_perm: int = 128, bands: int = 32, window: datetime.timedelta = datetime.timedelta(hours=24)) -> None:
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm {num_perm} is not divisible by bands {bands}.")
+            
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.window = window
+        self.hasher = MinHasher(num_perm=num_perm)
+        
+        self._buckets = {}
+        self._entries = deque()
+        
+    def __len__(self) -> int:
+        return len(self._entries)
+        
+    def find(self, title: str, ticker: str) -> tuple[DuplicateEntry, HeadlineSignature]:
+        """Returns the most similar representative of the ticker (or None) and the signature of the title."""
+        self.expire()
+        
+        signature = HeadlineSignature(minhash=self.hasher.signature(title), polarity=self.hasher.polarity(title))
+        
+        # collect candidates that share at least one band
+        candidates = {}
+        for band_key in self._band_keys(ticker, signature):
+            for entry in self._buckets.get(band_key, []):
+                candidates[id(entry)] = entry
+                
+        # verify the candidates with the estimated similarity
+        best, best_similarity = None, self.threshold
+        for entry in candidates.values():
+            similarity = self.hasher.similarity(signature.minhash, entry.signature.minhash)
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+                
+        return best, signature
+        
+    def add(self, url: str, ticker: str, signature: HeadlineSignature) -> DuplicateEntry:
+        """Adds a new representative to the index."""
+        entry = DuplicateEntry(url=url, ticker=ticker, signature=signature, added=datetime.datetime.now(datetime.timezone.utc))
+        entry.band_keys = self._band_keys(ticker, signature)
+        for band_key in entry.band_keys:
+            self._buckets.setdefault(band_key, []).append(entry)
+        self._entries.append(entry)
+        return entry
+        
+    def remove(self, entry: DuplicateEntry) -> None:
+        """Removes a representative, e.g. because sentimenting it failed."""
+        self._unlink(entry)
+        if entry in self._entries:
+            self._entries.remove(entry)
+            
+    def expire(self) -> None:
+        """Drops all representatives older than the window."""
+        oldest = datetime.datetime.now(datetime.timezone.utc) - self.window
+        while len(self._entries) > 0 and self._entries[0].added < oldest:
+            self._unlink(self._entries.popleft())
+            
+    def _unlink(self, entry: DuplicateEntry) -> None:
+        for band_key in entry.band_keys:
+            bucket = self._buckets.get(band_key, [])
+            if entry in bucket:
+                bucket.remove(entry)
+            if len(bucket) == 0:
+                self._buckets.pop(band_key, None)
+                
+    def _band_keys(self, ticker: str, signature: HeadlineSignature) -> list[tuple]:
+        # headlines of another polarity never share a bucket
+        minhash = signature.minhash
+        return [(ticker, signature.polarity, band, minhash[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+
+class BloomFilter():
+    """Fixed size bloom filter over strings, "not contained" answers are always correct."""
+    
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        
+        # optimal number of bits and hash functions for the capacity and error rate
+        self.num_bits = max(8, int(-capacity * np.log(error_rate) / np.log(2)**2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * np.log(2))))
+        self._bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        
+    def __contains__(self, item: str) -> bool:
+        positions = self._positions(item)
+        return bool(np.all(self._bits[positions >> 3] & (1 << (positions & 7)).astype(np.uint8)))
+        
+    def __len__(self) -> int:
+        return self.count
+        
+    def add(self, item: str) -> None:
+        positions = self._positions(item)
+        np.bitwise_or.at(self._bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        self.count += 1
+        
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+        
+    def _positions(self, item: str) -> np.ndarray:
+        # double hashing, k positions from two 64 bit hashes
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return np.array([(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)], dtype=np.int64)
@@ -0,0 +1,1025 @@
+"""Local stand-ins of external services, for tests, benchmarks and offline runs."""
+# standard libraries
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import datetime
+import threading
+import urllib.parse
+from types import SimpleNamespace
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# finance_gpt imports
+from finance_gpt import TOP_LEVEL_DIR, setup_logger
+from finance_gpt.news_api import NEWS_DATE_FORMAT, parse_news_date
+from finance_gpt.structures import Symbol
+# third party imports
+import pytz
+import websockets
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError
+
+logger = setup_logger(__name__)
+
+# recorded sample responses of the external services, the fakes answer in the same format
+PAYLOAD_DIR = os.path.join(TOP_LEVEL_DIR, "benchmarks", "payloads")
+
+def load_payload(name: str) -> dict:
+    """Loads a sample payload, e.g. "alpaca_account"."""
+    with open(os.path.join(PAYLOAD_DIR, f"{name}.json")) as f:
+        return json.load(f)
+
+def order_payload(order_id: str, symbol: str, qty: float, side: str, status: str = "new", filled_qty: float = 0.0, filled_avg_price: float = None) -> dict:
+    """Builds an order the way the Alpaca api returns it."""
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return {
+        "id": str(order_id),
+        "client_order_id": str(uuid.uuid4()),
+        "created_at": now,
+        "updated_at": now,
+        "submitted_at": now,
+        "filled_at": now if status == "filled" else None,
+        "asset_id": str(uuid.uuid5(uuid.NAMESPACE_DNS, symbol)),
+        "symbol": symbol,
+        "asset_class": "us_equity",
+        "qty": str(qty),
+        "filled_qty": str(filled_qty),
+        "filled_avg_price": None if filled_avg_price is None else str(filled_avg_price),
+        "order_class": "simple",
+        "order_type": "market",
+        "type": "market",
+        "side": side,
+        "time_in_force": "day",
+        "status": status,
+        "extended_hours": False,
+    }
+
+class FakeTradeUpdatesServer():
+    """Websocket server speaking the protocol of the Alpaca trade updates stream.
+    
+    Runs its own event loop in a background thread. Clients have to authenticate (any key is
+    accepted unless keys are given) and listen to trade_updates, then every published update
+    is sent to all of them.
+    """
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, keys: dict[str, str] = None) -> None:
+        self.host = host
+        self.port = port
+        self.keys = keys
+        
+        self._clients = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/stream"
+        
+    @property
+    def num_listeners(self) -> int:
+        return len(self._clients)
+        
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="fake-trade-updates", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+        
+    def publish(self, event: str, order: dict, price: float = None, qty: float = None, position_qty: float = None) -> None:
+        """Sends a trade update (e.g. event "fill" with an order_payload) to all listening clients."""
+        message = json.dumps({
+            "stream": "trade_updates",
+            "data": {
+                "event": event,
+                "order": order,
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "price": price,
+                "qty": qty,
+                "position_qty": position_qty,
+            },
+        })
+        asyncio.run_coroutine_threadsafe(self._broadcast(message), self._loop).result()
+        
+    def wait_for_listeners(self, count: int = 1, timeout: float = 10.0) -> bool:
+        """Waits until the given number of clients listens to trade updates."""
+        async def wait():
+            while len(self._clients) < count:
+                await asyncio.sleep(0.01)
+        try:
+            asyncio.run_coroutine_threadsafe(asyncio.wait_for(wait(), timeout), self._loop).result()
+            return True
+        except asyncio.TimeoutError:
+            return False
+            
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(websockets.serve(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        
+    async def _close(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+        
+    async def _broadcast(self, message: str) -> None:
+        for websocket in list(self._clients):
+            try:
+                await websocket.send(message)
+            except websockets.WebSocketException:
+                self._clients.discard(websocket)
+                
+    async def _handle(self, websocket, path: str = None) -> None:
+        try:
+            async for raw_message in websocket:
+                message = json.loads(raw_message)
+                action = message.get("action")
+                data = message.get("data", {})
+                
+                if action == "authenticate":
+                    authorized = self.keys is None or self.keys.get(data.get("key_id")) == data.get("secret_key")
+                    await websocket.send(json.dumps({"stream": "authorization", "data": {"action": "authenticate", "status": "authorized" if authorized else "unauthorized"}}))
+                    if not authorized:
+                        break
+                elif action == "listen":
+                    streams = [stream for stream in data.get("streams", []) if stream == "trade_updates"]
+                    if len(streams) > 0:
+                        self._clients.add(websocket)
+                    else:
+                        self._clients.discard(websocket)
+                    await websocket.send(json.dumps({"stream": "listening", "data": {"streams": streams}}))
+                else:
+                    logger.warning(f"Unknown action {action}.")
+        except websockets.WebSocketException:
+            pass
+        finally:
+            self._clients.discard(websocket)
+
+
+@dataclass
+class ServiceBehaviour:
+    """How a fake service answers.
+    
+    Every request takes latency plus up to jitter seconds, at most rate_limit requests per second
+    are answered (None for no limit) and a share of error_rate requests fails.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    rate_limit: float = None
+    error_rate: float = 0.0
+    seed: int = None
+
+
+class RateLimiter():
+    """Token bucket of rate requests per second, bursts of up to one second of requests are allowed."""
+    
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        
+    def try_acquire(self) -> bool:
+        """Takes a token if there is one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+            
+    def acquire(self) -> None:
+        """Waits for a token."""
+        while not self.try_acquire():
+            time.sleep(1 / self.rate)
+
+
+class FakeService():
+    """Latency, rate limit, errors and request counters shared by all fakes."""
+    
+    def __init__(self, behaviour: ServiceBehaviour = None) -> None:
+        self.behaviour = behaviour if behaviour is not None else ServiceBehaviour()
+        self._random = random.Random(self.behaviour.seed)
+        self._limiter = RateLimiter(self.behaviour.rate_limit) if self.behaviour.rate_limit is not None else None
+        self._stats_lock = threading.Lock()
+        # no errors are injected while set, see reliable
+        self._reliable = False
+        self.reset_stats()
+        
+    @contextmanager
+    def reliable(self):
+        """Answers every request without injected errors while inside, e.g. during the setup of a benchmark."""
+        self._reliable = True
+        try:
+            yield self
+        finally:
+            self._reliable = False
+        
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self.requests = Counter()
+            self.errors = Counter()
+            self.rate_limited = Counter()
+            
+    def stats(self) -> dict:
+        """Returns the number of requests, failed and rate limited ones in total and per endpoint."""
+        with self._stats_lock:
+            return {
+                "requests": sum(self.requests.values()),
+                "errors": sum(self.errors.values()),
+                "rate_limited": sum(self.rate_limited.values()),
+                "endpoints": dict(self.requests),
+            }
+            
+    def _admit(self, endpoint: str, throttle: bool = False) -> str:
+        """Applies the behaviour to one request, returns "rate_limited", "error" or None if it may be answered.
+        
+        With throttle, requests above the rate limit wait for their turn instead of being rejected.
+        """
+        with self._stats_lock:
+            self.requests[endpoint] += 1
+            
+        if self._limiter is not None:
+            if throttle:
+                self._limiter.acquire()
+            elif not self._limiter.try_acquire():
+                with self._stats_lock:
+                    self.rate_limited[endpoint] += 1
+                return "rate_limited"
+                
+        delay = self.behaviour.latency + self._random.uniform(0, self.behaviour.jitter)
+        if delay > 0:
+            time.sleep(delay)
+            
+        if not self._reliable and self.behaviour.error_rate > 0 and self._random.random() < self.behaviour.error_rate:
+            with self._stats_lock:
+                self.errors[endpoint] += 1
+            return "error"
+        return None
+
+
+class _FakeRequestHandler(BaseHTTPRequestHandler):
+    # keep connections open, like the real apis
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self) -> None:
+        self._respond("GET")
+        
+    def do_POST(self) -> None:
+        self._respond("POST")
+        
+    def do_DELETE(self) -> None:
+        self._respond("DELETE")
+        
+    def _respond(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length > 0 else b""
+        status, payload = self.server.service._dispatch(method, self.path, body)
+        
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        
+    def log_message(self, format: str, *args) -> None:
+        # requests are counted by the service, no access log
+        pass
+
+
+class FakeHttpService(FakeService):
+    """Json http server in a background thread, requests are routed to the handler methods of subclasses.
+    
+    Routes are (method, path pattern, handler name), the handler name is also the endpoint of the
+    request counters. Handlers get the query, the json body and the groups of the pattern and return
+    the status code and the json payload.
+    """
+    
+    routes = []
+    
+    def __init__(self, behaviour: ServiceBehaviour = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__(behaviour)
+        self.host = host
+        self.port = port
+        
+        self._server = None
+        self._thread = None
+        
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+        
+    def start(self) -> None:
+        self._server = ThreadingHTTPServer((self.host, self.port), _FakeRequestHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{type(self).__name__}", daemon=True)
+        self._thread.start()
+        
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        
+    def _dispatch(self, method: str, raw_path: str, body: bytes) -> tuple[int, object]:
+        url = urllib.parse.urlsplit(raw_path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if route_method != method or match is None:
+                continue
+                
+            failure = self._admit(name)
+            if failure == "rate_limited":
+                return 429, {"code": 42910000, "message": "rate limit exceeded"}
+            if failure == "error":
+                return 500, {"code": 50010000, "message": "internal server error"}
+                
+            try:
+                return getattr(self, name)(query, json.loads(body) if len(body) > 0 else None, *match.groups())
+            except Exception as e:
+                logger.exception("Fake %s failed to answer %s %s.", type(self).__name__, method, raw_path)
+                return 500, {"code": 50010000, "message": str(e)}
+                
+        return 404, {"code": 40410000, "message": f"no route for {method} {url.path}"}
+
+
+# building blocks of generated headlines
+HEADLINE_EVENTS = [
+    "shares rise after", "stock falls as", "jumps on", "slides after", "rallies as investors cheer",
+    "drops amid", "beats estimates on", "misses estimates as", "upgraded by analysts on", "downgraded after",
+    "surges following", "under pressure from",
+]
+HEADLINE_REASONS = [
+    "strong quarterly results", "weak guidance", "new product launch", "regulatory probe", "record cloud revenue",
+    "supply chain issues", "buyback announcement", "ceo departure", "ai partnership", "price target hike",
+    "antitrust lawsuit", "dividend increase", "layoffs", "data center demand", "margin pressure", "china sales",
+]
+
+def generate_news(tickers: list[str], count: int, seed: int = 0, duplicate_rate: float = 0.1, window: datetime.timedelta = datetime.timedelta(minutes=25), now: datetime.datetime = None) -> list[dict]:
+    """Generates news in the format of the sample page, newest first.
+    
+    Every article is about one of the tickers and mentions up to two others, dates are spread over
+    the window before now. A share of duplicate_rate articles repeats an earlier headline of the
+    same ticker under another url, like syndicated copies do.
+    """
+    rng = random.Random(seed)
+    template = load_payload("stocknewsapi_page")["data"][0]
+    now = now if now is not None else datetime.datetime.now(datetime.timezone.utc)
+    eastern = pytz.timezone("US/Eastern")
+    sources = sorted({article["source_name"] for article in load_payload("stocknewsapi_page")["data"]} | {"Benzinga", "Zacks Investment Research", "Seeking Alpha"})
+    
+    headlines = {ticker: [] for ticker in tickers}
+    news = []
+    for i in range(count):
+        ticker = rng.choice(tickers)
+        others = rng.sample(tickers, k=min(rng.choice([0, 0, 1, 2]), len(tickers)))
+        
+        if len(headlines[ticker]) > 0 and rng.random() < duplicate_rate:
+            title = rng.choice(headlines[ticker])
+        else:
+            title = f"{Symbol[ticker].value} {rng.choice(HEADLINE_EVENTS)} {rng.choice(HEADLINE_REASONS)}, {rng.choice(HEADLINE_REASONS)} in focus ({rng.randint(1, 99)}% move)"
+            headlines[ticker].append(title)
+            
+        date = now - window * rng.random()
+        news_dict = dict(template)
+        news_dict.update({
+            "news_url": f"https://news.example.com/{ticker.lower()}/{i}",
+            "title": title,
+            "text": f"{title}. {template['text']}",
+            "source_name": rng.choice(sources),
+            "date": date.astimezone(eastern).strftime(NEWS_DATE_FORMAT),
+            "sentiment": rng.choice(["Positive", "Neutral", "Negative"]),
+            "tickers": [ticker] + [other for other in others if other != ticker],
+        })
+        news.append(news_dict)
+        
+    news.sort(key=lambda news_dict: parse_news_date(news_dict["date"]), reverse=True)
+    return news
+
+
+class FakeNewsApi(FakeHttpService):
+    """Stand-in of the stocknewsapi, pages through the given news (newest first).
+    
+    Point NewsApi at f"{url}/api/v1". The date parameter is honored for lastNmin, every other
+    range returns all news.
+    """
+    
+    routes = [("GET", r"/api/v1", "get_page")]
+    
+    def __init__(self, news: list[dict], behaviour: ServiceBehaviour = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__(behaviour, host, port)
+        self.news = news
+        self._dates = [parse_news_date(news_dict["date"]) for news_dict in news]
+        
+        # ticker -> positions in news
+        self._by_ticker = {}
+        for position, news_dict in enumerate(news):
+            for ticker in news_dict["tickers"]:
+                self._by_ticker.setdefault(ticker, []).append(position)
+                
+    def get_page(self, query: dict, body: dict) -> tuple[int, dict]:
+        tickers = query.get("tickers", "").split(",")
+        items = int(query.get("items", 50))
+        page = int(query.get("page", 1))
+        
+        positions = sorted({position for ticker in tickers for position in self._by_ticker.get(ticker, [])})
+        
+        match = re.fullmatch(r"last(\d+)min", query.get("date", ""))
+        if match is not None:
+            since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=int(match.group(1)))
+            positions = [position for position in positions if self._dates[position] >= since]
+            
+        total_pages = (len(positions) + items - 1) // items
+        data = [self.news[position] for position in positions[(page - 1) * items:page * items]]
+        return 200, {"data": data, "total_pages": total_pages}
+
+
+class FakeOpenAI(FakeHttpService):
+    """Stand-in of the chat completions api, answers the sentiment prompts of GPT.
+    
+    Point the clients at f"{url}/v1". Every ticker leans to one answer, which is given for most of its
+    headlines, so the scores spread like real ones.
+    """
+    
+    routes = [("POST", r"/v1/chat/completions", "chat_completions")]
+    
+    def __init__(self, behaviour: ServiceBehaviour = None, host: str = "127.0.0.1", port: int = 0, consistency: float = 0.85) -> None:
+        super().__init__(behaviour, host, port)
+        self.consistency = consistency
+        self.template = load_payload("openai_chat_completion")
+        
+    def reset_stats(self) -> None:
+        super().reset_stats()
+        with self._stats_lock:
+            self.tokens = Counter()
+            
+    def stats(self) -> dict:
+        """Same as FakeService.stats, with the tokens of all answers."""
+        stats = super().stats()
+        with self._stats_lock:
+            stats["tokens"] = dict(self.tokens)
+        return stats
+        
+    def chat_completions(self, query: dict, body: dict) -> tuple[int, dict]:
+        prompt = body["messages"][-1]["content"]
+        
+        multi = re.search(r"Companies: (.*?)\. Headline: (.*)$", prompt, re.DOTALL)
+        if multi is not None:
+            headline = multi.group(2)
+            tickers = re.findall(r"([A-Z][A-Z0-9.]*) \(", multi.group(1))
+            content = "\n".join(f"{ticker} | {self._answer(ticker, headline)} | Answer of the fake model for {ticker}." for ticker in tickers)
+        else:
+            single = re.search(r"stock price of (.*?) in the .*?Headline: (.*)$", prompt, re.DOTALL)
+            if single is None:
+                return 400, {"error": {"message": "unknown prompt", "type": "invalid_request_error"}}
+            company, headline = single.groups()
+            # lean by ticker, like the multi ticker prompts
+            ticker = Symbol(company).name if company in Symbol._value2member_map_ else company
+            content = f"{self._answer(ticker, headline)}\nAnswer of the fake model for {company}."
+            
+        response = json.loads(json.dumps(self.template))
+        response["id"] = f"chatcmpl-{uuid.uuid4().hex}"
+        response["created"] = int(time.time())
+        response["model"] = body.get("model", response["model"])
+        response["choices"][0]["message"]["content"] = content
+        
+        # roughly four characters per token
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        response["usage"] = usage
+        with self._stats_lock:
+            self.tokens.update(usage)
+            
+        return 200, response
+        
+    def _answer(self, ticker: str, headline: str) -> str:
+        answers = ["YES", "NO", "UNKNOWN"]
+        lean = int(hashlib.md5(ticker.encode("utf-8")).hexdigest(), 16) % 3
+        draw = int(hashlib.md5(f"{ticker}|{headline}".encode("utf-8")).hexdigest(), 16)
+        if (draw % 1000) / 1000 < self.consistency:
+            return answers[lean]
+        return answers[draw % 3]
+
+
+class FakeAlpaca(FakeHttpService):
+    """Stand-in of the Alpaca trading and market data apis, for the TradingClient and StockHistoricalDataClient.
+    
+    Keeps cash and positions (negative quantities are shorts), every order is filled at the latest
+    price fill_delay seconds after it was submitted. Fills are published on trade_updates if given.
+    """
+    
+    routes = [
+        ("GET", r"/v2/account", "get_account"),
+        ("GET", r"/v2/positions", "get_all_positions"),
+        ("DELETE", r"/v2/positions/([^/]+)", "close_position"),
+        ("POST", r"/v2/orders", "submit_order"),
+        ("GET", r"/v2/orders/([^/]+)", "get_order"),
+        ("GET", r"/v2/assets", "get_all_assets"),
+        ("GET", r"/v2/assets/([^/]+)", "get_asset"),
+        ("GET", r"/v2/stocks/bars/latest", "get_latest_bars"),
+    ]
+    
+    def __init__(self, prices: dict[str, float], positions: dict[str, float] = None, cash: float = 100000.0, fill_delay: float = 0.05, trade_updates: FakeTradeUpdatesServer = None, behaviour: ServiceBehaviour = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__(behaviour, host, port)
+        self.prices = dict(prices)
+        self.positions = dict(positions) if positions is not None else {}
+        self.cash = cash - sum(qty * self.prices[symbol] for symbol, qty in self.positions.items())
+        self.fill_delay = fill_delay
+        self.trade_updates = trade_updates
+        
+        self.orders = {}
+        self._lock = threading.Lock()
+        self._templates = {name: load_payload(f"alpaca_{name}") for name in ("account", "position", "asset", "latest_bars")}
+        
+    def get_account(self, query: dict, body: dict) -> tuple[int, dict]:
+        with self._lock:
+            long_value = sum(qty * self.prices[symbol] for symbol, qty in self.positions.items() if qty > 0)
+            short_value = sum(qty * self.prices[symbol] for symbol, qty in self.positions.items() if qty < 0)
+            cash = self.cash
+        equity = cash + long_value + short_value
+        
+        account = dict(self._templates["account"])
+        account.update({
+            "cash": str(cash),
+            "equity": str(equity),
+            "last_equity": str(equity),
+            "portfolio_value": str(equity),
+            "long_market_value": str(long_value),
+            "short_market_value": str(short_value),
+            "buying_power": str(2 * equity),
+            "regt_buying_power": str(2 * equity),
+        })
+        return 200, account
+        
+    def get_all_positions(self, query: dict, body: dict) -> tuple[int, list]:
+        with self._lock:
+            positions = dict(self.positions)
+        return 200, [self._position_payload(symbol, qty) for symbol, qty in sorted(positions.items())]
+        
+    def close_position(self, query: dict, body: dict, symbol: str) -> tuple[int, dict]:
+        with self._lock:
+            qty = self.positions.get(symbol)
+        if qty is None:
+            return 404, {"code": 40410000, "message": "position does not exist"}
+        return 200, self._place(symbol, abs(qty), "sell" if qty > 0 else "buy")
+        
+    def submit_order(self, query: dict, body: dict) -> tuple[int, dict]:
+        symbol = body["symbol"]
+        qty = float(body["qty"])
+        if symbol not in self.prices or qty <= 0:
+            return 422, {"code": 40010001, "message": f"invalid order of {qty} {symbol}"}
+        return 200, self._place(symbol, qty, body["side"])
+        
+    def get_order(self, query: dict, body: dict, order_id: str) -> tuple[int, dict]:
+        with self._lock:
+            order = self.orders.get(order_id)
+        if order is None:
+            return 404, {"code": 40410000, "message": "order not found"}
+        return 200, order
+        
+    def get_all_assets(self, query: dict, body: dict) -> tuple[int, list]:
+        return 200, [self._asset_payload(symbol) for symbol in sorted(self.prices)]
+        
+    def get_asset(self, query: dict, body: dict, symbol: str) -> tuple[int, dict]:
+        if symbol not in self.prices:
+            return 404, {"code": 40410000, "message": "asset not found"}
+        return 200, self._asset_payload(symbol)
+        
+    def get_latest_bars(self, query: dict, body: dict) -> tuple[int, dict]:
+        template = next(iter(self._templates["latest_bars"]["bars"].values()))
+        bars = {}
+        for symbol in query.get("symbols", "").split(","):
+            if symbol in self.prices:
+                bars[symbol] = dict(template, o=self.prices[symbol], h=self.prices[symbol], l=self.prices[symbol], c=self.prices[symbol])
+        return 200, {"bars": bars}
+        
+    def _place(self, symbol: str, qty: float, side: str) -> dict:
+        order = order_payload(uuid.uuid4(), symbol, qty, side)
+        with self._lock:
+            self.orders[order["id"]] = order
+        timer = threading.Timer(self.fill_delay, self._fill, args=(order["id"],))
+        timer.daemon = True
+        timer.start()
+        return order
+        
+    def _fill(self, order_id: str) -> None:
+        with self._lock:
+            order = self.orders[order_id]
+            symbol = order["symbol"]
+            qty = float(order["qty"])
+            price = self.prices[symbol]
+            signed_qty = qty if order["side"] == "buy" else -qty
+            
+            position_qty = self.positions.get(symbol, 0.0) + signed_qty
+            if abs(position_qty) < 1e-9:
+                self.positions.pop(symbol, None)
+            else:
+                self.positions[symbol] = position_qty
+            self.cash -= signed_qty * price
+            
+            order = order_payload(order_id, symbol, qty, order["side"], status="filled", filled_qty=qty, filled_avg_price=price)
+            self.orders[order_id] = order
+            
+        if self.trade_updates is not None:
+            self.trade_updates.publish("fill", order, price=price, qty=qty, position_qty=position_qty)
+            
+    def _position_payload(self, symbol: str, qty: float) -> dict:
+        price = self.prices[symbol]
+        position = dict(self._templates["position"])
+        position.update({
+            "asset_id": str(uuid.uuid5(uuid.NAMESPACE_DNS, symbol)),
+            "symbol": symbol,
+            "avg_entry_price": str(price),
+            "qty": str(qty),
+            "qty_available": str(qty),
+            "side": "long" if qty > 0 else "short",
+            "market_value": str(qty * price),
+            "cost_basis": str(qty * price),
+            "current_price": str(price),
+            "lastday_price": str(price),
+        })
+        return position
+        
+    def _asset_payload(self, symbol: str) -> dict:
+        asset = dict(self._templates["asset"])
+        asset.update({
+            "id": str(uuid.uuid5(uuid.NAMESPACE_DNS, symbol)),
+            "symbol": symbol,
+            "name": Symbol[symbol].value if symbol in Symbol.__members__ else symbol,
+        })
+        return asset
+
+
+# a field missing in a document
+_MISSING = object()
+
+def _to_bson(value):
+    """Stores datetimes the way mongodb returns them, as naive utc datetimes."""
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return {key: _to_bson(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_bson(item) for item in value]
+    return value
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+def _get(document: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(document, dict) or key not in document:
+            return _MISSING
+        document = document[key]
+    return document
+
+def _compare(value, operand, compare) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    try:
+        return compare(value, operand)
+    except TypeError:
+        return False
+
+_OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand or (isinstance(value, list) and any(item in operand for item in value)),
+    "$nin": lambda value, operand: value not in operand,
+    "$gt": lambda value, operand: _compare(value, operand, lambda a, b: a > b),
+    "$gte": lambda value, operand: _compare(value, operand, lambda a, b: a >= b),
+    "$lt": lambda value, operand: _compare(value, operand, lambda a, b: a < b),
+    "$lte": lambda value, operand: _compare(value, operand, lambda a, b: a <= b),
+    "$exists": lambda value, operand: (value is not _MISSING) == bool(operand),
+}
+
+def _is_operator_dict(condition) -> bool:
+    return isinstance(condition, dict) and len(condition) > 0 and all(key.startswith("$") for key in condition)
+
+def _matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(document, sub_query) for sub_query in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(_matches(document, sub_query) for sub_query in condition):
+                return False
+            continue
+            
+        value = _get(document, key)
+        if _is_operator_dict(condition):
+            if not all(_OPERATORS[operator](value, operand) for operator, operand in condition.items()):
+                return False
+        elif not (value == condition or (isinstance(value, list) and condition in value)):
+            return False
+    return True
+
+def _evaluate(document: dict, expression):
+    """Evaluates an aggregation expression, only field paths and $objectToArray are supported."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict) and "$objectToArray" in expression:
+        value = _evaluate(document, expression["$objectToArray"])
+        return [{"k": key, "v": item} for key, item in (value or {}).items()]
+    return expression
+
+def _project(document: dict, projection: dict) -> dict:
+    if projection is None:
+        return _copy(document)
+        
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if len(fields) > 0 and all(value == 0 for value in fields.values()):
+        # exclusion
+        projected = {key: _copy(value) for key, value in document.items() if key not in fields}
+    else:
+        projected = {}
+        for key, value in fields.items():
+            if value == 1 or value is True:
+                item = _get(document, key)
+                if item is not _MISSING:
+                    projected[key] = _copy(item)
+            else:
+                projected[key] = _copy(_evaluate(document, value))
+                
+    if projection.get("_id", 1) in (0, False):
+        projected.pop("_id", None)
+    elif "_id" in document:
+        projected["_id"] = document["_id"]
+    return projected
+
+
+class FakeMongoClient(FakeService):
+    """In-memory stand-in of a MongoClient, supports the queries and aggregations of MongoDBWrapper.
+    
+    Every collection call is one request. Calls above the rate limit wait for their turn, like a
+    saturated connection pool, and failing calls raise AutoReconnect, like a dropped connection.
+    Unique indexes are kept as dicts, so lookups by url or _id do not scan the collection.
+    """
+    
+    def __init__(self, behaviour: ServiceBehaviour = None) -> None:
+        super().__init__(behaviour)
+        self._databases = {}
+        self._lock = threading.RLock()
+        
+    def __getitem__(self, name: str) -> "FakeMongoDatabase":
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = FakeMongoDatabase(self, name)
+            return self._databases[name]
+            
+    def _request(self, endpoint: str) -> None:
+        if self._admit(endpoint, throttle=True) == "error":
+            raise AutoReconnect(f"connection to the fake mongodb dropped during {endpoint}")
+
+
+class FakeMongoDatabase():
+    
+    def __init__(self, client: FakeMongoClient, name: str) -> None:
+        self.client = client
+        self.name = name
+        self._collections = {}
+        
+    def __getitem__(self, name: str) -> "FakeMongoCollection":
+        with self.client._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeMongoCollection(self.client, name)
+            return self._collections[name]
+
+
+class FakeMongoCollection():
+    """One collection, documents are kept by _id."""
+    
+    def __init__(self, client: FakeMongoClient, name: str) -> None:
+        self.client = client
+        self.name = name
+        
+        self._documents = {}
+        # index name -> (keys, options)
+        self._indexes = {"_id_": ([("_id", 1)], {"unique": True})}
+        # unique single field -> value -> _id
+        self._unique = {}
+        self._lock = client._lock
+        
+    def create_index(self, keys: list[tuple[str, int]], name: str = None, unique: bool = False, **options) -> str:
+        self.client._request(f"{self.name}.create_index")
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = name if name is not None else "_".join(f"{field}_{direction}" for field, direction in keys)
+        with self._lock:
+            self._indexes[name] = (list(keys), {"unique": unique, **options})
+            if unique and len(keys) == 1 and keys[0][0] not in self._unique:
+                field = keys[0][0]
+                index = {}
+                for _id, document in self._documents.items():
+                    value = _get(document, field)
+                    if value is not _MISSING and value in index:
+                        del self._indexes[name]
+                        raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name} dup key: {value!r}", code=11000)
+                    if value is not _MISSING:
+                        index[value] = _id
+                self._unique[field] = index
+        return name
+        
+    def index_information(self) -> dict:
+        self.client._request(f"{self.name}.index_information")
+        with self._lock:
+            return {name: {"key": keys, **options} for name, (keys, options) in self._indexes.items()}
+            
+    def estimated_document_count(self) -> int:
+        self.client._request(f"{self.name}.estimated_document_count")
+        with self._lock:
+            return len(self._documents)
+            
+    def find(self, filter: dict = None, projection: dict = None):
+        self.client._request(f"{self.name}.find")
+        with self._lock:
+            return iter([_project(document, projection) for document in self._find(_to_bson(filter or {}))])
+            
+    def find_one(self, filter: dict = None, projection: dict = None) -> dict:
+        self.client._request(f"{self.name}.find_one")
+        with self._lock:
+            documents = self._find(_to_bson(filter or {}))
+            return _project(documents[0], projection) if len(documents) > 0 else None
+            
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False):
+        self.client._request(f"{self.name}.replace_one")
+        with self._lock:
+            filter = _to_bson(filter)
+            documents = self._find(filter)
+            if len(documents) > 0:
+                replacement = dict(_to_bson(replacement), _id=documents[0]["_id"])
+                self._remove(documents[0]["_id"])
+                self._insert(replacement)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+            if upsert:
+                document = self._insert({**self._equalities(filter), **_to_bson(replacement)})
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=document["_id"])
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+            
+    def delete_many(self, filter: dict):
+        self.client._request(f"{self.name}.delete_many")
+        with self._lock:
+            documents = self._find(_to_bson(filter))
+            for document in documents:
+                self._remove(document["_id"])
+            return SimpleNamespace(deleted_count=len(documents))
+            
+    def bulk_write(self, operations: list, ordered: bool = True):
+        """Applies UpdateOne operations with $set and $setOnInsert, unique violations are collected like mongodb does."""
+        self.client._request(f"{self.name}.bulk_write")
+        matched = modified = upserted = 0
+        write_errors = []
+        with self._lock:
+            for index, operation in enumerate(operations):
+                filter, update, upsert = _to_bson(operation._filter), _to_bson(operation._doc), operation._upsert
+                documents = self._find(filter)
+                try:
+                    if len(documents) > 0:
+                        matched += 1
+                        if len(update.get("$set", {})) > 0:
+                            document = dict(documents[0], **update["$set"])
+                            self._remove(document["_id"])
+                            self._insert(document)
+                            modified += 1
+                    elif upsert:
+                        self._insert({**self._equalities(filter), **update.get("$setOnInsert", {}), **update.get("$set", {})})
+                        upserted += 1
+                except DuplicateKeyError as e:
+                    write_errors.append({"index": index, "code": e.code, "errmsg": str(e)})
+                    if ordered:
+                        break
+                        
+        if len(write_errors) > 0:
+            raise BulkWriteError({"writeErrors": write_errors, "nMatched": matched, "nModified": modified, "nUpserted": upserted})
+        return SimpleNamespace(matched_count=matched, modified_count=modified, upserted_count=upserted)
+        
+    def aggregate(self, pipeline: list[dict]):
+        """Runs $match, $project, $unwind and $group ($sum, $avg, $push) stages."""
+        self.client._request(f"{self.name}.aggregate")
+        with self._lock:
+            documents = list(self._documents.values())
+            
+        for stage in pipeline:
+            operator, spec = next(iter(stage.items()))
+            if operator == "$match":
+                spec = _to_bson(spec)
+                documents = [document for document in documents if _matches(document, spec)]
+            elif operator == "$project":
+                documents = [_project(document, spec) for document in documents]
+            elif operator == "$unwind":
+                field = spec[1:]
+                documents = [dict(document, **{field: item}) for document in documents for item in (_get(document, field) if isinstance(_get(document, field), list) else [])]
+            elif operator == "$group":
+                documents = self._group(documents, spec)
+            else:
+                raise NotImplementedError(f"Stage {operator} is not supported by the fake mongodb.")
+                
+        return iter(documents)
+        
+    @staticmethod
+    def _group(documents: list[dict], spec: dict) -> list[dict]:
+        groups = {}
+        for document in documents:
+            key = _evaluate(document, spec["_id"])
+            values = groups.setdefault(key, {name: [] for name in spec if name != "_id"})
+            for name, accumulator in spec.items():
+                if name != "_id":
+                    values[name].append(_evaluate(document, next(iter(accumulator.values()))))
+                    
+        results = []
+        for key, values in groups.items():
+            result = {"_id": key}
+            for name, accumulator in spec.items():
+                if name == "_id":
+                    continue
+                operator = next(iter(accumulator))
+                numbers = [value for value in values[name] if isinstance(value, (int, float))]
+                if operator == "$sum":
+                    result[name] = sum(numbers)
+                elif operator == "$avg":
+                    result[name] = sum(numbers) / len(numbers) if len(numbers) > 0 else None
+                elif operator == "$push":
+                    result[name] = values[name]
+                else:
+                    raise NotImplementedError(f"Accumulator {operator} is not supported by the fake mongodb.")
+            results.append(result)
+        return results
+        
+    def _find(self, filter: dict) -> list[dict]:
+        # use a unique index if the filter pins its field
+        for field in ["_id"] + list(self._unique):
+            condition = filter.get(field, _MISSING)
+            if condition is _MISSING:
+                continue
+            if _is_operator_dict(condition) and list(condition) == ["$in"]:
+                values = condition["$in"]
+            elif not _is_operator_dict(condition) and not isinstance(condition, dict):
+                values = [condition]
+            else:
+                continue
+            ids = values if field == "_id" else [self._unique[field].get(value) for value in values]
+            candidates = [self._documents[_id] for _id in ids if _id in self._documents]
+            break
+        else:
+            candidates = list(self._documents.values())
+            
+        return [document for document in candidates if _matches(document, filter)]
+        
+    def _equalities(self, filter: dict) -> dict:
+        return {key: value for key, value in filter.items() if not key.startswith("$") and not _is_operator_dict(value)}
+        
+    def _insert(self, document: dict) -> dict:
+        document = _copy(document)
+        document.setdefault("_id", ObjectId())
+        
+        # unique violations
+        for field, index in [("_id", self._documents)] + list(self._unique.items()):
+            value = document["_id"] if field == "_id" else _get(document, field)
+            if value is not _MISSING and value in index:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {field} dup key: {value!r}", code=11000)
+                
+        self._documents[document["_id"]] = document
+        for field, index in self._unique.items():
+            value = _get(document, field)
+            if value is not _MISSING:
+                index[value] = document["_id"]
+        return document
+        
+    def _remove(self, _id) -> None:
+        document = self._documents.pop(_id)
+        for field, index in self._unique.items():
+            value = _get(document, field)
+            if value is not _MISSING and index.get(value) == _id:
+                del index[value]
@@ -1,16 +1,29 @@
+import re
 from finance_gpt.utils import load_credentials
 from finance_gpt.news_api import NewsArticle, GPTSentiment
 from finance_gpt.utils import setup_logger
-from openai import OpenAI
+from finance_gpt.metrics import track, record_token_usage
+from openai import OpenAI, AsyncOpenAI
 
 logger = setup_logger(__name__)
 
+# one answer line of a multi ticker prompt, e.g. "AAPL | YES | Strong iPhone sales.", list markers like "1." or "-" are allowed
+MULTI_ANSWER_PATTERN = re.compile(r"^\s*(?:\d+[.)]\s*|[-*•]\s+)?([A-Z][A-Z0-9.]*)\s*\|\s*(YES|NO|UNKNOWN)\s*\|\s*(.*)$", re.IGNORECASE)
+
 class GPT():
     
-    def __init__(self, model_name: str = "gpt-4-1106-preview"):
-        self._load_api_key()
+    # bump this whenever one of the prompts changes, cached sentiments of older prompts are ignored then
+    prompt_version = 1
+    
+    def __init__(self, model_name: str = "gpt-4-1106-preview", timeout: float = 60.0, api_key: str = None, base_url: str = None):
+        if api_key is None:
+            self._load_api_key()
+        else:
+            self.api_key = api_key
         self.model_name = model_name
-        self.client = OpenAI(api_key=self.api_key)
+        # base_url can point to a local stand-in, None is the openai api
+        self.client = OpenAI(api_key=self.api_key, timeout=timeout, base_url=base_url)
+        self.async_client = AsyncOpenAI(api_key=self.api_key, timeout=timeout, base_url=base_url)
         
     def _load_api_key(self):
         """Loads the API key from the credentials file."""
@@ -27,57 +40,160 @@ class GPT():
         prompt += f"Is this headline good or bad for the stock price of {news_article.company.value} in the {term} term?"
         
         prompt += f"Headline: {news_article.title}"
+        
+        return prompt
+        
+    def get_multi_prompt(self, news_articles: list[NewsArticle], term: str) -> str:
+        
+        prompt = 'Forget all your previous instructions. Pretend you are a financial expert. You are a financial expert with stock recommendation experience. '
+        prompt += f"Is this headline good or bad for the stock price of each of the following companies in the {term} term? "
+        prompt += "Answer with exactly one line per company and nothing else, using the format: TICKER | ANSWER | REASON. "
+        prompt += "ANSWER is “YES” if good news, “NO” if bad news, or “UNKNOWN” if uncertain. REASON is one short and concise sentence. "
+        
+        prompt += "Companies: "
+        prompt += ", ".join(f"{news_article.company.name} ({news_article.company.value})" for news_article in news_articles)
+        prompt += f". Headline: {news_articles[0].title}"
 
         return prompt
         
+    def _get_messages(self, news_article: NewsArticle, term: str) -> list[dict]:
+        """Builds the chat messages for a sentiment request."""
+        return [{"role": "user", "content": self.get_prompt(news_article, term)}]
+        
     def get_sentiment(self, news_article: NewsArticle, term: str):
         
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            seed=1,
-            temperature=0.5,
-            messages=[{"role": "user", "content": self.get_prompt(news_article, term)}]
-        )
+        with track("openai", "sentiment"):
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                seed=1,
+                temperature=0.5,
+                messages=self._get_messages(news_article, term)
+            )
+        record_token_usage(self.model_name, response.usage)
+        
+        self._apply_response(news_article, response.choices[0].message.content)
+        
+    async def aget_sentiment(self, news_article: NewsArticle, term: str):
+        """Same as get_sentiment, but uses the async client so many requests can be in flight at once."""
+        
+        with track("openai", "sentiment"):
+            response = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                seed=1,
+                temperature=0.5,
+                messages=self._get_messages(news_article, term)
+            )
+        record_token_usage(self.model_name, response.usage)
+        
+        self._apply_response(news_article, response.choices[0].message.content)
+        
+    def get_sentiments(self, news_articles: list[NewsArticle], term: str) -> list[NewsArticle]:
+        """Sentiments one headline for several companies with a single request.
+        
+        All news articles have to share the same headline. Returns the news articles the model
+        did not answer for, those are left untouched and have to be sentimented separately.
+        """
         
-        logger.debug(f"This is the response: {response.choices[0].message.content}")
+        with track("openai", "multi_sentiment"):
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                seed=1,
+                temperature=0.5,
+                messages=[{"role": "user", "content": self.get_multi_prompt(news_articles, term)}]
+            )
+        record_token_usage(self.model_name, response.usage)
         
-        splits = response.choices[0].message.content.split("\n")
+        return self._apply_multi_response(news_articles, response.choices[0].message.content)
         
-        logger.debug(f"The splits: {splits}")
+    async def aget_sentiments(self, news_articles: list[NewsArticle], term: str) -> list[NewsArticle]:
+        """Same as get_sentiments, but uses the async client."""
+        
+        with track("openai", "multi_sentiment"):
+            response = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                seed=1,
+                temperature=0.5,
+                messages=[{"role": "user", "content": self.get_multi_prompt(news_articles, term)}]
+            )
+        record_token_usage(self.model_name, response.usage)
+        
+        return self._apply_multi_response(news_articles, response.choices[0].message.content)
+        
+    def _apply_response(self, news_article: NewsArticle, content: str) -> None:
+        """Parses the response of the model and stores the sentiment in the news article."""
+        
+        logger.debug("This is the response: %s", content)
+        
+        splits = content.split("\n")
+        
+        logger.debug("The splits: %s", splits)
         
         filtered_splits = []
         for split in splits:
-            if len(split) > 0:
-                filtered_splits.append(split)
-        logger.debug(f"The filtered splits: {splits}")
+            if len(split.strip()) > 0:
+                filtered_splits.append(split.strip())
+        logger.debug("The filtered splits: %s", filtered_splits)
         
         # check if sentiment is correct
         sentiment = filtered_splits[0]
         if sentiment.lower() not in ["no", "yes", "unknown"]:
-            logger.warn(f"Sentiment is weird: {sentiment}")
+            logger.warning("Sentiment is weird: %s", sentiment)
             
-            if "no" in sentiment:
+            if "unknown" in sentiment.lower():
+                sentiment = "UNKNOWN"
+                logger.debug("Using sentiment UNKNOWN")
+            elif "no" in sentiment.lower():
                 sentiment = "NO"
                 logger.debug("Using sentiment NO")
-            elif "yes" in sentiment:
+            elif "yes" in sentiment.lower():
                 sentiment = "YES"
                 logger.debug("Using sentiment YES")
             else:
                 raise Exception("Dont know what to do with this sentiment")
             
+        reasoning = " ".join(filtered_splits[1:])
         
-        sentiment, reasoning = filtered_splits
-        
-        logger.debug(f"The sentiment: {sentiment}")
-        logger.debug(f"The reasoning: {reasoning}")
+        logger.debug("The sentiment: %s", sentiment)
+        logger.debug("The reasoning: %s", reasoning)
         
-        sentiment = GPTSentiment[sentiment]
+        sentiment = GPTSentiment[sentiment.upper()]
 
         news_article.gpt_sentiment = sentiment
         news_article.gpt_verdict = reasoning
     
+    def _apply_multi_response(self, news_articles: list[NewsArticle], content: str) -> list[NewsArticle]:
+        """Parses the per ticker answer lines and stores the sentiments in the news articles."""
+        
+        logger.debug("This is the response: %s", content)
+        
+        # parse the answer lines
+        answers = {}
+        for line in content.split("\n"):
+            # markdown bold, e.g. "**AAPL** | **YES** | ..."
+            line = line.replace("**", "")
+            match = MULTI_ANSWER_PATTERN.match(line)
+            if match is None:
+                if len(line.strip()) > 0:
+                    logger.warning("Could not parse answer line: %s", line)
+                continue
+            ticker, sentiment, reasoning = match.groups()
+            answers[ticker.upper()] = (GPTSentiment[sentiment.upper()], reasoning.strip())
+            
+        # store them in the news articles
+        missing = []
+        for news_article in news_articles:
+            if news_article.company.name in answers:
+                news_article.gpt_sentiment, news_article.gpt_verdict = answers[news_article.company.name]
+            else:
+                missing.append(news_article)
+                
+        if len(missing) > 0:
+            logger.warning("No answer for tickers: %s", [news_article.company.name for news_article in missing])
+            
+        return missing
+
+
 
-        
 if __name__ == "__main__":
     from finance_gpt.news_api import NewsApi
     
@@ -86,4 +202,4 @@ if __name__ == "__main__":
     news_api = NewsApi()
     news = news_api.get_news("AMZN")
     
-    print(gpt.get_sentiment(news_article=news[0], term="short"))
\ No newline at end of file
+    print(gpt.get_sentiment(news_article=news[0], term="short"))
@@ -2,6 +2,8 @@ from finance_gpt import setup_logger
 from finance_gpt.scheduler import Scheduler
 from finance_gpt.portfolio_manager import PortfolioManager
 from finance_gpt.policy import Policy
+from finance_gpt.metrics import start_exporter
+from finance_gpt.utils import load_config
 
 logger = setup_logger("policy_runner")
 
@@ -18,7 +20,9 @@ if __name__ == "__main__":
         # portfolio manager
         pm = PortfolioManager()
         # setup policy
-        policy = Policy(name="normal", parameters={})
+        policy = Policy(name="normal", parameters={}, pm=pm)
+        # metrics
+        start_exporter(load_config().get("metrics", {}))
     except Exception as e:
         logger.exception("t")
         exit()
@@ -48,4 +52,3 @@ if __name__ == "__main__":
         
     except:
         logger.exception("Failed in main loop")
-        
\ No newline at end of file
@@ -0,0 +1,194 @@
+# standard libraries
+import os
+import json
+import time
+import datetime
+import threading
+from dataclasses import dataclass, asdict
+# finance_gpt imports
+from finance_gpt import TOP_LEVEL_DIR, setup_logger
+from finance_gpt.structures import Symbol
+from finance_gpt.metrics import track
+# third party imports
+from alpaca.data.historical import StockHistoricalDataClient
+from alpaca.data.requests import StockLatestBarRequest
+from alpaca.trading.client import TradingClient
+from alpaca.trading.requests import GetAssetsRequest
+from alpaca.trading.enums import AssetClass, AssetStatus
+
+logger = setup_logger(__name__)
+
+class PriceCache():
+    """Latest prices of stocks, fetched in one batched request and kept for ttl seconds."""
+    
+    def __init__(self, data_client: StockHistoricalDataClient, ttl: float = 60.0) -> None:
+        self.data_client = data_client
+        self.ttl = ttl
+        
+        # symbol name -> (price, monotonic time of the fetch)
+        self._prices = {}
+        self._lock = threading.Lock()
+        
+    def get_prices(self, symbols: list[Symbol]) -> dict[Symbol, float]:
+        """Gets the latest prices, only symbols without a fresh price are requested.
+        
+        Symbols the api has no price for are left out.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = [symbol for symbol in symbols if symbol.name not in self._prices or now - self._prices[symbol.name][1] > self.ttl]
+            
+        # one request for all stale symbols
+        if len(stale) > 0:
+            logger.debug(f"Requesting latest prices of {len(stale)} symbols.")
+            rq_params = StockLatestBarRequest(symbol_or_symbols=[symbol.name for symbol in stale])
+            with track("alpaca", "get_stock_latest_bar"):
+                latest_bars = self.data_client.get_stock_latest_bar(request_params=rq_params)
+            fetched = time.monotonic()
+            with self._lock:
+                for name, bar in latest_bars.items():
+                    self._prices[name] = (float(bar.close), fetched)
+                    
+        prices = {}
+        with self._lock:
+            for symbol in symbols:
+                if symbol.name in self._prices:
+                    prices[symbol] = self._prices[symbol.name][0]
+                else:
+                    logger.warning(f"No price for symbol {symbol.name}.")
+        return prices
+        
+    def get_price(self, symbol: Symbol) -> float:
+        """Gets the latest price of one stock."""
+        prices = self.get_prices([symbol])
+        if symbol not in prices:
+            raise ValueError(f"No price for symbol {symbol.name}.")
+        return prices[symbol]
+        
+    def invalidate(self) -> None:
+        """Forgets all prices."""
+        with self._lock:
+            self._prices = {}
+
+
+@dataclass
+class AssetInfo:
+    symbol: str
+    tradable: bool
+    shortable: bool
+    fractionable: bool
+    easy_to_borrow: bool
+    
+    @classmethod
+    def from_alpaca_asset(cls, asset):
+        return cls(
+            symbol=asset.symbol,
+            tradable=bool(asset.tradable),
+            shortable=bool(asset.shortable),
+            fractionable=bool(asset.fractionable),
+            easy_to_borrow=bool(asset.easy_to_borrow),
+        )
+
+
+class AssetCache():
+    """Tradable, shortable and fractionable flags of the whole symbol universe.
+    
+    Filled with one bulk assets request, persisted to a local file and refreshed in a background
+    thread once it is older than ttl seconds. Lookups never wait for a refresh.
+    """
+    
+    def __init__(self, trading_client: TradingClient, ttl: float = 24 * 60 * 60, path: str = None) -> None:
+        self.trading_client = trading_client
+        self.ttl = ttl
+        self.path = path if path is not None else os.path.join(TOP_LEVEL_DIR, "cache", "assets.json")
+        
+        self._assets = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        
+        # start from the local file, only ask the api if there is none
+        if not self._load():
+            self.refresh()
+            
+    def get(self, symbol: Symbol) -> AssetInfo:
+        """Gets the flags of a symbol, symbols missing in the bulk response are requested one by one."""
+        if self.is_stale():
+            self.refresh_in_background()
+            
+        with self._lock:
+            asset_info = self._assets.get(symbol.name)
+            
+        if asset_info is None:
+            logger.debug(f"Symbol {symbol.name} is not cached, requesting it.")
+            with track("alpaca", "get_asset"):
+                asset = self.trading_client.get_asset(symbol.name)
+            asset_info = AssetInfo.from_alpaca_asset(asset)
+            with self._lock:
+                self._assets[symbol.name] = asset_info
+                
+        return asset_info
+        
+    def is_stale(self) -> bool:
+        return self._fetched_at is None or time.time() - self._fetched_at > self.ttl
+        
+    def refresh(self) -> None:
+        """Requests the flags of all active us equities and keeps the ones of the symbol universe."""
+        logger.debug("Refreshing asset metadata.")
+        names = {symbol.name for symbol in Symbol}
+        request = GetAssetsRequest(asset_class=AssetClass.US_EQUITY, status=AssetStatus.ACTIVE)
+        with track("alpaca", "get_all_assets"):
+            all_assets = self.trading_client.get_all_assets(request)
+        assets = {asset.symbol: AssetInfo.from_alpaca_asset(asset) for asset in all_assets if asset.symbol in names}
+        
+        with self._lock:
+            self._assets = assets
+            self._fetched_at = time.time()
+        self._save()
+        logger.debug(f"Cached asset metadata of {len(assets)} symbols.")
+        
+    def refresh_in_background(self) -> None:
+        """Starts a refresh in a background thread, unless one is running already."""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh_safely, name="asset-cache-refresh", daemon=True)
+            self._refresh_thread.start()
+            
+    def _refresh_safely(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Failed to refresh asset metadata, keeping the old one.")
+            
+    def _load(self) -> bool:
+        """Loads the persisted flags, returns False if there are none."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            assets = {name: AssetInfo(**asset) for name, asset in data["assets"].items()}
+            fetched_at = datetime.datetime.fromisoformat(data["fetched_at"]).timestamp()
+        except Exception:
+            logger.exception(f"Failed to load asset metadata from {self.path}.")
+            return False
+            
+        with self._lock:
+            self._assets = assets
+            self._fetched_at = fetched_at
+        return True
+        
+    def _save(self) -> None:
+        with self._lock:
+            data = {
+                "fetched_at": datetime.datetime.fromtimestamp(self._fetched_at, datetime.timezone.utc).isoformat(),
+                "assets": {name: asdict(asset_info) for name, asset_info in self._assets.items()},
+            }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        
+        # write to a temporary file first, so a crash never leaves half a file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,250 @@
+# standard libraries
+import os
+import time
+import asyncio
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# finance_gpt imports
+from finance_gpt import TOP_LEVEL_DIR, setup_logger
+
+logger = setup_logger(__name__)
+
+# upper bounds of the latency buckets in seconds, from a mongo lookup to a slow gpt answer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if len(items) == 0:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in items) + "}"
+
+class Counter():
+    """Monotonic counter per label set."""
+    
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+        
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+            
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram():
+    """Latency histogram per label set, with cumulative buckets like prometheus."""
+    
+    def __init__(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += 1
+            entry[-1] += value
+            
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+            
+    def summary(self, **labels) -> dict:
+        """Gets the count and sum of one label set."""
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            if entry is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": entry[-2], "sum": entry[-1]}
+            
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {entry[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {entry[-1]}")
+        return lines
+
+class MetricsRegistry():
+    
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+        
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(name, description))
+        
+    def histogram(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+        
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+            
+    def render(self) -> str:
+        """Renders all metrics in the prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+# metrics of the process
+REGISTRY = MetricsRegistry()
+CALLS = REGISTRY.counter("finance_gpt_calls_total", "Calls per component and operation, by status.")
+DURATION = REGISTRY.histogram("finance_gpt_duration_seconds", "Latency per component and operation.")
+ITEMS = REGISTRY.counter("finance_gpt_items_total", "Items (articles, urls, orders) that went through a stage.")
+TOKENS = REGISTRY.counter("finance_gpt_openai_tokens_total", "OpenAI tokens per model and kind (prompt or completion).")
+
+@contextmanager
+def track(component: str, operation: str):
+    """Counts and times one call, calls that raise count with status error."""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        DURATION.observe(time.perf_counter() - start, component=component, operation=operation)
+        CALLS.inc(component=component, operation=operation, status=status)
+
+def instrument(component: str, operation: str = None):
+    """Decorator version of track, works for functions and coroutine functions."""
+    def decorator(func):
+        name = operation or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(component, name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+            
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(component, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_token_usage(model: str, usage) -> None:
+    """Counts the tokens of an OpenAI response, responses without usage are ignored."""
+    if usage is None:
+        return
+    TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+    TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+
+
+class MetricsExporter():
+    """Exposes the metrics as prometheus text over http (/metrics) and/or in a file rewritten every interval seconds."""
+    
+    def __init__(self, port: int = None, path: str = None, interval: float = 60.0, registry: MetricsRegistry = REGISTRY) -> None:
+        self.port = port
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        
+        self._server = None
+        self._stop = threading.Event()
+        self._threads = []
+        
+    def start(self) -> None:
+        if self.port is not None:
+            registry = self.registry
+            
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    
+                def log_message(self, format, *args):
+                    pass
+                    
+            self._server = ThreadingHTTPServer(("0.0.0.0", self.port), Handler)
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True))
+            logger.info(f"Serving metrics on port {self.port}.")
+            
+        if self.path is not None:
+            self._threads.append(threading.Thread(target=self._write_periodically, name="metrics-file", daemon=True))
+            
+        for thread in self._threads:
+            thread.start()
+            
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+        if self.path is not None:
+            self.write()
+            
+    def write(self) -> None:
+        """Writes the metrics file, through a temporary file so readers never see half of it."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+        
+    def _write_periodically(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                logger.exception(f"Failed to write the metrics to {self.path}.")
+
+def start_exporter(config: dict) -> MetricsExporter:
+    """Starts the exporter of the metrics section of config.json, None if it exports nowhere."""
+    port = config.get("port")
+    path = config.get("file", os.path.join(TOP_LEVEL_DIR, "logs", "metrics.prom"))
+    if port is None and path is None:
+        return None
+    exporter = MetricsExporter(port=port, path=path, interval=config.get("interval", 60.0))
+    exporter.start()
+    return exporter
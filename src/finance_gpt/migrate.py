@@ -0,0 +1,24 @@
+from finance_gpt import setup_logger
+from finance_gpt.mongodb import MongoDBWrapper
+from finance_gpt.utils import load_config
+
+logger = setup_logger("migrate")
+
+if __name__ == "__main__":
+    
+    # the unique url index can only be built once duplicates are removed
+    db = MongoDBWrapper(config={**load_config().get("mongodb", {}), "ensure_indexes": False})
+    
+    # articles were stored once per ticker chunk that returned them
+    logger.info("Removing stored news articles with duplicate urls.")
+    deleted = db.remove_duplicate_urls()
+    logger.info(f"Removed {deleted} news articles with duplicate urls.")
+    print(f"Removed {deleted} news articles with duplicate urls.")
+    
+    db.ensure_indexes()
+    
+    # add the published_at datetime to articles stored before it existed
+    logger.info("Backfilling published_at of stored news articles.")
+    updated = db.backfill_published_at()
+    logger.info(f"Backfilled published_at of {updated} news articles.")
+    print(f"Backfilled published_at of {updated} news articles.")
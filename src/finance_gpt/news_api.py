@@ -1,15 +1,27 @@
 # standard libraries
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 import requests
+from requests.adapters import HTTPAdapter
 # finance_gpt imports
 from finance_gpt.utils import load_credentials, load_tickers, setup_logger
+from finance_gpt.metrics import instrument, track
 from finance_gpt.structures import Symbol
 
 logger = setup_logger(__name__)
 
+# date format of the news api, e.g. 'Mon, 01 Jan 2024 09:30:00 -0500'
+NEWS_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S %z'
+
+def parse_news_date(date_str: str) -> datetime.datetime:
+    """Parses a date of the news api."""
+    return datetime.datetime.strptime(date_str, NEWS_DATE_FORMAT)
+
 class GPTSentiment(Enum):
     YES = 1
     UNKNOWN = 0
@@ -36,7 +48,7 @@ class NewsArticle:
         """Creates a NewsArticle from a dictionary."""
         
         # parse date
-        date_object = datetime.datetime.strptime(data["date"], '%a, %d %b %Y %H:%M:%S %z')
+        date_object = parse_news_date(data["date"])
         
         return cls(
             company=Symbol[ticker],
@@ -55,8 +67,11 @@ class NewsArticle:
     def from_db(cls, data: dict, ticker: str = None):
         """Creates a NewsArticle from a dictionary."""
         
-        # parse date
-        date_object = datetime.datetime.strptime(data["date"], '%a, %d %b %Y %H:%M:%S %z')
+        # stored as utc datetime, older entries only have the date string
+        if "published_at" in data:
+            date_object = data["published_at"].replace(tzinfo=datetime.timezone.utc)
+        else:
+            date_object = parse_news_date(data["date"])
         
         return cls(
             company=Symbol[ticker],
@@ -85,13 +100,78 @@ class NewsArticle:
 
         return dict((k, convert_value(v)) for k, v in data)
 
+@dataclass
+class NewsCursor:
+    """High water mark of the ingested news, the latest article date and the urls with exactly that date."""
+    date: datetime.datetime
+    urls: list[str] = field(default_factory=list)
+    # url -> failed attempts of articles that hold the cursor back
+    attempts: dict[str, int] = field(default_factory=dict)
+    
+    def is_seen(self, news_dict: dict) -> bool:
+        """Checks if an article is at or behind the high water mark."""
+        date = parse_news_date(news_dict["date"])
+        return date < self.date or (date == self.date and news_dict["news_url"] in self.urls)
+        
+    @classmethod
+    def advance(cls, cursor, news: list[dict], failed: list[dict] = None, max_attempts: int = 3):
+        """Moves the cursor to the latest of the given news.
+        
+        The cursor does not move past the oldest failed article, so that it gets fetched again.
+        Articles that failed max_attempts times in a row are given up, so that one article that
+        always fails does not hold the cursor back forever.
+        """
+        previous_attempts = cursor.attempts if cursor is not None else {}
+        attempts = {}
+        blocking = []
+        for news_dict in failed or []:
+            url = news_dict["news_url"]
+            attempts[url] = previous_attempts.get(url, 0) + 1
+            if attempts[url] >= max_attempts:
+                logger.warning(f"Giving up on news article {url} after {attempts[url]} failed attempts.")
+                del attempts[url]
+            else:
+                blocking.append(news_dict)
+                
+        if len(blocking) > 0:
+            oldest_failed = min(parse_news_date(news_dict["date"]) for news_dict in blocking)
+            news = [news_dict for news_dict in news if parse_news_date(news_dict["date"]) < oldest_failed]
+            
+        for news_dict in news:
+            date = parse_news_date(news_dict["date"])
+            if cursor is None or date > cursor.date:
+                cursor = cls(date=date, urls=[news_dict["news_url"]])
+            elif date == cursor.date and news_dict["news_url"] not in cursor.urls:
+                cursor.urls.append(news_dict["news_url"])
+                
+        if cursor is not None:
+            cursor.attempts = attempts
+        return cursor
+
+class NewsApiError(Exception):
+    """Raised when the news api does not answer successfully after all retries."""
+
+
 class NewsApi():
     
-    def __init__(self):
-        # load in the api key
-        self.api_key = self._load_api_key()
-        # endpoint
-        self.url = "https://stocknewsapi.com/api/v1"
+    def __init__(self, max_workers: int = 4, max_retries: int = 5, backoff: float = 1.0, max_backoff: float = 30.0, timeout: float = 30.0, api_key: str = None, url: str = "https://stocknewsapi.com/api/v1"):
+        # load in the api key, unless one is given
+        self.api_key = api_key if api_key is not None else self._load_api_key()
+        # endpoint, can point to a local stand-in
+        self.url = url
+        
+        # fetching behaviour
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        
+        # pooled http session, reuses connections across chunks, pages and cycles
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def _load_api_key(self) -> str:
         """Loads the API key from the credentials file."""
@@ -101,57 +181,123 @@ class NewsApi():
         except:
             raise Exception("Not able to load in credentials, please make sure you have a credentials file with the correct format.")
     
+    @instrument("news_api")
     def get_news(self, tickers: list[str], time_interval_str: str) -> list[dict]:
+        """Gets all news of the given tickers, chunks of 50 tickers and their pages are fetched concurrently."""
         
-        data = []
+        # create ticker strings
+        chunks = [",".join(tickers[i:i + 50]) for i in range(0, len(tickers), 50)]
         
-        for i in range(len(tickers)//50+1):
-            # create ticker string
-            ticker_str = ""
-            for symb in tickers[i*50:(i+1)*50]:
-                ticker_str += symb + ","
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # first page of every chunk, tells how many pages there are
+            first_pages = list(executor.map(lambda ticker_str: self._get_page(ticker_str, time_interval_str, 1), chunks))
             
-            # get data
-            page_number = 1
-            done = False
-            max_retries = 5
-            while not done:
-                for _ in range(max_retries):
-                    params = {
-                        "tickers": ticker_str[:-1],
-                        "items": 100,
-                        "page": page_number,
-                        "date": time_interval_str,
-                        "token": self.api_key,
-                    }
-                    response = requests.get(self.url, params=params)
-                    logger.debug(f"response: {response}")
+            # all remaining pages
+            futures = []
+            for ticker_str, first_page in zip(chunks, first_pages):
+                if len(first_page["data"]) == 0:
+                    continue
+                for page_number in range(2, first_page["total_pages"] + 1):
+                    futures.append(executor.submit(self._get_page, ticker_str, time_interval_str, page_number))
                     
-                    if int(response.status_code) != 200:
-                        logger.error(f"News data was not able to load, retrying, status_code: {response.status_code}")
-                    else:
-                        break
-                
-                new_data = response.json()["data"]
+            data = []
+            for first_page in first_pages:
+                data += first_page["data"]
+            for future in futures:
+                data += future.result()["data"]
+
+        return data
+        
+    @instrument("news_api")
+    def get_news_since(self, tickers: list[str], cursor: NewsCursor, max_lookback: datetime.timedelta = datetime.timedelta(days=7)) -> list[dict]:
+        """Gets only the news after the cursor.
+        
+        Asks for the smallest date range that covers the cursor and stops paginating a chunk
+        as soon as it reaches articles that were already seen (the api returns the newest first).
+        """
+        
+        time_interval_str = self._interval_since(cursor.date, max_lookback)
+        logger.debug(f"Getting news since {cursor.date} with date {time_interval_str}.")
+        
+        # create ticker strings
+        chunks = [",".join(tickers[i:i + 50]) for i in range(0, len(tickers), 50)]
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda ticker_str: self._get_pages_since(ticker_str, time_interval_str, cursor), chunks))
+            
+        data = []
+        for result in results:
+            data += result
+            
+        return data
+        
+    def _get_pages_since(self, ticker_str: str, time_interval_str: str, cursor: NewsCursor) -> list[dict]:
+        
+        data = []
+        page_number = 1
+        while True:
+            page = self._get_page(ticker_str, time_interval_str, page_number)
+            
+            new_data = [news_dict for news_dict in page["data"] if not cursor.is_seen(news_dict)]
+            data += new_data
+            
+            # stop at already seen articles or at the last page
+            if len(new_data) < len(page["data"]) or len(page["data"]) == 0 or page_number >= page["total_pages"]:
+                return data
+            page_number += 1
+            
+    def _interval_since(self, since: datetime.datetime, max_lookback: datetime.timedelta) -> str:
+        """Gets the smallest date parameter of the api that covers everything since the given date."""
+        
+        now = datetime.datetime.now(pytz.utc)
+        elapsed = now - since
+        
+        # keep a minute of margin for clock differences
+        for minutes in (5, 10, 15, 30, 60):
+            if elapsed + datetime.timedelta(minutes=1) <= datetime.timedelta(minutes=minutes):
+                return f"last{minutes}min"
                 
-                # if new data is empty skip
-                if len(new_data) == 0:
-                    done = True
-                    continue
+        # the api works in eastern time
+        eastern = pytz.timezone("US/Eastern")
+        if elapsed > max_lookback:
+            logger.warning(f"Cursor {since} is older than {max_lookback}, only getting news of the last {max_lookback}.")
+            since = now - max_lookback
+        since_date = since.astimezone(eastern).date()
+        today = now.astimezone(eastern).date()
+        
+        if since_date == today:
+            return "today"
+        return f"{since_date:%m%d%Y}-{today:%m%d%Y}"
+        
+    def _get_page(self, ticker_str: str, time_interval_str: str, page_number: int) -> dict:
+        """Gets one page, retries with exponential backoff and jitter."""
+        
+        params = {
+            "tickers": ticker_str,
+            "items": 100,
+            "page": page_number,
+            "date": time_interval_str,
+            "token": self.api_key,
+        }
+        
+        for attempt in range(self.max_retries):
+            try:
+                with track("news_api", "get_page"):
+                    response = self.session.get(self.url, params=params, timeout=self.timeout)
+                logger.debug(f"response: {response}")
                 
-                # get total number of pages
-                pages = response.json()["total_pages"]
+                if int(response.status_code) == 200:
+                    return response.json()
+                    
+                logger.error(f"News data was not able to load, retrying, status_code: {response.status_code}")
+            except requests.RequestException:
+                logger.exception("News data was not able to load, retrying.")
                 
-                # add data
-                data += new_data
+            # wait before the next try, full jitter
+            if attempt < self.max_retries - 1:
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt)))
                 
-                # if data overflowed update page number
-                if page_number < pages:
-                    page_number += 1
-                else:
-                    done = True
-
-        return data
+        raise NewsApiError(f"News data was not able to load after {self.max_retries} tries, page: {page_number}, tickers: {ticker_str}")
 
 def load_all_news() -> dict[str:list[NewsArticle]]:
     """Loads all news from the last 24 hours."""
@@ -165,7 +311,7 @@ def load_all_news() -> dict[str:list[NewsArticle]]:
         news[ticker] = news_api.get_news(ticker)
     
     return news
-                   
+
 if __name__ == "__main__":
     news_api = NewsApi()
     tickers = load_tickers()
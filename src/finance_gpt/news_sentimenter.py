@@ -1,70 +1,160 @@
+import asyncio
 import datetime
+import dataclasses
 from finance_gpt import setup_logger
 from finance_gpt.scheduler import SentimentScheduler
-from finance_gpt.news_api import NewsApi, NewsArticle
+from finance_gpt.news_api import NewsApi, NewsApiError, NewsCursor, parse_news_date
 from finance_gpt.gpt import GPT
-from finance_gpt.utils import load_tickers
+from finance_gpt.sentiment_pipeline import SentimentPipeline
+from finance_gpt.sentiment_cache import SentimentCache
+from finance_gpt.dedup import NearDuplicateIndex
+from finance_gpt.utils import load_tickers, load_config
 from finance_gpt.mongodb import MongoDBWrapper
+from finance_gpt.metrics import track, ITEMS, start_exporter
 
 logger = setup_logger("news_sentimenter")
 
-if __name__ == "__main__":
+class NewsSentimenter():
+    """Fetches the news of every interval, sentiments the new ones and stores them.
     
-    # setup
-    logger.debug("Starting News Sentimenter.")
-    try:
+    The database can be shared with other components of the same process, the news api and
+    the model can be replaced (e.g. by clients of local stand-ins).
+    """
+    
+    def __init__(self, db: MongoDBWrapper = None, config: dict = None, news_api: NewsApi = None, gpt: GPT = None) -> None:
+        # config
+        if config is None:
+            config = load_config().get("news_sentimenter", {})
         # timer
-        scheduler = SentimentScheduler(interval=15)
+        self.scheduler = SentimentScheduler(interval=config.get("interval", 15), pipelined=config.get("pipelined", False))
         # news api
-        news_api = NewsApi()
+        if news_api is None:
+            news_api_config = load_config().get("news_api", {})
+            news_api = NewsApi(
+                max_workers=news_api_config.get("max_workers", 4),
+                max_retries=news_api_config.get("max_retries", 5),
+                backoff=news_api_config.get("backoff", 1.0),
+            )
+        self.news_api = news_api
         # sentiment model
-        gpt = GPT()
+        self.gpt = gpt if gpt is not None else GPT()
         # mongodb wrapper
-        db = MongoDBWrapper()
+        self.db = db if db is not None else MongoDBWrapper()
+        if config.get("url_filter_capacity", 1000000) is not None:
+            self.db.enable_url_filter(capacity=config.get("url_filter_capacity", 1000000))
         # load in all tickers to look at
-        tickers = load_tickers()
+        self.tickers = load_tickers()
+        # sentiment cache, drop entries of older models and prompts
+        cache = SentimentCache(self.db, self.gpt.model_name, self.gpt.prompt_version, max_size=config.get("cache_size", 10000))
+        cache.prune()
+        # near duplicate headlines of the last 24 hours
+        dedup_index = None
+        if config.get("dedup_threshold", 0.7) is not None:
+            dedup_index = NearDuplicateIndex(threshold=config.get("dedup_threshold", 0.7))
+        # date of the latest processed news
+        self.newest = None
+        # failed cycles after which an article no longer holds the cursor back
+        self.max_attempts = config.get("max_attempts", 3)
+        # sentiment stage
+        self.pipeline = SentimentPipeline(self.gpt, self.db, self.tickers, max_concurrency=config.get("max_concurrency", 8), multi_ticker=config.get("multi_ticker", True), cache=cache, dedup_index=dedup_index)
+        
+    async def run_cycle(self, prefetched: asyncio.Task = None) -> asyncio.Task:
+        """Processes the news since the persisted cursor, blocking calls run in threads.
+        
+        Takes the news from prefetched if given. When pipelining, returns the fetch of the next
+        window, which starts at its boundary even if this cycle is still sentimenting.
+        """
+        # load only the news since the persisted cursor, the last 30 minutes on the first start
+        logger.debug("Loading news.")
+        cursor = await asyncio.to_thread(self.db.get_news_cursor, "stocknewsapi")
+        try:
+            news = await (prefetched if prefetched is not None else self._fetch(cursor))
+        except NewsApiError:
+            logger.exception("Failed to load news, skipping this interval.")
+            return None
+            
+        # find the urls that are not yet processed
+        with track("sentimenter", "url_dedup"):
+            new_urls = set(await asyncio.to_thread(self.db.get_new_urls, [news_dict["news_url"] for news_dict in news]))
+        ITEMS.inc(len(news), stage="news_fetched")
+        ITEMS.inc(len(new_urls), stage="news_new")
+        
+        # sentiment news that are not yet processed
+        new_news = [news_dict for news_dict in news if news_dict["news_url"] in new_urls]
+        
+        # start fetching the next window behind the articles still being sentimented, so that failed
+        # ones are fetched again, already processed news it contains are filtered out then
+        prefetch = None
+        if self.scheduler.pipelined:
+            prefetch = asyncio.create_task(self._fetch_at(self.scheduler.window_end, self._provisional_cursor(cursor, news, new_news)))
+            
+        logger.debug("Sentimenting news.")
+        try:
+            with track("sentimenter", "pipeline"):
+                failed = await self.pipeline.run(new_news)
+            ITEMS.inc(len(failed), stage="news_failed")
+        except BaseException:
+            if prefetch is not None:
+                prefetch.cancel()
+            raise
+        
+        # move the cursor, failed articles are fetched again in the next cycle
+        next_cursor = NewsCursor.advance(cursor, news, failed=failed, max_attempts=self.max_attempts)
+        if next_cursor is not None:
+            await asyncio.to_thread(self.db.set_news_cursor, "stocknewsapi", next_cursor)
+            self.newest = next_cursor.date
+            
+        return prefetch
+        
+    @staticmethod
+    def _provisional_cursor(cursor: NewsCursor, news: list[dict], in_flight: list[dict]) -> NewsCursor:
+        """Gets the cursor moved over the news older than every article in flight, the given cursor is left as is."""
+        if len(in_flight) > 0:
+            oldest_in_flight = min(parse_news_date(news_dict["date"]) for news_dict in in_flight)
+            news = [news_dict for news_dict in news if parse_news_date(news_dict["date"]) < oldest_in_flight]
+        if cursor is not None:
+            cursor = dataclasses.replace(cursor, urls=list(cursor.urls), attempts=dict(cursor.attempts))
+        return NewsCursor.advance(cursor, news)
+        
+    async def _fetch(self, cursor: NewsCursor) -> list[dict]:
+        if cursor is None:
+            return await asyncio.to_thread(self.news_api.get_news, self.tickers, time_interval_str="last30min")
+        return await asyncio.to_thread(self.news_api.get_news_since, self.tickers, cursor)
+        
+    async def _fetch_at(self, moment: datetime.datetime, cursor: NewsCursor) -> list[dict]:
+        await asyncio.sleep(max(0.0, (moment - datetime.datetime.now(datetime.timezone.utc)).total_seconds()))
+        return await self._fetch(cursor)
+        
+    async def run(self) -> None:
+        """Runs a cycle every interval, forever. Cycles that overran are followed right away by a catch up cycle."""
+        prefetch = None
+        while True:
+            self.scheduler.start_cycle()
+            with track("sentimenter", "cycle"):
+                prefetch = await self.run_cycle(prefetch)
+            self.scheduler.finish_cycle(self.newest)
+            logger.info(f"Sentiment cycle lag: {self.scheduler.stats()}")
+            
+            # sleep until next interval
+            logger.debug("Sleeping until next interval")
+            await asyncio.sleep(self.scheduler.seconds_until_next())
+
+async def main() -> None:
+    
+    # setup
+    logger.debug("Starting News Sentimenter.")
+    try:
+        sentimenter = NewsSentimenter()
+        start_exporter(load_config().get("metrics", {}))
     except:
         logger.exception("Failed to setup news sentimenter")
         exit()
     
     # main loop
     try:
-        while True:
-            # load news
-            logger.debug("Loading news.")
-            # TODO change to last 15 min
-            news = news_api.get_news(tickers, time_interval_str="last30min")
-                        
-            # load in all urls from this day minutes
-            processed_urls = db.get_urls(time_frame=datetime.timedelta(days=1))
-            
-            # sentiment news that are not yet processed
-            logger.debug("Sentimenting news.")
-            for news_dict in news:
-                if news_dict["news_url"] not in processed_urls:
-                    # copy the news_dict
-                    news_dict_copy = news_dict.copy()
-                    news_dict_copy["gpt_sentiment"] = {}
-                    news_dict_copy["gpt_verdict"] = {}
-                                        
-                    # sentiment article for every relevant company
-                    for ticker in news_dict["tickers"]:
-                        if ticker in tickers:
-                            # convert news dict to news article
-                            news_article = NewsArticle.from_dict(news_dict, ticker)
-                            # sentiment it using chat gpt
-                            gpt.get_sentiment(news_article, term="short")
-                            
-                            # save sentiment in copy
-                            news_dict_copy["gpt_sentiment"][ticker] = news_article.gpt_sentiment.value
-                            news_dict_copy["gpt_verdict"][ticker] = news_article.gpt_verdict
-                    
-                    # save them in the database
-                    db.add_news_articles([news_dict_copy])
-            
-            # sleep until next interval
-            logger.debug("Sleeping until next interval")
-            scheduler.sleep()
-    
+        await sentimenter.run()
     except:
-        logger.exception("Failed in main loop of news sentimenter")
\ No newline at end of file
+        logger.exception("Failed in main loop of news sentimenter")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+# standard libraries
+import time
+import threading
+from dataclasses import dataclass
+# finance_gpt imports
+from finance_gpt import setup_logger
+from finance_gpt.metrics import track
+# third party imports
+from alpaca.trading.client import TradingClient
+from alpaca.trading.stream import TradingStream
+
+logger = setup_logger(__name__)
+
+# an order in one of these states does not change anymore
+FINAL_STATUSES = {"filled", "canceled", "expired", "rejected", "done_for_day", "replaced", "stopped", "suspended"}
+
+@dataclass
+class OrderState:
+    order_id: str
+    status: str
+    filled_qty: float = 0.0
+    
+    @classmethod
+    def from_alpaca_order(cls, order):
+        status = order.status.value if hasattr(order.status, "value") else str(order.status)
+        return cls(order_id=str(order.id), status=status, filled_qty=float(order.filled_qty or 0))
+        
+    @property
+    def is_final(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+class OrderTracker():
+    """Tracks the state of orders with the trade updates stream, polling the REST api as fallback.
+    
+    The stream runs in a background thread and wakes up waiting threads on every update, so a
+    wait returns as soon as the last order is filled. Orders the stream did not report on within
+    poll_interval seconds (e.g. while it reconnects) are requested over the REST api.
+    """
+    
+    def __init__(self, trading_client: TradingClient, stream: TradingStream = None, poll_interval: float = 10.0) -> None:
+        self.trading_client = trading_client
+        self.stream = stream
+        self.poll_interval = poll_interval
+        
+        # order id -> latest known state
+        self._states = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        
+    def start(self) -> None:
+        """Starts listening to the trade updates stream in a background thread."""
+        if self.stream is None or self._thread is not None:
+            return
+        self.stream.subscribe_trade_updates(self._on_trade_update)
+        self._thread = threading.Thread(target=self.stream.run, name="trade-updates", daemon=True)
+        self._thread.start()
+        
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        try:
+            self.stream.stop()
+        except Exception:
+            logger.exception("Failed to stop the trade updates stream.")
+        self._thread.join(timeout=10)
+        self._thread = None
+        
+    async def _on_trade_update(self, trade_update) -> None:
+        logger.debug(f"Trade update: {trade_update.event} for order {trade_update.order.id}.")
+        self._update(OrderState.from_alpaca_order(trade_update.order))
+        
+    def _update(self, state: OrderState) -> None:
+        with self._condition:
+            # an update of the stream can overtake a poll
+            known = self._states.get(state.order_id)
+            if known is not None and known.is_final and not state.is_final:
+                return
+            self._states[state.order_id] = state
+            self._condition.notify_all()
+            
+    def get(self, order_id: str) -> OrderState:
+        with self._condition:
+            return self._states.get(order_id)
+            
+    def wait(self, order_ids: list[str], timeout: float = None) -> dict[str, OrderState]:
+        """Waits until all given orders are in a final state or the timeout is over.
+        
+        Returns the latest known state of every order, orders without any state are left out.
+        """
+        order_ids = set(order_ids)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        # without a stream every wake up is a poll
+        poll_at = time.monotonic() if self.stream is None else time.monotonic() + self.poll_interval
+        
+        with self._condition:
+            while True:
+                pending = [order_id for order_id in order_ids if order_id not in self._states or not self._states[order_id].is_final]
+                if len(pending) == 0:
+                    break
+                    
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    logger.warning(f"Timed out waiting for {len(pending)} orders.")
+                    break
+                    
+                if now >= poll_at:
+                    # ask the api without holding the lock, the stream keeps updating meanwhile
+                    self._condition.release()
+                    try:
+                        self._poll(pending)
+                    finally:
+                        self._condition.acquire()
+                    poll_at = time.monotonic() + self.poll_interval
+                    continue
+                    
+                wake_up = poll_at if deadline is None else min(poll_at, deadline)
+                self._condition.wait(timeout=wake_up - now)
+                
+            return {order_id: self._states[order_id] for order_id in order_ids if order_id in self._states}
+            
+    def forget(self, order_ids: list[str]) -> None:
+        """Drops the states of orders that are not needed anymore."""
+        with self._condition:
+            for order_id in order_ids:
+                self._states.pop(order_id, None)
+                
+    def _poll(self, order_ids: list[str]) -> None:
+        logger.debug(f"Polling the state of {len(order_ids)} orders.")
+        for order_id in order_ids:
+            try:
+                with track("alpaca", "get_order_by_id"):
+                    order = self.trading_client.get_order_by_id(order_id)
+                self._update(OrderState.from_alpaca_order(order))
+            except Exception:
+                logger.exception(f"Failed to poll the state of order {order_id}.")
@@ -1,54 +1,37 @@
 import datetime
 from finance_gpt.portfolio_manager import Portfolio, PortfolioManager
 from finance_gpt.mongodb import MongoDBWrapper
+from finance_gpt.scoring import DEFAULT_PARAMETERS, score_sentiments, select_stocks
+from finance_gpt.metrics import instrument
 from finance_gpt import setup_logger
 
 import pandas as pd
 
 class Policy():
     
-    def __init__(self, name: str, parameters: dict) -> None:
+    def __init__(self, name: str, parameters: dict, db: MongoDBWrapper = None, pm: PortfolioManager = None) -> None:
         self.name = name
-        self.parameters = parameters
+        self.parameters = {**DEFAULT_PARAMETERS, **parameters}
         self.logger = setup_logger(f"Policy-{self.name}")
         self.logger.info(f"Starting up policy: {self.name} with parameters: {self.parameters}")
         
-        self.db = MongoDBWrapper()
-        self.pm = PortfolioManager()
+        # clients can be shared with other components of the same process
+        self.db = db if db is not None else MongoDBWrapper()
+        self.pm = pm if pm is not None else PortfolioManager()
     
+    @instrument("policy")
     def get_portfolio(self) -> Portfolio:
         
-        AMOUNT_OF_STOCKS = 15
-        
-        # get the news
-        news = self.db.get_news_articles(time_frame=datetime.timedelta(days=1))
-        
         # calculate sentiment score
         self.logger.debug("Calculating sentiment score.")
-        scores = {}
-        for key, value in news.items():
-            scores[key] = 0
-            counter = 0
-            for news_article in value:
-                scores[key] += news_article.gpt_sentiment.value
-                counter += 1
-                
-            if counter == 0:
-                del scores[key]
-            else:
-                scores[key] /= counter
-        
-        # get the best stocks (AMOUNT_OF_STOCKS)
-        self.logger.debug(f"Getting the {AMOUNT_OF_STOCKS} best stocks.")
-        score_df = pd.DataFrame.from_dict(scores, orient="index", columns=["score"])
-        score_df["absolute_score"] = abs(score_df["score"])
-        sorted_score_df = score_df.sort_values(by="absolute_score", ascending=False)
-        new_stocks = sorted_score_df.iloc[:AMOUNT_OF_STOCKS, :]
-        self.logger.debug(f"New stocks: {new_stocks}")
+        scores = self.get_scores()
+        self.logger.debug(f"Sentiment scores of {len(scores)} tickers from {scores['count'].sum()} sentiments.")
         
-        # cut the scores to have a absolute value bigger than 0.7
-        self.logger.debug("Cutting the scores to have a absolute value bigger than 0.7.")
-        new_stocks = new_stocks[new_stocks["absolute_score"] >= 0.7]
+        # get the best stocks with a high enough absolute score
+        amount_of_stocks = self.parameters["amount_of_stocks"]
+        threshold = self.parameters["threshold"]
+        self.logger.debug(f"Getting the {amount_of_stocks} best stocks with an absolute score of at least {threshold}.")
+        new_stocks = select_stocks(scores, amount_of_stocks, threshold)
         self.logger.debug(f"New stocks: {new_stocks}")
         
         # create the portfolio
@@ -58,7 +41,24 @@ class Policy():
         
         return new_portfolio
         
+    def get_scores(self) -> pd.DataFrame:
+        """Scores every ticker, returns a DataFrame indexed by ticker with the columns score and count."""
+        time_frame = datetime.timedelta(hours=self.parameters["time_frame_hours"])
         
+        # plain means can be aggregated by the database, weighted ones need the single sentiments
+        if self.parameters["half_life_hours"] is None and not self.parameters["source_weights"]:
+            scores = self.db.get_sentiment_scores(time_frame=time_frame)
+            return scores[scores["count"] >= self.parameters["min_articles"]]
+            
+        records = self.db.get_sentiment_records(time_frame=time_frame)
+        return score_sentiments(
+            records,
+            half_life_hours=self.parameters["half_life_hours"],
+            source_weights=self.parameters["source_weights"],
+            min_articles=self.parameters["min_articles"],
+        )
+
+
 if __name__ == "__main__":
     policy = Policy(name="test", parameters={})
     
@@ -1,62 +1,227 @@
 # standard libraries
-import time
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 # finance_gpt imports
 from finance_gpt import setup_logger
 from finance_gpt.structures import Portfolio, Position, Symbol, PositionSide
-from finance_gpt.utils import load_credentials
+from finance_gpt.utils import load_credentials, load_config
+from finance_gpt.market_data import PriceCache, AssetCache
+from finance_gpt.metrics import track, ITEMS
+from finance_gpt.order_tracker import OrderTracker, OrderState
+from finance_gpt.rebalance import RebalanceAction, PlannedOrder, OrderResult, RebalanceReport, plan_rebalance, unfilled_flips, DEFAULT_MIN_TRADE_VALUE
 # third party imports
 from alpaca.trading.client import TradingClient
-from alpaca.trading.requests import MarketOrderRequest, GetOrdersRequest
-from alpaca.trading.enums import TimeInForce, QueryOrderStatus
+from alpaca.trading.stream import TradingStream
+from alpaca.trading.requests import MarketOrderRequest
+from alpaca.trading.enums import TimeInForce
 from alpaca.data.historical import StockHistoricalDataClient
-from alpaca.data.requests import StockLatestBarRequest
 import pandas as pd
 
 logger = setup_logger(__name__)
 
+def size_portfolio(stock_table: pd.DataFrame, amount: float, get_price: Callable[[Symbol], float], is_shortable: Callable[[Symbol], bool], is_tradable: Callable[[Symbol], bool] = None, is_fractionable: Callable[[Symbol], bool] = None) -> Portfolio:
+    """Splits the money equally over the stocks of a buy list, shorts are rounded to whole stocks.
+    
+    Prices and asset flags are looked up with the given functions, so that the same sizing
+    can run against the live api or a price history. Without is_tradable and is_fractionable
+    every stock counts as tradable and fractionable.
+    """
+    
+    # instantiate new portfolio
+    portfolio = Portfolio()
+    
+    # calculate the amount of stocks
+    num_stocks = len(stock_table)
+    
+    # add the positions to the portfolio
+    for index, row in stock_table.iterrows():
+        # get the symbol
+        symbol = Symbol.from_string(index)
+        
+        logger.debug("Adding position for symbol %s.", symbol)
+        logger.debug("Money available: %s, number of stocks: %s.", amount, num_stocks)
+        
+        # orders of untradable stocks would be rejected
+        if is_tradable is not None and not is_tradable(symbol):
+            logger.debug("Symbol is not tradable, not adding position to new portfolio.")
+            num_stocks -= 1
+            continue
+        
+        # get side
+        if row["score"] < 0:
+            side = PositionSide.SHORT
+        else:
+            side = PositionSide.LONG
+        logger.debug("Side: %s", side)
+        
+        # get the amount of stocks
+        stock_price = get_price(symbol)
+        stock_amount = (amount / num_stocks) / stock_price
+        logger.debug("Stock price: %s, stock amount: %s", stock_price, stock_amount)
+        
+        # if the side is short, round the amount of stocks (can only be integer)
+        if side == PositionSide.SHORT:
+            logger.debug("Shorting Stock -> need to have rounded stock amount.")
+            
+            # calculate the amount of stocks
+            rounded_stock_amount = round(stock_amount)
+            logger.debug("Rounded stock amount: %s", rounded_stock_amount)
+            
+            if rounded_stock_amount == 0:
+                logger.debug("Rounded stock amount is 0, not adding position to new portfolio.")
+                continue
+                
+            # check if symbol is shortable
+            if not is_shortable(symbol):
+                logger.debug("Symbol is not shortable, not adding position to new portfolio.")
+                continue
+                
+            stock_amount = rounded_stock_amount
+            
+        # stocks without fractional trading can only be bought whole
+        elif is_fractionable is not None and not is_fractionable(symbol):
+            logger.debug("Symbol is not fractionable -> need to have whole stock amount.")
+            stock_amount = int(stock_amount)
+            
+            if stock_amount == 0:
+                logger.debug("Whole stock amount is 0, not adding position to new portfolio.")
+                continue
+            
+        # add the position to the portfolio
+        portfolio.add(Position(
+            symbol=symbol,
+            amount=stock_amount,
+            side=side)
+        )
+        logger.debug("Added position for symbol %s to new portfolio, amount: %s, side: %s.", symbol, stock_amount, side)
+        
+        # update the amount and number of stocks
+        amount -= stock_amount * stock_price
+        num_stocks -= 1
+        
+    return portfolio
+
 class PortfolioManager():
     
-    def __init__(self) -> None:
-        # setup of alpaca api
-        key, secret = self._load_credentials()
-        self.trading_client = TradingClient(
+    def __init__(self, config: dict = None, trading_client: TradingClient = None, data_client: StockHistoricalDataClient = None, stream: TradingStream = None) -> None:
+        # settings, taken from the portfolio_manager section of config.json by default
+        if config is None:
+            config = load_config().get("portfolio_manager", {})
+            
+        # setup of alpaca api, given clients (e.g. of local stand-ins) are used as they are
+        key, secret = None, None
+        if trading_client is None or data_client is None or (stream is None and config.get("trade_stream", True)):
+            key, secret = self._load_credentials()
+        self.trading_client = trading_client if trading_client is not None else TradingClient(
             api_key=key,
             secret_key=secret,
         )
-        self.account = self.trading_client.get_account()
-        self.data_client = StockHistoricalDataClient(
+        with track("alpaca", "get_account"):
+            self.account = self.trading_client.get_account()
+        self.data_client = data_client if data_client is not None else StockHistoricalDataClient(
             api_key=key,
             secret_key=secret,
         )
+        # latest prices, shared by create_portfolio and update
+        self.price_cache = PriceCache(self.data_client, ttl=config.get("price_ttl", 60.0))
+        # tradable, shortable and fractionable flags of all symbols
+        self.asset_cache = AssetCache(self.trading_client, ttl=config.get("asset_ttl", 24 * 60 * 60), path=config.get("asset_cache_path"))
+        
+        # rebalancing
+        self.order_workers = config.get("order_workers", 4)
+        self.min_trade_value = config.get("min_trade_value", DEFAULT_MIN_TRADE_VALUE)
+        
+        # fills of submitted orders are pushed by the trade updates stream, polled as fallback
+        if stream is None and config.get("trade_stream", True):
+            stream = TradingStream(api_key=key, secret_key=secret, paper=True, url_override=config.get("trade_stream_url"))
+        self.order_tracker = OrderTracker(self.trading_client, stream, poll_interval=config.get("fill_poll_interval", 10.0))
+        self.order_tracker.start()
+        self.fill_timeout = config.get("fill_timeout", None)
         
         # setup of portfolio
         self.portfolio = Portfolio()
         self._sync_portfolio()
         
-    def update(self, new_portfolio: Portfolio) -> None:
-        """Updates the portfolio according to the new portfolio."""
+    def update(self, new_portfolio: Portfolio) -> RebalanceReport:
+        """Updates the portfolio according to the new portfolio.
+        
+        Only the difference per symbol is traded. Orders that free capital (close, reduce, the close
+        of a flip) are sent first, the others once those are filled. Independent orders are sent
+        concurrently. The open of a flip is skipped if its close did not fill. Returns a report of
+        all orders.
+        """
         # sync the portfolio
         self._sync_portfolio()
         
-        # close all positions that are not in the new portfolio
-        for old_position in self.portfolio.positions:
-            if not new_portfolio.in_portfolio(old_position):
-                self.trading_client.close_position(old_position.symbol.name)
-                self.portfolio.remove(old_position)
-                
-        # wait for all orders to be filled
-        self._wait_for_orders()
+        # plan the minimal orders, only resizes need a price
+        diff = self.portfolio.diff(new_portfolio)
+        prices = self.price_cache.get_prices([new.symbol for _, new in diff.resized]) if self.min_trade_value > 0 and len(diff.resized) > 0 else None
+        orders, unchanged = plan_rebalance(diff, prices=prices, min_trade_value=self.min_trade_value)
+        logger.debug("Planned orders: %s, unchanged: %s", orders, unchanged)
+        
+        report = RebalanceReport(unchanged=unchanged)
+        
+        # free capital first, the other orders are sent as soon as all of those are filled
+        for phase in (True, False):
+            phase_orders = [order for order in orders if order.action.frees_capital == phase]
+            
+            # the old side of a flip whose close did not fill is still held
+            held_back = unfilled_flips(report.results)
+            for order in phase_orders:
+                if order.action == RebalanceAction.FLIP_OPEN and order.symbol in held_back:
+                    report.results.append(OrderResult(order=order, error=f"Skipped, the close of the flip of {order.symbol.name} did not fill."))
+            phase_orders = [order for order in phase_orders if not (order.action == RebalanceAction.FLIP_OPEN and order.symbol in held_back)]
+            
+            if len(phase_orders) > 0:
+                phase_results = self._submit_orders(phase_orders)
+                report.results += phase_results
                 
-        # open all positions that are not in the old portfolio
-        for new_position in new_portfolio.positions:
-            if not self.portfolio.in_portfolio(new_position):
+                # record what was filled
+                states = self._wait_for_orders([result.order_id for result in phase_results if result.order_id is not None])
+                for result in phase_results:
+                    if result.order_id in states:
+                        result.status = states[result.order_id].status
+                        result.filled_qty = states[result.order_id].filled_qty
+                        
+        self.order_tracker.forget([result.order_id for result in report.results if result.order_id is not None])
+        
+        self._sync_portfolio()
+        logger.info("Rebalanced portfolio: %s", report.summary())
+        for result in report.failed:
+            logger.error("Order %s failed: %s", result.order, result.error)
+            
+        return report
+        
+    def _submit_orders(self, orders: list[PlannedOrder]) -> list[OrderResult]:
+        """Submits independent orders concurrently, failed orders are reported instead of raised."""
+        if len(orders) == 0:
+            return []
+            
+        with ThreadPoolExecutor(max_workers=self.order_workers) as executor:
+            return list(executor.map(self._submit_order, orders))
+            
+    def _submit_order(self, order: PlannedOrder) -> OrderResult:
+        result = OrderResult(order=order)
+        try:
+            if order.action in (RebalanceAction.CLOSE, RebalanceAction.FLIP_CLOSE):
+                # closing the whole position does not leave fractional leftovers
+                with track("alpaca", "close_position"):
+                    submitted = self.trading_client.close_position(order.symbol.name)
+            else:
                 market_order_data = MarketOrderRequest(
-                    symbol=new_position.symbol.name,
-                    qty=new_position.amount,
-                    side=new_position.side.to_alpaca_order_side(),
+                    symbol=order.symbol.name,
+                    qty=order.qty,
+                    side=order.side,
                     time_in_force=TimeInForce.DAY
                 )
-                self.trading_client.submit_order(order_data=market_order_data)
+                with track("alpaca", "submit_order"):
+                    submitted = self.trading_client.submit_order(order_data=market_order_data)
+            result.order_id = str(submitted.id)
+            ITEMS.inc(stage="orders_submitted")
+        except Exception as e:
+            logger.exception("Failed to submit order %s.", order)
+            result.error = str(e)
+        return result
     
     def _sync_portfolio(self) -> None:
         """Syncs the positions in the portfolio with the positions in the Alpaca API."""
@@ -65,7 +230,8 @@ class PortfolioManager():
         self.portfolio.reset()
         
         # get positions from Alpaca API
-        alpaca_positions = self.trading_client.get_all_positions()
+        with track("alpaca", "get_all_positions"):
+            alpaca_positions = self.trading_client.get_all_positions()
         
         # convert to positions and add to portfolio
         for alpaca_position in alpaca_positions:
@@ -85,89 +251,30 @@ class PortfolioManager():
             print("credentials.json file does not contain alpaca credentials.")
             raise Exception
     
-    def _wait_for_orders(self) -> None:
-        """Waits for all orders to be filled."""
-        
-        # get all open orders
-        order_request_filter = GetOrdersRequest(status=QueryOrderStatus.OPEN)
-        open_orders = self.trading_client.get_orders(filter=order_request_filter)
-        
-        # wait for all open orders to be filled
-        while len(open_orders) > 0:
-            open_orders = self.trading_client.get_orders(filter=order_request_filter)
-            time.sleep(10)
+    def _wait_for_orders(self, order_ids: list[str]) -> dict[str, OrderState]:
+        """Waits for the given orders to be filled (or canceled, rejected, ...)."""
+        return self.order_tracker.wait(order_ids, timeout=self.fill_timeout)
     
     def create_portfolio(self, stock_table: pd.DataFrame) -> Portfolio:
         """Creates a portfolio from a buy list."""
-        logger.debug(f"Creating portfolio from stock table: {stock_table}")
-        
-        # instantiate new portfolio
-        portfolio = Portfolio()
+        logger.debug("Creating portfolio from stock table: %s", stock_table)
         
         # calculate buy power
         amount = float(self.account.portfolio_value) - 10
-        # calculate the amount of stocks
-        num_stocks = len(stock_table)
         
-        # add the positions to the portfolio
-        for index, row in stock_table.iterrows():
-            # get the symbol
-            symbol = Symbol.from_string(index)
-            
-            logger.debug(f"Adding position for symbol {symbol}.")
-            logger.debug(f"Money available: {amount}, number of stocks: {num_stocks}.")
-            
-            # get side
-            if row["score"] < 0:
-                side = PositionSide.SHORT
-            else:
-                side = PositionSide.LONG
-            logger.debug(f"Side: {side}")
-            
-            # get the amount of stocks
-            stock_price = self._get_price(symbol)
-            stock_amount = (amount / num_stocks) / stock_price
-            logger.debug(f"Stock price: {stock_price}, stock amount: {stock_amount}")
-            
-            # if the side is short, round the amount of stocks (can only be integer)
-            if side == PositionSide.SHORT:
-                logger.debug("Shorting Stock -> need to have rounded stock amount.")
-                
-                # calculate the amount of stocks
-                rounded_stock_amount = round(stock_amount)
-                logger.debug(f"Rounded stock amount: {rounded_stock_amount}")
-                
-                if rounded_stock_amount == 0:
-                    logger.debug("Rounded stock amount is 0, not adding position to new portfolio.")
-                    continue
-                
-                # check if symbol is shortable
-                if not self.trading_client.get_asset(symbol.name).shortable:
-                    logger.debug("Symbol is not shortable, not adding position to new portfolio.")
-                    continue
-                    
-                stock_amount = rounded_stock_amount
-    
-            # add the position to the portfolio
-            portfolio.add(Position(
-                symbol=symbol,
-                amount=stock_amount,
-                side=side)
-            )
-            logger.debug(f"Added position for symbol {symbol} to new portfolio, amount: {stock_amount}, side: {side}.")
-            
-            # update the amount and number of stocks
-            amount -= stock_amount * stock_price
-            num_stocks -= 1
+        # get all prices with one request, stocks without a price can not be sized
+        prices = self.price_cache.get_prices([Symbol.from_string(ticker) for ticker in stock_table.index])
+        stock_table = stock_table[[Symbol.from_string(ticker) in prices for ticker in stock_table.index]]
         
-        return portfolio
-    
-    def _get_price(self, symbol: Symbol) -> float:
-        """Gets the current price of a stock."""
-        rq_params = StockLatestBarRequest(symbol_or_symbols=symbol.name)
-        latest_bar = self.data_client.get_stock_latest_bar(request_params=rq_params)
-        return latest_bar[symbol.name].close
-     
+        return size_portfolio(
+            stock_table,
+            amount,
+            get_price=prices.__getitem__,
+            is_shortable=lambda symbol: self.asset_cache.get(symbol).shortable,
+            is_tradable=lambda symbol: self.asset_cache.get(symbol).tradable,
+            is_fractionable=lambda symbol: self.asset_cache.get(symbol).fractionable,
+        )
+
 if __name__ == "__main__":
     # test the portfolio manager
     pm = PortfolioManager()
@@ -177,4 +284,3 @@ if __name__ == "__main__":
     new_portfolio = pm.create_portfolio(new_stocks)
     
     pm.update(new_portfolio=new_portfolio)
-    
\ No newline at end of file
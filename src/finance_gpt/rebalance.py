@@ -0,0 +1,96 @@
+# standard libraries
+from enum import Enum
+from dataclasses import dataclass, field
+# finance_gpt imports
+from finance_gpt.structures import PortfolioDiff, Symbol
+# third party imports
+from alpaca.trading.enums import OrderSide as AlpacaOrderSide
+
+# resizes worth less than this (in dollars) are not traded, e.g. a fraction of a share left over by rounding
+DEFAULT_MIN_TRADE_VALUE = 1.0
+
+class RebalanceAction(Enum):
+    OPEN = "open"
+    INCREASE = "increase"
+    REDUCE = "reduce"
+    CLOSE = "close"
+    # a flip is planned as a close of the old side and an open of the new side
+    FLIP_CLOSE = "flip_close"
+    FLIP_OPEN = "flip_open"
+    
+    @property
+    def frees_capital(self) -> bool:
+        """Orders that free capital go first, the others wait until they are filled."""
+        return self in (RebalanceAction.REDUCE, RebalanceAction.CLOSE, RebalanceAction.FLIP_CLOSE)
+
+@dataclass
+class PlannedOrder:
+    symbol: Symbol
+    action: RebalanceAction
+    side: AlpacaOrderSide
+    qty: float
+
+@dataclass
+class OrderResult:
+    order: PlannedOrder
+    order_id: str = None
+    status: str = None
+    filled_qty: float = 0.0
+    error: str = None
+
+@dataclass
+class RebalanceReport:
+    results: list[OrderResult] = field(default_factory=list)
+    # symbols whose position was already close enough to the target
+    unchanged: list[Symbol] = field(default_factory=list)
+    
+    @property
+    def failed(self) -> list[OrderResult]:
+        return [result for result in self.results if result.error is not None]
+        
+    def summary(self) -> dict:
+        return {
+            "orders": len(self.results),
+            "failed": len(self.failed),
+            "filled": sum(1 for result in self.results if result.status == "filled"),
+            "unchanged": len(self.unchanged),
+            "actions": {action.value: sum(1 for result in self.results if result.order.action == action) for action in RebalanceAction},
+        }
+
+def _opposite(side: AlpacaOrderSide) -> AlpacaOrderSide:
+    return AlpacaOrderSide.SELL if side == AlpacaOrderSide.BUY else AlpacaOrderSide.BUY
+
+def unfilled_flips(results: list[OrderResult]) -> set[Symbol]:
+    """Symbols whose flip close did not fill, opening their new side would add up with the old one."""
+    return {result.order.symbol for result in results if result.order.action == RebalanceAction.FLIP_CLOSE and result.status != "filled"}
+
+def plan_rebalance(diff: PortfolioDiff, prices: dict[Symbol, float] = None, min_trade_value: float = DEFAULT_MIN_TRADE_VALUE) -> tuple[list[PlannedOrder], list[Symbol]]:
+    """Plans the minimal orders per symbol for the diff of the current to the target portfolio.
+    
+    Resizes worth less than min_trade_value (needs prices) are skipped.
+    Returns the planned orders and the symbols that are left unchanged.
+    """
+    orders = []
+    unchanged = [position.symbol for position in diff.unchanged]
+    
+    for old in diff.removed:
+        orders.append(PlannedOrder(old.symbol, RebalanceAction.CLOSE, _opposite(old.side.to_alpaca_order_side()), old.amount))
+        
+    for new in diff.added:
+        orders.append(PlannedOrder(new.symbol, RebalanceAction.OPEN, new.side.to_alpaca_order_side(), new.amount))
+        
+    for old, new in diff.flipped:
+        orders.append(PlannedOrder(old.symbol, RebalanceAction.FLIP_CLOSE, _opposite(old.side.to_alpaca_order_side()), old.amount))
+        orders.append(PlannedOrder(new.symbol, RebalanceAction.FLIP_OPEN, new.side.to_alpaca_order_side(), new.amount))
+        
+    for old, new in diff.resized:
+        delta = new.amount - old.amount
+        price = prices.get(new.symbol) if prices is not None else None
+        if price is not None and abs(delta) * price < min_trade_value:
+            unchanged.append(new.symbol)
+        elif delta > 0:
+            orders.append(PlannedOrder(new.symbol, RebalanceAction.INCREASE, new.side.to_alpaca_order_side(), delta))
+        else:
+            orders.append(PlannedOrder(new.symbol, RebalanceAction.REDUCE, _opposite(new.side.to_alpaca_order_side()), -delta))
+            
+    return orders, unchanged
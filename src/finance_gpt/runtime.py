@@ -0,0 +1,88 @@
+import asyncio
+from finance_gpt import setup_logger
+from finance_gpt.scheduler import Scheduler
+from finance_gpt.portfolio_manager import PortfolioManager
+from finance_gpt.policy import Policy
+from finance_gpt.mongodb import MongoDBWrapper
+from finance_gpt.news_sentimenter import NewsSentimenter
+from finance_gpt.utils import load_config
+from finance_gpt.metrics import start_exporter
+
+logger = setup_logger("runtime")
+
+class Runtime():
+    """Runs the news sentimenter and the daily trading job as tasks of one event loop.
+    
+    Both share one MongoDB client, the trading job and the policy share one portfolio manager.
+    Blocking calls run in threads, so neither job holds up the other.
+    """
+    
+    def __init__(self, config: dict = None) -> None:
+        if config is None:
+            config = load_config().get("runtime", {})
+        self.minutes_before_open = config.get("minutes_before_open", 5)
+        
+        # shared clients
+        self.db = MongoDBWrapper()
+        self.pm = PortfolioManager()
+        
+        self.scheduler = Scheduler()
+        self.policy = Policy(name=config.get("policy", "normal"), parameters=config.get("policy_parameters", {}), db=self.db, pm=self.pm)
+        self.sentimenter = NewsSentimenter(db=self.db)
+        
+    async def trade(self) -> None:
+        """Builds the portfolio shortly before the next open and trades it at the open."""
+        # sleep until market opens (some minutes before)
+        logger.debug(f"Sleeping until {self.minutes_before_open} minutes before market opens.")
+        await asyncio.sleep(self.scheduler.seconds_until_pre_open(self.minutes_before_open))
+        
+        # run policy
+        new_portfolio = await asyncio.to_thread(self.policy.get_portfolio)
+        
+        # wait for markets to open
+        logger.debug("Waiting for markets to open.")
+        await asyncio.sleep(self.scheduler.seconds_until_market_open())
+        
+        # update the portfolio accordingly
+        logger.debug("Updating the portfolio accordingly online")
+        await asyncio.to_thread(self.pm.update, new_portfolio)
+        logger.debug("Portfolio updated.")
+        
+    async def trade_forever(self) -> None:
+        while True:
+            try:
+                await self.trade()
+            except Exception:
+                logger.exception("Failed to trade, trying again in a minute.")
+                await asyncio.sleep(60)
+                
+    async def sentiment_forever(self) -> None:
+        while True:
+            try:
+                await self.sentimenter.run()
+            except Exception:
+                logger.exception("Failed in the news sentimenter, restarting it.")
+                await asyncio.sleep(60)
+                
+    async def run(self) -> None:
+        await asyncio.gather(self.sentiment_forever(), self.trade_forever())
+
+async def main() -> None:
+    
+    # setup
+    logger.debug("Starting Finance GPT runtime.")
+    try:
+        runtime = Runtime()
+        start_exporter(load_config().get("metrics", {}))
+    except:
+        logger.exception("Failed to setup runtime")
+        exit()
+        
+    # main loop
+    try:
+        await runtime.run()
+    except:
+        logger.exception("Failed in main loop of runtime")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,112 +1,170 @@
 import datetime
 import time
-import pytz
-import pandas_market_calendars as mcal
 
 from finance_gpt import setup_logger
+from finance_gpt.trading_calendar import TradingCalendar
+from finance_gpt.utils import load_config
 
 logger = setup_logger(__name__)
 
 class Scheduler():
+    """Sleeps until shortly before and until the open of the next trading session.
     
-    def __init__(self) -> None:
+    Wakeups are computed in utc from the cached trading calendar and slept against the monotonic
+    clock. The seconds_until_* methods give the same deadlines for use with asyncio.sleep.
+    """
+    
+    def __init__(self, calendar: TradingCalendar = None) -> None:
         logger.debug("Initializing Scheduler.")
+        if calendar is None:
+            config = load_config().get("scheduler", {})
+            calendar = TradingCalendar(exchange=config.get("exchange", "NASDAQ"), horizon_days=config.get("calendar_horizon_days", 365))
+        self.calendar = calendar
+        
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
     
     def _check_market_open(self) -> tuple[bool, datetime.datetime, datetime.datetime]:
         """Checks if the market is opens today."""
         try:
-            nasdaq = mcal.get_calendar('NASDAQ')
-            date_to_check = datetime.datetime.now().date()
-            schedule = nasdaq.schedule(start_date=date_to_check, end_date=date_to_check)
-
-            if not schedule.empty:            
-                return True, schedule.iloc[0]['market_open'].to_pydatetime(), schedule.iloc[0]['market_close'].to_pydatetime()
+            session = self.calendar.session(self.calendar.today(self._now()))
+            if session is not None:
+                return True, session[0], session[1]
             else:
                 return False, None, None
         except Exception as e:
             logger.exception("Error while checking if market is open.")
             return False, None, None
     
-    def sleep(self, minutes: int = 10):
-        """Sleeps until market opens again AM."""
+    def seconds_until_pre_open(self, minutes: int = 10) -> float:
+        """Seconds until the given minutes before the open of the next session, 0 if that moment has passed but the open has not."""
+        now = self._now()
+        market_open, _ = self.calendar.next_session(now)
+        return max(0.0, (market_open - datetime.timedelta(minutes=minutes) - now).total_seconds())
         
-        while True:
-            # sleep until 12:00 AM
-            self._sleep12()
-            
-            # check if market opens today
-            market_opens, market_open_time, market_close_time = self._check_market_open()
-            
-            if market_opens:
-                now = datetime.datetime.now()
-                tz = pytz.timezone(str(market_open_time.tzinfo))
-                time_dt = abs((market_open_time - tz.localize(now)).total_seconds()) - minutes * 60
-                time.sleep(time_dt)
-                return
+    def seconds_until_market_open(self) -> float:
+        """Seconds until today's session opens, 0 if it is open already."""
+        market_opens, market_open_time, _ = self._check_market_open()
+        if not market_opens:
+            raise Exception("Market is closed today.")
+        return max(0.0, (market_open_time - self._now()).total_seconds())
         
-    def _sleep12(self):
-        """Sleeps until 12:00 AM."""
-        try:
-            # get current time
-            now = datetime.datetime.now()
-            
-            if now.hour >= 12:
-                next_date = datetime.datetime(now.year, now.month, now.day, 12, 0, 0) + datetime.timedelta(days=1)
-            else:
-                next_date = datetime.datetime(now.year, now.month, now.day, 12, 0, 0)
-            
-            # get time until 12:00 AM
-            time_dt = abs((next_date - now).total_seconds())
-            
-            # sleep until 12:00 AM
-            time.sleep(time_dt)
-        except Exception as e:
-            logger.exception("Error while sleeping until 12:00 AM, not sleeping.")
+    def sleep(self, minutes: int = 10):
+        """Sleeps until the given minutes before the market opens again."""
+        seconds = self.seconds_until_pre_open(minutes)
+        logger.debug(f"Sleeping {seconds:.0f} seconds until {minutes} minutes before the market opens.")
+        self._sleep_for(seconds)
         
     def sleep_until_market_open(self):
         """Sleeps until market opens"""
-            
-        # check if market opens today
-        market_opens, market_open_time, market_close_time = self._check_market_open()
+        self._sleep_for(self.seconds_until_market_open())
         
-        if market_opens:
-            now = datetime.datetime.now()
-            tz = pytz.timezone(str(market_open_time.tzinfo))
-            time_dt = abs((market_open_time - tz.localize(now)).total_seconds())
-            time.sleep(time_dt)
-            return
-        else:
-            raise Exception("Market is closed today.")
+    @staticmethod
+    def _sleep_for(seconds: float) -> None:
+        """Sleeps until a deadline on the monotonic clock, which wall clock changes do not move."""
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
 
 
 class SentimentScheduler():
+    """Starts a sentiment cycle at every interval boundary (in minutes, in utc).
+    
+    A cycle that runs past the next boundary is an overrun: the next cycle starts right away and,
+    as it fetches everything since the cursor, merges all windows that were missed instead of
+    skipping them. The lag of every cycle behind its boundary is kept in stats().
+    """
     
-    def __init__(self, interval: int) -> None:
+    def __init__(self, interval: int, pipelined: bool = False) -> None:
         self.interval = interval
-        self.last_startup = None
+        # fetch the news of the next window while the current one is still sentimented
+        self.pipelined = pipelined
+        # boundary of the running (or last) cycle
+        self.window = None
         
-    def sleep(self):
-        """Sleep until next interval is reached"""       
+        # lag metrics
+        self.cycles = 0
+        self.overruns = 0
+        self.merged_windows = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.last_data_lag = None
         
-        now = datetime.datetime.now()
-        minute = now.minute
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
         
-        before_minute = minute + (self.interval - minute % self.interval) - self.interval
-        before_startup = datetime.datetime(year=now.year, month=now.month, day=now.day, hour=now.hour, minute=before_minute)
-        next_startup = before_startup + datetime.timedelta(minutes=self.interval)
+    def boundary(self, moment: datetime.datetime = None) -> datetime.datetime:
+        """Gets the last interval boundary at or before the given moment (now by default)."""
+        moment = moment or self._now()
+        interval_seconds = self.interval * 60
+        return datetime.datetime.fromtimestamp(moment.timestamp() // interval_seconds * interval_seconds, datetime.timezone.utc)
         
-        # make sure that sentimenting didnt take too long
-        if self.last_startup is None:
-            self.last_startup = datetime.datetime.now()
-        if (next_startup - self.last_startup).total_seconds()/60 > self.interval:
-            logger.error(f"Sentimenting took to long, last startup was: {self.last_startup}, next startup is: {next_startup}")
-        self.last_startup = next_startup
+    def next_boundary(self, moment: datetime.datetime = None) -> datetime.datetime:
+        return self.boundary(moment) + datetime.timedelta(minutes=self.interval)
         
-        delta = (next_startup - datetime.datetime.now()).total_seconds()
+    @property
+    def window_end(self) -> datetime.datetime:
+        """Boundary of the window after the one of the running (or last) cycle."""
+        return self.window + datetime.timedelta(minutes=self.interval)
+    
+    def start_cycle(self) -> datetime.datetime:
+        """Marks the start of a cycle, returns the boundary of its window."""
+        window = self.boundary()
+        if self.window is not None:
+            # a wakeup right at the boundary can read the clock a hair before it
+            window = max(window, self.window_end)
+            missed = round((window - self.window).total_seconds() / (self.interval * 60)) - 1
+            if missed > 0:
+                self.merged_windows += missed
+                logger.warning(f"Catching up, merging {missed} missed windows into the window of {window}.")
+        self.window = window
+        return window
+        
+    def finish_cycle(self, newest: datetime.datetime = None) -> bool:
+        """Marks the end of a cycle, newest is the date of the latest processed news.
+        
+        Returns True if the cycle overran its interval.
+        """
+        now = self._now()
+        self.cycles += 1
+        self.last_lag = (now - self.window).total_seconds()
+        self.max_lag = max(self.max_lag, self.last_lag)
+        if newest is not None:
+            self.last_data_lag = (now - newest).total_seconds()
+            
+        overran = now >= self.window_end
+        if overran:
+            self.overruns += 1
+            logger.error(f"Sentimenting took to long, the cycle of {self.window} finished {self.last_lag:.0f} seconds after its start.")
+        return overran
         
-        time.sleep(delta)
+    def stats(self) -> dict:
+        """Returns the lag metrics, lags are in seconds."""
+        return {
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "merged_windows": self.merged_windows,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "last_data_lag": self.last_data_lag,
+        }
         
+    def seconds_until_next(self) -> float:
+        """Seconds until the next interval is reached, 0 when behind"""
+        if self.window is None:
+            return (self.next_boundary() - self._now()).total_seconds()
+        return max(0.0, (self.window_end - self._now()).total_seconds())
         
+    def sleep(self):
+        """Sleep until next interval is reached"""
+        time.sleep(self.seconds_until_next())
+
+
 if __name__ == "__main__":
     sscheduler = SentimentScheduler(interval=5)
     
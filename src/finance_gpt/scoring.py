@@ -0,0 +1,76 @@
+import datetime
+import numpy as np
+import pandas as pd
+from finance_gpt.structures import get_symbol_registry
+
+# parameters of the scoring, a policy can override every one of them
+DEFAULT_PARAMETERS = {
+    # number of stocks in the portfolio
+    "amount_of_stocks": 15,
+    # minimum absolute score of a stock to be bought or shorted
+    "threshold": 0.7,
+    # how far back sentiments are taken into account
+    "time_frame_hours": 24,
+    # half life of the exponential time decay of a sentiment, None for no decay
+    "half_life_hours": None,
+    # weight per news source, sources that are not listed have a weight of 1
+    "source_weights": {},
+    # minimum number of articles of a stock to be scored
+    "min_articles": 1,
+}
+
+def score_sentiments(records: pd.DataFrame, now: datetime.datetime = None, half_life_hours: float = None, source_weights: dict = None, min_articles: int = 1) -> pd.DataFrame:
+    """Scores every ticker with the weighted mean of its sentiments.
+    
+    records needs the columns ticker, timestamp (utc), sentiment and source, one row per article and ticker.
+    A symbol_id column (see SymbolRegistry) saves the ticker lookups, records of unknown tickers are ignored.
+    Returns a DataFrame indexed by ticker with the columns score and count.
+    """
+    if len(records) == 0:
+        return pd.DataFrame(columns=["score", "count"], index=pd.Index([], name="ticker"))
+        
+    sentiments = records["sentiment"].to_numpy(dtype=np.float64)
+    weights = np.ones(len(records))
+    
+    # exponential time decay
+    if half_life_hours is not None:
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        timestamps = pd.to_datetime(records["timestamp"], utc=True)
+        age_hours = (pd.Timestamp(now) - timestamps).dt.total_seconds().to_numpy() / 3600
+        weights *= 0.5 ** (np.clip(age_hours, 0, None) / half_life_hours)
+        
+    # weights per source
+    if source_weights:
+        weights *= records["source"].map(source_weights).fillna(1.0).to_numpy(dtype=np.float64)
+        
+    # weighted mean per symbol id
+    registry = get_symbol_registry()
+    if "symbol_id" in records:
+        ids = records["symbol_id"].to_numpy(dtype=np.int64)
+    else:
+        ids = registry.ids(records["ticker"])
+    known = ids >= 0
+    ids, weights, sentiments = ids[known], weights[known], sentiments[known]
+    
+    weighted_sums = np.bincount(ids, weights=weights * sentiments, minlength=len(registry))
+    weight_totals = np.bincount(ids, weights=weights, minlength=len(registry))
+    counts = np.bincount(ids, minlength=len(registry))
+    
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = np.where(weight_totals > 0, weighted_sums / weight_totals, 0.0)
+        
+    scored = counts >= max(min_articles, 1)
+    result = pd.DataFrame({"score": scores[scored], "count": counts[scored]}, index=pd.Index(registry.tickers[scored], name="ticker"))
+    return result.sort_index()
+
+def select_stocks(scores: pd.DataFrame, amount_of_stocks: int, threshold: float) -> pd.DataFrame:
+    """Takes the amount_of_stocks stocks with the highest absolute score, as long as it reaches the threshold.
+    
+    Returns a DataFrame indexed by ticker with the columns score and absolute_score.
+    """
+    score_df = scores[["score"]].copy()
+    score_df["absolute_score"] = score_df["score"].abs()
+    sorted_score_df = score_df.sort_values(by="absolute_score", ascending=False, kind="stable")
+    new_stocks = sorted_score_df.iloc[:amount_of_stocks, :]
+    return new_stocks[new_stocks["absolute_score"] >= threshold]
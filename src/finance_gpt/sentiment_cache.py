@@ -0,0 +1,114 @@
+import re
+import hashlib
+import datetime
+import threading
+import unicodedata
+from collections import OrderedDict
+from finance_gpt import setup_logger
+from finance_gpt.news_api import GPTSentiment
+from finance_gpt.mongodb import MongoDBWrapper
+
+logger = setup_logger(__name__)
+
+class SentimentCache():
+    """Cache of GPT sentiments, an in-process LRU in front of a MongoDB collection.
+    
+    Entries are keyed by the normalized headline, ticker, term, model name and prompt version,
+    so syndicated copies of a headline are only sent once and a new model or prompt simply misses.
+    """
+    
+    def __init__(self, db: MongoDBWrapper, model_name: str, prompt_version: int, max_size: int = 10000) -> None:
+        self.db = db
+        self.model_name = model_name
+        self.prompt_version = prompt_version
+        self.max_size = max_size
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # counters
+        self.hits = 0
+        self.misses = 0
+        
+    @staticmethod
+    def normalize_title(title: str) -> str:
+        """Normalizes a headline, so that copies with other casing, punctuation or spacing match."""
+        title = unicodedata.normalize("NFKC", title).lower()
+        title = re.sub(r"[^\w\s]", " ", title)
+        return " ".join(title.split())
+        
+    def key(self, title: str, ticker: str, term: str) -> str:
+        """Creates the cache key of a headline for one ticker."""
+        raw_key = "|".join([self.normalize_title(title), ticker, term, self.model_name, str(self.prompt_version)])
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+        
+    def get_many(self, keys: list[str]) -> dict[str, tuple[GPTSentiment, str]]:
+        """Looks up the given keys, first in memory and then with one query in MongoDB."""
+        found = {}
+        remote_keys = []
+        
+        # look up in memory
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                else:
+                    remote_keys.append(key)
+                    
+        # look up in the database
+        if len(remote_keys) > 0:
+            for key, entry in self.db.get_cached_sentiments(remote_keys).items():
+                value = (GPTSentiment(int(entry["gpt_sentiment"])), entry["gpt_verdict"])
+                found[key] = value
+                self._remember(key, value)
+                
+        hits = sum(1 for key in keys if key in found)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+            
+        return found
+        
+    def put_many(self, values: dict[str, tuple[GPTSentiment, str]]) -> None:
+        """Stores new sentiments in memory and in MongoDB."""
+        if len(values) == 0:
+            return
+            
+        entries = []
+        for key, value in values.items():
+            self._remember(key, value)
+            entries.append({
+                "_id": key,
+                "gpt_sentiment": value[0].value,
+                "gpt_verdict": value[1],
+                "model_name": self.model_name,
+                "prompt_version": self.prompt_version,
+                "created_at": datetime.datetime.now(datetime.timezone.utc),
+            })
+            
+        self.db.add_cached_sentiments(entries)
+        
+    def prune(self) -> int:
+        """Deletes all entries of other models or prompt versions from MongoDB."""
+        deleted = self.db.delete_stale_cached_sentiments(self.model_name, self.prompt_version)
+        logger.debug(f"Deleted {deleted} stale cached sentiments.")
+        return deleted
+        
+    def stats(self) -> dict:
+        """Returns the hit and miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "size": len(self._entries),
+            }
+            
+    def _remember(self, key: str, value: tuple[GPTSentiment, str]) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,203 @@
+import asyncio
+from finance_gpt import setup_logger
+from finance_gpt.news_api import NewsArticle, GPTSentiment
+from finance_gpt.gpt import GPT
+from finance_gpt.mongodb import MongoDBWrapper
+from finance_gpt.sentiment_cache import SentimentCache
+from finance_gpt.dedup import NearDuplicateIndex, DuplicateEntry
+
+logger = setup_logger(__name__)
+
+class SentimentPipeline():
+    
+    def __init__(self, gpt: GPT, db: MongoDBWrapper, tickers: list[str], max_concurrency: int = 8, term: str = "short", multi_ticker: bool = True, cache: SentimentCache = None, dedup_index: NearDuplicateIndex = None) -> None:
+        self.gpt = gpt
+        self.db = db
+        self.tickers = set(tickers)
+        self.max_concurrency = max_concurrency
+        self.term = term
+        self.multi_ticker = multi_ticker
+        self.cache = cache
+        self.dedup_index = dedup_index
+        
+    async def run(self, news: list[dict]) -> list[dict]:
+        """Sentiments all given news concurrently and stores every article as soon as it is done.
+        
+        At most max_concurrency requests are in flight at the same time. Articles that fail to be
+        sentimented or stored are logged and returned, so they can be picked up again in the next cycle.
+        """
+        # the api can return the same article more than once
+        news = list({news_dict["news_url"]: news_dict for news_dict in news}.values())
+        logger.debug(f"Sentimenting {len(news)} news with {self.max_concurrency} concurrent requests.")
+        
+        # group near duplicate headlines, only the representatives get sentimented
+        clusters = self._cluster(news)
+        
+        # look up all representative headlines in the cache with one round trip
+        cached = {}
+        if self.cache is not None:
+            keys = [self._cache_key(news_dict, ticker) for news_dict in news for ticker in self._relevant_tickers(news_dict) if self._is_representative(clusters, news_dict, ticker)]
+            cached = await asyncio.to_thread(self.cache.get_many, keys)
+            
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.create_task(self._sentiment_article(news_dict, semaphore, cached, clusters)) for news_dict in news]
+        
+        processed = 0
+        unstored = set()
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    news_dict, new_sentiments = await task
+                except Exception:
+                    logger.exception("Failed to sentiment news article, skipping it.")
+                    continue
+                
+                # save it in the database, articles that could not be stored count as failed
+                try:
+                    await asyncio.to_thread(self._store, news_dict, new_sentiments)
+                except Exception:
+                    logger.exception(f"Failed to store news article {news_dict['news_url']}, skipping it.")
+                    unstored.add(news_dict["news_url"])
+                    continue
+                processed += 1
+        finally:
+            # never leave requests running in the background
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            
+        logger.debug(f"Sentimented and stored {processed} of {len(news)} news.")
+        if self.cache is not None:
+            logger.debug(f"Sentiment cache stats: {self.cache.stats()}")
+        return [news_dict for task, news_dict in zip(tasks, news) if task.exception() is not None or news_dict["news_url"] in unstored]
+        
+    def _cluster(self, news: list[dict]) -> dict[tuple[str, str], tuple[DuplicateEntry, asyncio.Future]]:
+        """Assigns every (url, ticker) to the representative of its near duplicate cluster.
+        
+        Representatives that are sentimented in this run get a future, which resolves to their
+        sentiment and verdict (or None if sentimenting failed).
+        """
+        clusters = {}
+        if self.dedup_index is None:
+            return clusters
+            
+        loop = asyncio.get_running_loop()
+        pending = {}
+        for news_dict in news:
+            for ticker in self._relevant_tickers(news_dict):
+                entry, signature = self.dedup_index.find(news_dict["title"], ticker)
+                if entry is None or (entry.result is None and id(entry) not in pending):
+                    entry = self.dedup_index.add(news_dict["news_url"], ticker, signature)
+                    pending[id(entry)] = loop.create_future()
+                clusters[(news_dict["news_url"], ticker)] = (entry, pending.get(id(entry)))
+                
+        duplicates = sum(1 for key, (entry, _) in clusters.items() if entry.url != key[0])
+        logger.debug(f"Collapsed {duplicates} of {len(clusters)} headlines into near duplicate clusters.")
+        
+        return clusters
+        
+    def _is_representative(self, clusters: dict, news_dict: dict, ticker: str) -> bool:
+        if (news_dict["news_url"], ticker) not in clusters:
+            return True
+        entry, _ = clusters[(news_dict["news_url"], ticker)]
+        return entry.url == news_dict["news_url"]
+        
+    async def _sentiment_article(self, news_dict: dict, semaphore: asyncio.Semaphore, cached: dict, clusters: dict) -> tuple[dict, dict]:
+        """Sentiments one article for every relevant company.
+        
+        Returns the copy to store and the newly requested sentiments, keyed by cache key.
+        """
+        
+        # copy the news_dict
+        news_dict_copy = news_dict.copy()
+        news_dict_copy["gpt_sentiment"] = {}
+        news_dict_copy["gpt_verdict"] = {}
+        
+        # split into representatives and near duplicates of other headlines
+        news_articles = [NewsArticle.from_dict(news_dict, ticker) for ticker in self._relevant_tickers(news_dict)]
+        own = [news_article for news_article in news_articles if self._is_representative(clusters, news_dict, news_article.company.name)]
+        duplicates = [news_article for news_article in news_articles if not self._is_representative(clusters, news_dict, news_article.company.name)]
+        
+        try:
+            new_sentiments = await self._sentiment_own(news_dict, own, semaphore, cached)
+        except Exception:
+            self._resolve(clusters, news_dict, own, failed=True)
+            raise
+        self._resolve(clusters, news_dict, own)
+        
+        # take the sentiment of the representative for near duplicates
+        if len(duplicates) > 0:
+            news_dict_copy["duplicate_of"] = {}
+        for news_article in duplicates:
+            entry, future = clusters[(news_dict["news_url"], news_article.company.name)]
+            result = entry.result if entry.result is not None else await future
+            if result is None:
+                raise Exception(f"Sentimenting the representative {entry.url} failed.")
+            news_article.gpt_sentiment, news_article.gpt_verdict = result
+            news_dict_copy["duplicate_of"][news_article.company.name] = entry.url
+            
+        # save sentiment in copy
+        for news_article in news_articles:
+            news_dict_copy["gpt_sentiment"][news_article.company.name] = news_article.gpt_sentiment.value
+            news_dict_copy["gpt_verdict"][news_article.company.name] = news_article.gpt_verdict
+            
+        return news_dict_copy, new_sentiments
+        
+    def _resolve(self, clusters: dict, news_dict: dict, news_articles: list[NewsArticle], failed: bool = False) -> None:
+        """Hands the results of representatives to their near duplicates."""
+        for news_article in news_articles:
+            key = (news_dict["news_url"], news_article.company.name)
+            if key not in clusters:
+                continue
+            entry, future = clusters[key]
+            if failed:
+                self.dedup_index.remove(entry)
+            else:
+                entry.result = (news_article.gpt_sentiment, news_article.gpt_verdict)
+            if future is not None and not future.done():
+                future.set_result(entry.result)
+                
+    async def _sentiment_own(self, news_dict: dict, news_articles: list[NewsArticle], semaphore: asyncio.Semaphore, cached: dict) -> dict:
+        """Sentiments the given companies of an article, returns the newly requested sentiments."""
+        
+        # take what is already cached
+        uncached = []
+        for news_article in news_articles:
+            key = self._cache_key(news_dict, news_article.company.name)
+            if key in cached:
+                news_article.gpt_sentiment, news_article.gpt_verdict = cached[key]
+            else:
+                uncached.append(news_article)
+                
+        # sentiment article for every relevant company
+        if len(uncached) > 1 and self.multi_ticker:
+            # one request for all companies, only fall back to single requests for unanswered ones
+            async with semaphore:
+                missing = await self.gpt.aget_sentiments(uncached, term=self.term)
+        else:
+            missing = uncached
+        await asyncio.gather(*[self._sentiment(news_article, semaphore) for news_article in missing])
+        
+        new_sentiments = {}
+        for news_article in uncached:
+            new_sentiments[self._cache_key(news_dict, news_article.company.name)] = (news_article.gpt_sentiment, news_article.gpt_verdict)
+            
+        return new_sentiments
+        
+    async def _sentiment(self, news_article: NewsArticle, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            await self.gpt.aget_sentiment(news_article, term=self.term)
+
+    def _store(self, news_dict: dict, new_sentiments: dict[str, tuple[GPTSentiment, str]]) -> None:
+        """Stores a sentimented article and caches its new sentiments."""
+        if self.cache is not None:
+            self.cache.put_many(new_sentiments)
+        self.db.add_news_articles([news_dict])
+        
+    def _relevant_tickers(self, news_dict: dict) -> list[str]:
+        return [ticker for ticker in news_dict["tickers"] if ticker in self.tickers]
+        
+    def _cache_key(self, news_dict: dict, ticker: str) -> str:
+        if self.cache is None:
+            return None
+        return self.cache.key(news_dict["title"], ticker, self.term)
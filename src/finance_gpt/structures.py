@@ -1,7 +1,12 @@
 # standard libraries
 from enum import Enum
+from typing import Iterable
 from dataclasses import dataclass, field
+# finance_gpt imports
+from finance_gpt.utils import load_tickers
 # third party imports
+import numpy as np
+import pandas as pd
 from alpaca.trading.enums import PositionSide as AlpacaPositionSide, OrderSide as AlpacaOrderSide
 from alpaca.trading.models import Position as AlpacaPosition
 
@@ -110,10 +115,50 @@ class Symbol(Enum):
     
     @classmethod
     def from_string(cls, string: str):
-        for symbol in cls:
-            if symbol.name == string:
-                return symbol
-        raise ValueError(f"Unknown symbol {string}.")
+        try:
+            return cls[string]
+        except KeyError:
+            raise ValueError(f"Unknown symbol {string}.")
+
+class SymbolRegistry():
+    """Stable small integer ids of the symbol universe, with O(1) lookups both ways.
+    
+    Ids follow the order of the given tickers (tickers.json), symbols that are not listed there
+    get the ids after them in enum order. Arrays indexed by id can replace dicts keyed by ticker.
+    """
+    
+    def __init__(self, tickers: list[str]) -> None:
+        listed = set(tickers)
+        names = list(tickers) + [symbol.name for symbol in Symbol if symbol.name not in listed]
+        if len(names) != len(set(names)):
+            raise ValueError("Tickers contain duplicates.")
+            
+        self._symbols = tuple(Symbol.from_string(name) for name in names)
+        self._ids = {symbol: i for i, symbol in enumerate(self._symbols)}
+        self._index = pd.Index(names)
+        self.tickers = np.array(names, dtype=object)
+        
+    def __len__(self) -> int:
+        return len(self._symbols)
+        
+    def id(self, symbol: Symbol) -> int:
+        return self._ids[symbol]
+        
+    def symbol(self, symbol_id: int) -> Symbol:
+        return self._symbols[symbol_id]
+        
+    def ids(self, tickers: Iterable[str]) -> np.ndarray:
+        """Gets the ids of many tickers at once, -1 for unknown tickers."""
+        return self._index.get_indexer(pd.Index(tickers)).astype(np.int32)
+
+_symbol_registry = None
+
+def get_symbol_registry() -> SymbolRegistry:
+    """Gets the registry of the tickers in tickers.json, built once per process."""
+    global _symbol_registry
+    if _symbol_registry is None:
+        _symbol_registry = SymbolRegistry(load_tickers())
+    return _symbol_registry
 
 class PositionSide(Enum):
     LONG = "long"
@@ -135,8 +180,8 @@ class PositionSide(Enum):
             return AlpacaOrderSide.SELL
         else:
             raise ValueError(f"Unknown side {self}.")
-    
-@dataclass
+
+@dataclass(slots=True)
 class Position:
     symbol: Symbol
     amount: float
@@ -152,21 +197,55 @@ class Position:
 
 
 @dataclass
+class PortfolioDiff:
+    """Changes that turn one portfolio into another, every list is sorted by symbol."""
+    added: list[Position] = field(default_factory=list)
+    removed: list[Position] = field(default_factory=list)
+    # (old position, new position) pairs
+    resized: list[tuple[Position, Position]] = field(default_factory=list)
+    flipped: list[tuple[Position, Position]] = field(default_factory=list)
+    unchanged: list[Position] = field(default_factory=list)
+    
+    @property
+    def is_empty(self) -> bool:
+        return len(self.added) + len(self.removed) + len(self.resized) + len(self.flipped) == 0
+
+
 class Portfolio():
-    positions: list[Position] = field(default_factory=list)
+    """Positions keyed by symbol, at most one position per symbol.
+    
+    Lookups are O(1), the positions are only sorted (by symbol name) when they are iterated.
+    """
+    
+    def __init__(self, positions: list[Position] = None) -> None:
+        self._positions = {}
+        self._sorted = None
+        for position in positions or []:
+            # make sure that the portfolio has no duplicate positions
+            if position.symbol in self._positions:
+                raise ValueError("Portfolio contains duplicate positions.")
+            self._positions[position.symbol] = position
+            
+    @property
+    def positions(self) -> list[Position]:
+        """The positions sorted by symbol name."""
+        if self._sorted is None:
+            self._sorted = sorted(self._positions.values(), key=lambda x: x.symbol.name)
+        return list(self._sorted)
+        
+    @property
+    def symbols(self) -> set[Symbol]:
+        return set(self._positions)
     
     def add(self, position: Position) -> None:
         """Adds a position to the portfolio."""
         # check if the position is already in the portfolio
-        for pos in self.positions:
-            if pos.symbol == position.symbol:
-                raise ValueError(f"Position for symbol {position.symbol} already exists.")
+        if position.symbol in self._positions:
+            raise ValueError(f"Position for symbol {position.symbol} already exists.")
         
         # add a position to the portfolio
-        self.positions.append(position)
-        
-        # sort the positions by symbol
-        self.positions.sort(key=lambda x: x.symbol.name)
+        self._positions[position.symbol] = position
+        self._sorted = None
     
     def remove(self, position: Position) -> None:
         """Removes a position from the portfolio."""
@@ -175,24 +254,54 @@ class Portfolio():
             raise ValueError(f"Position for symbol {position.symbol} does not exist.")
         
         # remove the position from the portfolio
-        self.positions.remove(position)
+        del self._positions[position.symbol]
+        self._sorted = None
     
     def reset(self) -> None:
         """Resets the portfolio."""
-        self.positions = []
+        self._positions = {}
+        self._sorted = None
     
-    def __post_init__(self) -> None:        
-        # sort the positions by symbol
-        self.positions.sort(key=lambda x: x.symbol.name)
-        
-        # make sure that the portfolio has no duplicate positions
-        symbols = [pos.symbol for pos in self.positions]
-        if len(symbols) != len(set(symbols)):
-            raise ValueError("Portfolio contains duplicate positions.")
+    def get(self, symbol: Symbol) -> Position:
+        """Gets the position of a symbol, None if there is none."""
+        return self._positions.get(symbol)
     
     def in_portfolio(self, position: Position) -> bool:
         """Checks if the given position is in the portfolio."""
-        for pos in self.positions:
-            if pos.symbol == position.symbol and pos.side == position.side:
-                return True
-        return False
\ No newline at end of file
+        pos = self._positions.get(position.symbol)
+        return pos is not None and pos.side == position.side
+        
+    def diff(self, other: "Portfolio") -> PortfolioDiff:
+        """Compares this portfolio to another one in one pass over both."""
+        diff = PortfolioDiff()
+        for symbol in sorted(self._positions.keys() | other._positions.keys(), key=lambda x: x.name):
+            old = self._positions.get(symbol)
+            new = other._positions.get(symbol)
+            if old is None:
+                diff.added.append(new)
+            elif new is None:
+                diff.removed.append(old)
+            elif old.side != new.side:
+                diff.flipped.append((old, new))
+            elif old.amount != new.amount:
+                diff.resized.append((old, new))
+            else:
+                diff.unchanged.append(new)
+        return diff
+        
+    def __iter__(self):
+        return iter(self.positions)
+        
+    def __len__(self) -> int:
+        return len(self._positions)
+        
+    def __contains__(self, symbol: Symbol) -> bool:
+        return symbol in self._positions
+        
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Portfolio):
+            return NotImplemented
+        return self._positions == other._positions
+        
+    def __repr__(self) -> str:
+        return f"Portfolio(positions={self.positions})"
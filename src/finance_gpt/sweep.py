@@ -0,0 +1,127 @@
+import os
+import json
+import random
+import argparse
+import datetime
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from finance_gpt import setup_logger
+from finance_gpt.backtest import Backtest, CACHE_DIR, load_sentiment_records, load_price_history
+from finance_gpt.scoring import DEFAULT_PARAMETERS
+from finance_gpt.structures import get_symbol_registry
+from finance_gpt.utils import reset_logging
+
+logger = setup_logger(__name__)
+
+# arrays of a worker, loaded once per process from the memory mapped files
+_worker_data = {}
+
+def _code_dtype(num_categories: int) -> type:
+    """Smallest integer type pandas keeps the codes of a categorical with that many categories in."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def save_arrays(records: pd.DataFrame, prices: pd.DataFrame, directory: str) -> None:
+    """Writes the records and prices as plain arrays, so that workers can memory map them."""
+    registry = get_symbol_registry()
+    records = records.sort_values("timestamp", kind="stable")
+    # unknown tickers can not be scored anyway
+    ticker_codes = registry.ids(records["ticker"])
+    records, ticker_codes = records[ticker_codes >= 0], ticker_codes[ticker_codes >= 0]
+    source_codes, sources = pd.factorize(records["source"].fillna(""))
+    
+    # codes in the type of a categorical, so that the workers can use them without a cast
+    np.save(os.path.join(directory, "symbol_ids.npy"), ticker_codes.astype(_code_dtype(len(registry.tickers))))
+    np.save(os.path.join(directory, "source_codes.npy"), source_codes.astype(_code_dtype(len(sources))))
+    np.save(os.path.join(directory, "timestamps.npy"), records["timestamp"].to_numpy(dtype="datetime64[ns]"))
+    np.save(os.path.join(directory, "sentiments.npy"), records["sentiment"].to_numpy(dtype=np.int8))
+    np.save(os.path.join(directory, "prices.npy"), prices.to_numpy(dtype=np.float64))
+    np.save(os.path.join(directory, "dates.npy"), prices.index.to_numpy(dtype="datetime64[ns]"))
+    
+    with open(os.path.join(directory, "labels.json"), "w") as f:
+        json.dump({"tickers": list(registry.tickers), "sources": list(sources), "price_columns": list(prices.columns)}, f)
+
+def _init_worker(directory: str) -> None:
+    """Maps the arrays of the sweep into the worker process."""
+    # forked workers inherit the log queue of the parent, but not its listener
+    reset_logging()
+    
+    def load(name):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        
+    with open(os.path.join(directory, "labels.json")) as f:
+        labels = json.load(f)
+        
+    # every column stays backed by the memory mapped files, the workers share them
+    symbol_ids = load("symbol_ids")
+    records = pd.DataFrame({
+        "ticker": pd.Categorical.from_codes(symbol_ids, categories=labels["tickers"], validate=False),
+        "symbol_id": symbol_ids,
+        "timestamp": pd.DatetimeIndex(load("timestamps"), tz="UTC"),
+        "sentiment": load("sentiments"),
+        "source": pd.Categorical.from_codes(load("source_codes"), categories=labels["sources"], validate=False),
+    }, copy=False)
+    prices = pd.DataFrame(load("prices"), index=pd.DatetimeIndex(load("dates")), columns=labels["price_columns"], copy=False)
+    
+    _worker_data["records"] = records
+    _worker_data["prices"] = prices
+
+def _evaluate(parameters: dict, capital: float) -> dict:
+    result = Backtest(_worker_data["records"], _worker_data["prices"], parameters=parameters, capital=capital).run()
+    return {**parameters, **result.summary()}
+
+def parameter_grid(grid: dict[str, list], samples: int = None, seed: int = 1) -> list[dict]:
+    """Gets every combination of the grid, or a random sample of them."""
+    keys = list(grid.keys())
+    combinations = [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+    if samples is not None and samples < len(combinations):
+        combinations = random.Random(seed).sample(combinations, samples)
+    return combinations
+
+def run_sweep(records: pd.DataFrame, prices: pd.DataFrame, parameter_sets: list[dict], workers: int = None, capital: float = 100000.0, rank_by: str = "sharpe") -> pd.DataFrame:
+    """Backtests every parameter set in a process pool and ranks the results."""
+    with tempfile.TemporaryDirectory(prefix="finance_gpt_sweep_") as directory:
+        save_arrays(records, prices, directory)
+        
+        logger.info(f"Sweeping {len(parameter_sets)} parameter sets with {workers or os.cpu_count()} workers.")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(directory,)) as executor:
+            chunksize = max(1, len(parameter_sets) // (4 * (workers or os.cpu_count())))
+            rows = list(executor.map(_evaluate, parameter_sets, itertools.repeat(capital), chunksize=chunksize))
+            
+    results = pd.DataFrame(rows)
+    return results.sort_values(by=rank_by, ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from finance_gpt.utils import load_tickers
+    
+    parser = argparse.ArgumentParser(description="Backtest a grid of policy parameters in parallel.")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--end", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--grid", required=True, help="json file with a list of values per policy parameter")
+    parser.add_argument("--samples", type=int, default=None, help="only evaluate a random sample of the grid")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--prices", default=os.path.join(CACHE_DIR, "prices.csv"))
+    parser.add_argument("--records", default=None)
+    parser.add_argument("--output", default=os.path.join(CACHE_DIR, "sweep_results.csv"))
+    args = parser.parse_args()
+    
+    with open(args.grid) as f:
+        grid = json.load(f)
+        
+    start = datetime.datetime.combine(args.start, datetime.time(), tzinfo=datetime.timezone.utc)
+    end = datetime.datetime.combine(args.end, datetime.time(), tzinfo=datetime.timezone.utc)
+    lookback = datetime.timedelta(hours=max(grid.get("time_frame_hours", [DEFAULT_PARAMETERS["time_frame_hours"]])))
+    
+    prices = load_price_history(args.prices, tickers=load_tickers()).loc[str(args.start):str(args.end)]
+    records = load_sentiment_records(start - lookback, end, path=args.records)
+    
+    results = run_sweep(records, prices, parameter_grid(grid, samples=args.samples), workers=args.workers)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(results.head(20))
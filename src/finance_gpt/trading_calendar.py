@@ -0,0 +1,110 @@
+# standard libraries
+import os
+import json
+import datetime
+# finance_gpt imports
+from finance_gpt import TOP_LEVEL_DIR, setup_logger
+# third party imports
+import pytz
+import pandas_market_calendars as mcal
+
+logger = setup_logger(__name__)
+
+class TradingCalendar():
+    """Open and close times (in utc) of the trading sessions of an exchange.
+    
+    The sessions are computed once for horizon_days ahead and cached in a local file, lookups by
+    date are dict lookups. The schedule is only computed again once less than a month of it is left.
+    """
+    
+    def __init__(self, exchange: str = "NASDAQ", horizon_days: int = 365, path: str = None) -> None:
+        self.exchange = exchange
+        self.horizon_days = horizon_days
+        self.path = path if path is not None else os.path.join(TOP_LEVEL_DIR, "cache", f"calendar_{exchange}.json")
+        self.timezone = pytz.timezone("America/New_York")
+        
+        # date -> (open, close)
+        self._sessions = {}
+        self._start = None
+        self._end = None
+        
+        if not self._load() or not self._covers(self.today() + datetime.timedelta(days=30)):
+            self.refresh()
+            
+    def today(self, now: datetime.datetime = None) -> datetime.date:
+        """Today (or the date of the given moment) in the timezone of the exchange."""
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        return now.astimezone(self.timezone).date()
+        
+    def session(self, date: datetime.date) -> tuple[datetime.datetime, datetime.datetime]:
+        """Gets the open and close of the session on the given date, None if the market is closed."""
+        if not self._covers(date):
+            self.refresh(date)
+        return self._sessions.get(date)
+        
+    def next_session(self, after: datetime.datetime) -> tuple[datetime.datetime, datetime.datetime]:
+        """Gets the first session that opens after the given (timezone aware) moment."""
+        date = after.astimezone(self.timezone).date()
+        # there are never more than a few closed days in a row
+        for _ in range(14):
+            session = self.session(date)
+            if session is not None and session[0] > after:
+                return session
+            date += datetime.timedelta(days=1)
+        raise ValueError(f"No session of {self.exchange} within two weeks after {after}.")
+        
+    def refresh(self, date: datetime.date = None) -> None:
+        """Computes the sessions from a week before the given date (today by default) until the horizon."""
+        start = (date or self.today()) - datetime.timedelta(days=7)
+        end = start + datetime.timedelta(days=7 + self.horizon_days)
+        logger.debug(f"Computing the sessions of {self.exchange} from {start} to {end}.")
+        
+        schedule = mcal.get_calendar(self.exchange).schedule(start_date=start, end_date=end)
+        self._sessions = {
+            day.date(): (row["market_open"].to_pydatetime(), row["market_close"].to_pydatetime())
+            for day, row in schedule.iterrows()
+        }
+        self._start = start
+        self._end = end
+        self._save()
+        
+    def _covers(self, date: datetime.date) -> bool:
+        return self._start is not None and self._start <= date <= self._end
+        
+    def _load(self) -> bool:
+        """Loads the cached sessions, returns False if there are none."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            sessions = {
+                datetime.date.fromisoformat(day): (datetime.datetime.fromisoformat(market_open), datetime.datetime.fromisoformat(market_close))
+                for day, (market_open, market_close) in data["sessions"].items()
+            }
+            start = datetime.date.fromisoformat(data["start"])
+            end = datetime.date.fromisoformat(data["end"])
+        except Exception:
+            logger.exception(f"Failed to load the calendar from {self.path}.")
+            return False
+            
+        self._sessions = sessions
+        self._start = start
+        self._end = end
+        return True
+        
+    def _save(self) -> None:
+        data = {
+            "exchange": self.exchange,
+            "start": self._start.isoformat(),
+            "end": self._end.isoformat(),
+            "sessions": {day.isoformat(): [market_open.isoformat(), market_close.isoformat()] for day, (market_open, market_close) in self._sessions.items()},
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        
+        # write to a temporary file first, so a crash never leaves half a file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -1,7 +1,11 @@
 import os
 import json
+import queue
+import atexit
 import logging
-from logging.handlers import SMTPHandler
+import threading
+import multiprocessing.util
+from logging.handlers import SMTPHandler, QueueHandler, QueueListener
 from finance_gpt import TOP_LEVEL_DIR
 
 
@@ -16,7 +20,7 @@ def load_credentials() -> dict:
         print("Error loading credentials.json file.")
     
     return credentials
-    
+
 def load_tickers() -> list[str]:
     """Loads all tickers from the tickers.json file."""
     tickers_path = os.path.join(TOP_LEVEL_DIR, "tickers.json")
@@ -25,6 +29,20 @@ def load_tickers() -> list[str]:
     
     return tickers
 
+def load_config() -> dict:
+    """Load the runtime config from the config.json file, empty if there is none."""
+    
+    config_path = os.path.join(TOP_LEVEL_DIR, "config", "config.json")
+    if not os.path.exists(config_path):
+        return {}
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+            return config
+    except Exception as e:
+        print("Error loading config.json file.")
+        raise e
+
 # logging setup
 
 def load_logging_config() -> dict:
@@ -60,56 +78,140 @@ def setup_logging_folder() -> None:
     if not os.path.exists(path):
         os.mkdir(path)
 
-def setup_logger(name: str) -> logging.Logger:
-    """Setup logger."""
-    # setup logging folder
-    setup_logging_folder()
+class ModuleFileHandler(logging.Handler):
+    """Writes every record to the file of its logger, logs/<name>.log, opened on first use."""
     
-    # load logging config
-    logging_config = load_logging_config()
+    def __init__(self, file_mode: str, level: int = logging.NOTSET) -> None:
+        super().__init__(level)
+        self.file_mode = file_mode
+        self._handlers = {}
+        
+    def emit(self, record: logging.LogRecord) -> None:
+        handler = self._handlers.get(record.name)
+        if handler is None:
+            path = os.path.join(TOP_LEVEL_DIR, "logs", f"{record.name}.log")
+            handler = logging.FileHandler(path, mode=self.file_mode)
+            handler.setFormatter(self.formatter)
+            self._handlers[record.name] = handler
+        handler.emit(record)
+        
+    def close(self) -> None:
+        for handler in self._handlers.values():
+            handler.close()
+        super().close()
+
+# state of the logging of this process, set up once by configure_logging
+_logging = {}
+_logging_lock = threading.Lock()
+
+def configure_logging(file_mode: str = None) -> None:
+    """Sets up the logging of this process, once.
     
-    # get the log level
-    log_level = log_level_from_string(logging_config["logging_level"])
-    # get the file mode
-    file_mode = logging_config["file_mode"]
+    Loggers only put their records on a queue, a listener thread writes them to the files (one per
+    logger and all.log) and sends the emails, so that file and SMTP I/O never block the caller.
+    file_mode overrides the one of logging_config.json.
+    """
+    with _logging_lock:
+        if len(_logging) > 0:
+            return
+            
+        # setup logging folder
+        setup_logging_folder()
+        
+        # load logging config
+        logging_config = load_logging_config()
+        
+        # get the log level
+        log_level = log_level_from_string(logging_config["logging_level"])
+        # get the file mode
+        if file_mode is None:
+            file_mode = logging_config["file_mode"]
+        
+        # create a logging format
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        
+        # create a unique file handler per module
+        file_handler_unique = ModuleFileHandler(file_mode, level=log_level)
+        file_handler_unique.setFormatter(formatter)
+        
+        # create a file handler for all modules
+        path = os.path.join(TOP_LEVEL_DIR, "logs", "all.log")
+        file_handler_all = logging.FileHandler(path, mode=file_mode)
+        file_handler_all.setLevel(log_level)
+        file_handler_all.setFormatter(formatter)
+        
+        handlers = [file_handler_unique, file_handler_all]
+        
+        # create a email handler
+        email_conf = logging_config["email_logging"]
+        if email_conf["enabled"]:
+            email_handler = SMTPHandler(
+                mailhost=(email_conf["smtp_server"], email_conf["smtp_port"]),  # Specify the SMTP server and port
+                fromaddr=email_conf["fromaddr"],    # Your Gmail address
+                toaddrs=email_conf["toaddrs"],   # List of recipient email addresses
+                subject=email_conf["subject"],
+                credentials=(email_conf["credentials"]["username"], email_conf["credentials"]["password"]),  # Your Gmail credentials
+                secure=()
+            )
+            email_handler.setFormatter(formatter)
+            
+            # emails get their own listener thread, so a slow smtp server does not hold up the files
+            email_queue = queue.SimpleQueue()
+            email_listener = QueueListener(email_queue, email_handler)
+            email_listener.start()
+            atexit.register(email_listener.stop)
+            
+            email_queue_handler = QueueHandler(email_queue)
+            email_queue_handler.setLevel(email_conf["logging_level"])
+            handlers.append(email_queue_handler)
+            
+        # the loggers only enqueue, the listener thread does the I/O
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        
+        _logging["level"] = log_level
+        _logging["handler"] = QueueHandler(log_queue)
+        _logging["listener"] = listener
+        _logging["pid"] = os.getpid()
+
+def reset_logging() -> None:
+    """Sets up the logging again in a forked process, e.g. a worker of a process pool.
     
-    # get the logger
-    logger = logging.getLogger(name)
-    # set the log level
-    logger.setLevel(log_level)
-    # create a logging format
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    A forked process inherits the queue handler of its parent, but not the listener thread, so its
+    records would never be written. The loggers get the handler of a new listener instead, which
+    appends to the files of the parent.
+    """
+    global _logging_lock
+    if _logging.get("pid") == os.getpid():
+        return
+        
+    # another thread of the parent may have held the lock while forking
+    _logging_lock = threading.Lock()
+    inherited = _logging.get("handler")
+    _logging.clear()
+    configure_logging(file_mode="a")
     
-    # create a unique file handler for this module
-    path = os.path.join(TOP_LEVEL_DIR, "logs", f"{name}.log")
-    file_handler_unique = logging.FileHandler(path, mode=file_mode)
-    file_handler_unique.setLevel(log_level)
-    file_handler_unique.setFormatter(formatter)
+    # processes of multiprocessing skip atexit, the listener writes the remaining records on their exit
+    multiprocessing.util.Finalize(None, _logging["listener"].stop, exitpriority=10)
     
-    # create a file handler for all modules
-    path = os.path.join(TOP_LEVEL_DIR, "logs", "all.log")
-    file_handler_all = logging.FileHandler(path, mode=file_mode)
-    file_handler_all.setLevel(log_level)
-    file_handler_all.setFormatter(formatter)
+    for logger in list(logging.root.manager.loggerDict.values()):
+        if isinstance(logger, logging.Logger) and inherited in logger.handlers:
+            logger.removeHandler(inherited)
+            logger.addHandler(_logging["handler"])
 
-    logger.addHandler(file_handler_unique)
-    logger.addHandler(file_handler_all)
+def setup_logger(name: str) -> logging.Logger:
+    """Setup logger, every logger gets the queue handler of the process at most once."""
+    configure_logging()
     
-    # create a email handler
-    email_conf = logging_config["email_logging"]
-    if email_conf["enabled"]:
-        email_handler = SMTPHandler(
-            mailhost=(email_conf["smtp_server"], email_conf["smtp_port"]),  # Specify the SMTP server and port
-            fromaddr=email_conf["fromaddr"],    # Your Gmail address
-            toaddrs=email_conf["toaddrs"],   # List of recipient email addresses
-            subject=email_conf["subject"],
-            credentials=(email_conf["credentials"]["username"], email_conf["credentials"]["password"]),  # Your Gmail credentials
-            secure=()
-        )
-        email_handler.setLevel(email_conf["logging_level"])
-        email_handler.setFormatter(formatter)
-        
-        logger.addHandler(email_handler)
+    # get the logger
+    logger = logging.getLogger(name)
+    # set the log level
+    logger.setLevel(_logging["level"])
+    
+    if _logging["handler"] not in logger.handlers:
+        logger.addHandler(_logging["handler"])
     
     return logger
 
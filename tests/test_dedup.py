@@ -0,0 +1,55 @@
+from finance_gpt.dedup import NearDuplicateIndex
+
+def cluster(index: NearDuplicateIndex, url: str, title: str, ticker: str):
+    """Returns the representative the headline is matched to, adds it as a new one otherwise."""
+    entry, signature = index.find(title, ticker)
+    if entry is None:
+        entry = index.add(url, ticker, signature)
+    return entry
+
+def test_reworded_headline_is_clustered():
+    index = NearDuplicateIndex()
+    first = cluster(index, "u1", "Apple shares rise after strong iPhone sales", "AAPL")
+    second = cluster(index, "u2", "Apple stock climbs after strong iPhone sales", "AAPL")
+    
+    assert second is first
+
+def test_syndicated_copy_is_clustered():
+    index = NearDuplicateIndex()
+    first = cluster(index, "u1", "Nvidia stock jumps as analysts raise price targets", "NVDA")
+    second = cluster(index, "u2", "NVIDIA Shares Surge As Analysts Raise Price Targets - Reuters", "NVDA")
+    
+    assert second is first
+
+def test_unrelated_headlines_of_the_same_ticker_are_not_clustered():
+    index = NearDuplicateIndex()
+    titles = [
+        "Apple shares rise after strong iPhone sales",
+        "Apple shares fall after weak iPhone sales",
+        "Apple faces EU antitrust fine over App Store rules",
+        "Apple to open new campus in Austin",
+    ]
+    entries = [cluster(index, f"u{i}", title, "AAPL") for i, title in enumerate(titles)]
+    
+    assert len({id(entry) for entry in entries}) == len(titles)
+
+def test_same_headline_of_another_ticker_is_not_clustered():
+    index = NearDuplicateIndex()
+    first = cluster(index, "u1", "Big tech rallies after strong earnings", "AAPL")
+    second = cluster(index, "u1", "Big tech rallies after strong earnings", "MSFT")
+    
+    assert second is not first
+
+def test_negation_and_polarity_flips_are_not_clustered():
+    pairs = [
+        ("FDA approves Moderna flu vaccine application", "FDA rejects Moderna flu vaccine application"),
+        ("Amazon stock not expected to rise after FTC lawsuit ruling", "Amazon stock expected to rise after FTC lawsuit ruling"),
+        ("Tesla beats quarterly delivery forecasts", "Tesla misses quarterly delivery forecasts"),
+        ("Nike raises full-year guidance", "Nike cuts full-year guidance"),
+    ]
+    for first_title, second_title in pairs:
+        index = NearDuplicateIndex()
+        first = cluster(index, "u1", first_title, "AAPL")
+        second = cluster(index, "u2", second_title, "AAPL")
+        
+        assert second is not first, (first_title, second_title)
@@ -0,0 +1,54 @@
+from finance_gpt.gpt import GPT
+from finance_gpt.news_api import NewsArticle, GPTSentiment
+
+def news_articles(tickers: list[str]) -> list[NewsArticle]:
+    news_dict = {
+        "news_url": "https://news.example.com/1",
+        "title": "Big tech rallies after strong earnings",
+        "text": "Text.",
+        "source_name": "Reuters",
+        "date": "Fri, 12 Jan 2024 10:42:15 -0500",
+        "sentiment": "Positive",
+        "type": "Article",
+        "tickers": tickers,
+    }
+    return [NewsArticle.from_dict(news_dict, ticker) for ticker in tickers]
+
+def apply(content: str, tickers: tuple[str] = ("AAPL", "MSFT")) -> tuple[list[NewsArticle], list[NewsArticle]]:
+    gpt = GPT(api_key="test")
+    articles = news_articles(list(tickers))
+    missing = gpt._apply_multi_response(articles, content)
+    return articles, missing
+
+def test_well_formed_lines():
+    articles, missing = apply("AAPL | YES | Strong iPhone sales.\nMSFT | NO | Cloud growth slows.")
+    
+    assert missing == []
+    assert [article.gpt_sentiment for article in articles] == [GPTSentiment.YES, GPTSentiment.NO]
+    assert [article.gpt_verdict for article in articles] == ["Strong iPhone sales.", "Cloud growth slows."]
+
+def test_lowercase_answers():
+    articles, missing = apply("aapl | yes | Strong iPhone sales.\nMSFT | unknown | Unclear.")
+    
+    assert missing == []
+    assert [article.gpt_sentiment for article in articles] == [GPTSentiment.YES, GPTSentiment.UNKNOWN]
+
+def test_numbered_lines():
+    articles, missing = apply("1. AAPL | YES | Strong iPhone sales.\n2) MSFT | NO | Cloud growth slows.")
+    
+    assert missing == []
+    assert [article.gpt_sentiment for article in articles] == [GPTSentiment.YES, GPTSentiment.NO]
+
+def test_bolded_and_bulleted_lines():
+    articles, missing = apply("- **AAPL** | **YES** | Strong iPhone sales.\n* MSFT | NO | Cloud growth slows.")
+    
+    assert missing == []
+    assert [article.gpt_sentiment for article in articles] == [GPTSentiment.YES, GPTSentiment.NO]
+    assert articles[0].gpt_verdict == "Strong iPhone sales."
+
+def test_missing_tickers_are_returned():
+    articles, missing = apply("Here are the answers:\nAAPL | YES | Strong iPhone sales.\nGOOGL | NO | Not asked for.", tickers=["AAPL", "MSFT", "AMZN"])
+    
+    assert [article.company.name for article in missing] == ["MSFT", "AMZN"]
+    assert articles[0].gpt_sentiment == GPTSentiment.YES
+    assert articles[1].gpt_sentiment is None
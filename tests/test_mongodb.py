@@ -0,0 +1,53 @@
+import datetime
+import pytest
+from bson import ObjectId
+from finance_gpt.fake_services import FakeMongoClient
+from finance_gpt.mongodb import MongoDBWrapper, MissingIndexError
+
+def store_copies(client: FakeMongoClient) -> None:
+    # an article stored once per ticker chunk that returned it, as older versions did
+    collection = client["news"]["stocknewsapi"]
+    collection.replace_one({"_id": ObjectId("000000000000000000000001")}, {"news_url": "https://news/a", "gpt_sentiment": {"AAPL": 1}}, upsert=True)
+    collection.replace_one({"_id": ObjectId("000000000000000000000002")}, {"news_url": "https://news/a", "gpt_sentiment": {"MSFT": -1}}, upsert=True)
+    collection.replace_one({"_id": ObjectId("000000000000000000000003")}, {"news_url": "https://news/b", "gpt_sentiment": {"AAPL": 0}}, upsert=True)
+
+def test_missing_unique_index_is_a_startup_error():
+    client = FakeMongoClient()
+    store_copies(client)
+    
+    with pytest.raises(MissingIndexError):
+        MongoDBWrapper(client=client)
+
+def test_duplicate_urls_are_merged_into_the_first_copy():
+    client = FakeMongoClient()
+    store_copies(client)
+    db = MongoDBWrapper(config={"ensure_indexes": False}, client=client)
+    
+    assert db.remove_duplicate_urls() == 1
+    db.ensure_indexes()
+    
+    articles = {entry["news_url"]: entry for entry in client["news"]["stocknewsapi"].find()}
+    assert len(articles) == 2
+    assert articles["https://news/a"]["_id"] == ObjectId("000000000000000000000001")
+    assert articles["https://news/a"]["gpt_sentiment"] == {"AAPL": 1, "MSFT": -1}
+    assert "news_url_unique" in client["news"]["stocknewsapi"].index_information()
+
+def test_sentiment_scores_only_cover_the_time_frame_and_known_tickers():
+    client = FakeMongoClient()
+    db = MongoDBWrapper(client=client)
+    until = datetime.datetime(2024, 1, 12, 15, tzinfo=datetime.timezone.utc)
+    collection = client["news"]["stocknewsapi"]
+    collection.replace_one({"news_url": "https://news/a"}, {"published_at": until - datetime.timedelta(hours=2), "gpt_sentiment": {"AAPL": 1, "NOTATICKER": 1}}, upsert=True)
+    collection.replace_one({"news_url": "https://news/b"}, {"published_at": until - datetime.timedelta(hours=1), "gpt_sentiment": {"AAPL": -1, "MSFT": 1}}, upsert=True)
+    # before and after the time frame
+    collection.replace_one({"news_url": "https://news/c"}, {"published_at": until - datetime.timedelta(hours=30), "gpt_sentiment": {"AAPL": 1}}, upsert=True)
+    collection.replace_one({"news_url": "https://news/d"}, {"published_at": until, "gpt_sentiment": {"AAPL": 1}}, upsert=True)
+    
+    scores = db.get_sentiment_scores(datetime.timedelta(hours=24), until=until)
+    
+    assert list(scores.index) == ["AAPL", "MSFT"]
+    assert scores.loc["AAPL", "score"] == 0
+    assert scores.loc["AAPL", "count"] == 2
+    
+    records = db.get_sentiment_records(datetime.timedelta(hours=24), until=until)
+    assert sorted(records["ticker"]) == ["AAPL", "AAPL", "MSFT"]
@@ -0,0 +1,49 @@
+from finance_gpt.news_api import NewsCursor, parse_news_date
+from finance_gpt.news_sentimenter import NewsSentimenter
+
+def news_dict(url: str, minute: int) -> dict:
+    return {"news_url": url, "date": f"Fri, 12 Jan 2024 10:{minute:02d}:00 -0500"}
+
+def test_cursor_holds_at_oldest_failed_article():
+    news = [news_dict("u1", 1), news_dict("u2", 2), news_dict("u3", 3)]
+    cursor = NewsCursor.advance(None, news, failed=[news_dict("u2", 2)])
+    
+    assert cursor.date == parse_news_date(news_dict("u1", 1)["date"])
+    assert cursor.attempts == {"u2": 1}
+
+def test_cursor_moves_past_an_article_that_always_fails():
+    news = [news_dict("u1", 1), news_dict("u2", 2), news_dict("u3", 3)]
+    failed = [news_dict("u2", 2)]
+    
+    cursor = NewsCursor.advance(None, news, failed=failed, max_attempts=3)
+    cursor = NewsCursor.advance(cursor, news[1:], failed=failed, max_attempts=3)
+    assert cursor.date == parse_news_date(news_dict("u1", 1)["date"])
+    assert cursor.attempts == {"u2": 2}
+    
+    cursor = NewsCursor.advance(cursor, news[1:], failed=failed, max_attempts=3)
+    assert cursor.date == parse_news_date(news_dict("u3", 3)["date"])
+    assert cursor.attempts == {}
+
+def test_attempts_are_reset_once_the_article_succeeds():
+    news = [news_dict("u1", 1), news_dict("u2", 2)]
+    cursor = NewsCursor.advance(None, news, failed=[news_dict("u2", 2)])
+    cursor = NewsCursor.advance(cursor, news[1:], failed=[])
+    
+    assert cursor.date == parse_news_date(news_dict("u2", 2)["date"])
+    assert cursor.attempts == {}
+
+def test_prefetch_cursor_stays_behind_articles_in_flight():
+    cursor = NewsCursor.advance(None, [news_dict("u0", 0)], failed=[])
+    cursor.attempts = {"u9": 1}
+    news = [news_dict("u1", 1), news_dict("u2", 2), news_dict("u3", 3)]
+    
+    provisional = NewsSentimenter._provisional_cursor(cursor, news, in_flight=[news_dict("u3", 3), news_dict("u2", 2)])
+    
+    assert provisional.date == parse_news_date(news_dict("u1", 1)["date"])
+    assert provisional.urls == ["u1"]
+    # the persisted cursor is advanced after the cycle, with its attempts
+    assert cursor.date == parse_news_date(news_dict("u0", 0)["date"])
+    assert cursor.attempts == {"u9": 1}
+    
+    provisional = NewsSentimenter._provisional_cursor(cursor, news, in_flight=[])
+    assert provisional.date == parse_news_date(news_dict("u3", 3)["date"])
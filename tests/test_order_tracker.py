@@ -0,0 +1,102 @@
+import time
+import uuid
+import threading
+import pytest
+from alpaca.trading.models import Order
+from alpaca.trading.stream import TradingStream
+from finance_gpt.fake_services import FakeTradeUpdatesServer, order_payload
+from finance_gpt.order_tracker import OrderTracker
+
+ORDER_ID = str(uuid.uuid4())
+
+class StubTradingClient():
+    """Answers polls with the stored orders, on_poll runs before every answer."""
+    
+    def __init__(self) -> None:
+        self.orders = {}
+        self.polls = []
+        self.on_poll = None
+        
+    def get_order_by_id(self, order_id: str) -> Order:
+        self.polls.append(order_id)
+        if self.on_poll is not None:
+            self.on_poll(order_id)
+        return Order(**self.orders[order_id])
+
+@pytest.fixture
+def server():
+    server = FakeTradeUpdatesServer()
+    server.start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def client():
+    client = StubTradingClient()
+    client.orders[ORDER_ID] = order_payload(ORDER_ID, "AAPL", 10, "buy", status="new")
+    return client
+
+@pytest.fixture
+def start_tracker(server, client):
+    trackers = []
+    def start(poll_interval: float) -> OrderTracker:
+        tracker = OrderTracker(client, TradingStream("key", "secret", paper=True, url_override=server.url), poll_interval=poll_interval)
+        tracker.start()
+        trackers.append(tracker)
+        assert server.wait_for_listeners(1)
+        return tracker
+    yield start
+    
+    # the stream only notices a stop after its 5 second receive timeout, a closed connection ends it at once
+    server.stop()
+    for tracker in trackers:
+        tracker.stop()
+
+def test_fill_over_the_stream_wakes_the_waiter(server, client, start_tracker):
+    tracker = start_tracker(poll_interval=60)
+    fill = threading.Timer(0.2, server.publish, args=("fill", order_payload(ORDER_ID, "AAPL", 10, "buy", status="filled", filled_qty=10)))
+    fill.start()
+    
+    start = time.monotonic()
+    states = tracker.wait([ORDER_ID], timeout=30)
+    
+    assert states[ORDER_ID].status == "filled"
+    assert states[ORDER_ID].filled_qty == 10
+    assert time.monotonic() - start < 5
+    assert client.polls == []
+
+def test_polling_takes_over_while_the_stream_is_silent(server, client, start_tracker):
+    client.orders[ORDER_ID] = order_payload(ORDER_ID, "AAPL", 10, "buy", status="filled", filled_qty=10)
+    tracker = start_tracker(poll_interval=0.1)
+    states = tracker.wait([ORDER_ID], timeout=10)
+    
+    assert states[ORDER_ID].status == "filled"
+    assert client.polls == [ORDER_ID]
+
+def test_stale_poll_does_not_overwrite_a_final_state(server, client, start_tracker):
+    tracker = start_tracker(poll_interval=0.1)
+    
+    # the fill arrives over the stream while the poll is on its way, the poll answers with the old state
+    def fill_during_poll(order_id):
+        server.publish("fill", order_payload(order_id, "AAPL", 10, "buy", status="filled", filled_qty=10))
+        deadline = time.monotonic() + 10
+        while (tracker.get(order_id) is None or not tracker.get(order_id).is_final) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    client.on_poll = fill_during_poll
+    
+    states = tracker.wait([ORDER_ID], timeout=10)
+    
+    assert client.polls == [ORDER_ID]
+    assert states[ORDER_ID].status == "filled"
+    assert tracker.get(ORDER_ID).status == "filled"
+
+def test_wait_returns_the_latest_state_after_the_timeout(server, client, start_tracker):
+    tracker = start_tracker(poll_interval=0.05)
+    start = time.monotonic()
+    unknown = str(uuid.uuid4())
+    states = tracker.wait([ORDER_ID, unknown], timeout=0.3)
+    
+    assert 0.3 <= time.monotonic() - start < 5
+    assert states[ORDER_ID].status == "new"
+    # orders without any state are left out
+    assert unknown not in states
@@ -0,0 +1,83 @@
+from alpaca.trading.enums import OrderSide
+from alpaca.trading.client import TradingClient
+from alpaca.data.historical import StockHistoricalDataClient
+from finance_gpt.fake_services import FakeAlpaca
+from finance_gpt.portfolio_manager import PortfolioManager
+from finance_gpt.structures import Portfolio, Position, PositionSide, Symbol
+from finance_gpt.rebalance import RebalanceAction, PlannedOrder, plan_rebalance
+
+def long(symbol: Symbol, amount: float) -> Position:
+    return Position(symbol=symbol, amount=amount, side=PositionSide.LONG)
+
+def short(symbol: Symbol, amount: float) -> Position:
+    return Position(symbol=symbol, amount=amount, side=PositionSide.SHORT)
+
+def test_diff_sorts_positions_into_their_changes():
+    old = Portfolio([long(Symbol.AAPL, 10), long(Symbol.MSFT, 5), short(Symbol.TSLA, 3), long(Symbol.NVDA, 2)])
+    new = Portfolio([long(Symbol.AAPL, 12), short(Symbol.MSFT, 5), long(Symbol.NVDA, 2), long(Symbol.AMZN, 4)])
+    
+    diff = old.diff(new)
+    
+    assert diff.added == [long(Symbol.AMZN, 4)]
+    assert diff.removed == [short(Symbol.TSLA, 3)]
+    assert diff.resized == [(long(Symbol.AAPL, 10), long(Symbol.AAPL, 12))]
+    assert diff.flipped == [(long(Symbol.MSFT, 5), short(Symbol.MSFT, 5))]
+    assert diff.unchanged == [long(Symbol.NVDA, 2)]
+    assert not diff.is_empty
+    assert old.diff(old).is_empty
+
+def test_plan_trades_only_the_difference():
+    old = Portfolio([long(Symbol.AAPL, 10), long(Symbol.MSFT, 5), short(Symbol.TSLA, 3), short(Symbol.NVDA, 6)])
+    new = Portfolio([long(Symbol.AAPL, 12), short(Symbol.MSFT, 5), short(Symbol.NVDA, 2), long(Symbol.AMZN, 4)])
+    
+    orders, unchanged = plan_rebalance(old.diff(new))
+    
+    assert orders == [
+        PlannedOrder(Symbol.TSLA, RebalanceAction.CLOSE, OrderSide.BUY, 3),
+        PlannedOrder(Symbol.AMZN, RebalanceAction.OPEN, OrderSide.BUY, 4),
+        PlannedOrder(Symbol.MSFT, RebalanceAction.FLIP_CLOSE, OrderSide.SELL, 5),
+        PlannedOrder(Symbol.MSFT, RebalanceAction.FLIP_OPEN, OrderSide.SELL, 5),
+        PlannedOrder(Symbol.AAPL, RebalanceAction.INCREASE, OrderSide.BUY, 2),
+        PlannedOrder(Symbol.NVDA, RebalanceAction.REDUCE, OrderSide.BUY, 4),
+    ]
+    assert unchanged == []
+
+def test_tiny_resizes_are_skipped_by_default():
+    old = Portfolio([long(Symbol.AAPL, 10.0), long(Symbol.MSFT, 5.0)])
+    new = Portfolio([long(Symbol.AAPL, 10.001), long(Symbol.MSFT, 6.0)])
+    prices = {Symbol.AAPL: 190.0, Symbol.MSFT: 400.0}
+    
+    orders, unchanged = plan_rebalance(old.diff(new), prices=prices)
+    
+    assert [order.symbol for order in orders] == [Symbol.MSFT]
+    assert unchanged == [Symbol.AAPL]
+    
+    # a floor of 0 trades every resize
+    orders, unchanged = plan_rebalance(old.diff(new), prices=prices, min_trade_value=0.0)
+    assert [order.symbol for order in orders] == [Symbol.AAPL, Symbol.MSFT]
+
+class LockedPositionsAlpaca(FakeAlpaca):
+    """Refuses to close positions."""
+    
+    def close_position(self, query: dict, body: dict, symbol: str) -> tuple[int, dict]:
+        return 403, {"code": 40310000, "message": f"position of {symbol} is locked"}
+
+def test_failed_flip_close_suppresses_its_open(tmp_path):
+    alpaca = LockedPositionsAlpaca({"AAPL": 190.0, "MSFT": 400.0}, positions={"MSFT": 5}, fill_delay=0.01)
+    alpaca.start()
+    try:
+        pm = PortfolioManager(
+            config={"trade_stream": False, "fill_poll_interval": 0.05, "fill_timeout": 10, "asset_cache_path": str(tmp_path / "assets.json")},
+            trading_client=TradingClient(api_key="key", secret_key="secret", paper=True, url_override=alpaca.url),
+            data_client=StockHistoricalDataClient(api_key="key", secret_key="secret", url_override=alpaca.url),
+        )
+        report = pm.update(Portfolio([short(Symbol.MSFT, 5), long(Symbol.AAPL, 2)]))
+        pm.order_tracker.stop()
+    finally:
+        alpaca.stop()
+        
+    errors = {result.order.action: result.error for result in report.failed}
+    assert set(errors) == {RebalanceAction.FLIP_CLOSE, RebalanceAction.FLIP_OPEN}
+    assert "did not fill" in errors[RebalanceAction.FLIP_OPEN]
+    # the open of another symbol still goes through, the old side of the flip is kept
+    assert alpaca.positions == {"MSFT": 5, "AAPL": 2}
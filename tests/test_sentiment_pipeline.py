@@ -0,0 +1,72 @@
+import asyncio
+from finance_gpt.news_api import GPTSentiment
+from finance_gpt.sentiment_pipeline import SentimentPipeline
+
+def news_dict(i: int, ticker: str = "AAPL") -> dict:
+    return {
+        "news_url": f"https://news.example.com/{i}",
+        "title": f"Headline number {i}",
+        "text": "Text.",
+        "source_name": "Reuters",
+        "date": "Fri, 12 Jan 2024 10:42:15 -0500",
+        "sentiment": "Positive",
+        "type": "Article",
+        "tickers": [ticker],
+    }
+
+class StubGPT():
+    
+    def __init__(self) -> None:
+        self.requests = 0
+        
+    async def aget_sentiment(self, news_article, term: str) -> None:
+        self.requests += 1
+        await asyncio.sleep(0.01)
+        news_article.gpt_sentiment = GPTSentiment.YES
+        news_article.gpt_verdict = "Good."
+
+class FlakyDB():
+    """Fails the first write."""
+    
+    def __init__(self) -> None:
+        self.writes = 0
+        self.stored = []
+        
+    def add_news_articles(self, news_articles: list[dict]) -> int:
+        self.writes += 1
+        if self.writes == 1:
+            raise ConnectionError("connection reset")
+        self.stored += [news_article["news_url"] for news_article in news_articles]
+        return len(news_articles)
+
+def test_failed_store_is_returned_as_failed():
+    gpt, db = StubGPT(), FlakyDB()
+    pipeline = SentimentPipeline(gpt, db, ["AAPL"], max_concurrency=2)
+    news = [news_dict(i) for i in range(10)]
+    
+    failed = asyncio.run(pipeline.run(news))
+    
+    assert len(failed) == 1
+    assert len(db.stored) == 9
+    assert failed[0]["news_url"] not in db.stored
+    assert gpt.requests == 10
+
+def test_no_requests_are_left_running_on_cancellation():
+    gpt, db = StubGPT(), FlakyDB()
+    db.writes = 1
+    pipeline = SentimentPipeline(gpt, db, ["AAPL"], max_concurrency=1)
+    
+    async def run_and_cancel():
+        task = asyncio.create_task(pipeline.run([news_dict(i) for i in range(10)]))
+        await asyncio.sleep(0.025)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        requests = gpt.requests
+        await asyncio.sleep(0.1)
+        return requests
+        
+    requests = asyncio.run(run_and_cancel())
+    assert gpt.requests == requests < 10
@@ -0,0 +1,38 @@
+import mmap
+import numpy as np
+import pandas as pd
+from finance_gpt import sweep
+
+def is_memory_mapped(array: np.ndarray) -> bool:
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+def column_array(column: pd.Series) -> np.ndarray:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy()
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        return column.array._ndarray
+    return column.to_numpy()
+
+def test_worker_data_stays_memory_mapped(tmp_path):
+    days = pd.bdate_range("2024-01-02", "2024-01-31")
+    records = pd.DataFrame({
+        "ticker": ["AAPL", "MSFT", "NVDA", "AAPL", "UNKNOWN"] * 20,
+        "timestamp": pd.date_range("2024-01-01", periods=100, freq="7h", tz="UTC"),
+        "sentiment": [1, -1, 0, 1, 1] * 20,
+        "source": ["a", "b"] * 50,
+    })
+    prices = pd.DataFrame(100.0, index=days, columns=["AAPL", "MSFT", "NVDA"])
+    sweep.save_arrays(records, prices, str(tmp_path))
+    
+    sweep._init_worker(str(tmp_path))
+    result = sweep._evaluate({"amount_of_stocks": 2, "threshold": 0.0}, 100000.0)
+    
+    assert result["days"] == len(days)
+    worker_records = sweep._worker_data["records"]
+    for name in worker_records.columns:
+        assert is_memory_mapped(column_array(worker_records[name])), name
+    assert is_memory_mapped(sweep._worker_data["prices"].to_numpy())